@@ -7,6 +7,60 @@ COMMAND_PREFIX = "!"
 # filepath for saving / loading info storage (in case server dies)
 DEFAULT_BACKUP_FOLDER_NAME = "backups"
 
+# "json" (one readable file) or "jsonl.gz" (compressed, streamed in on restore, customers' inventories unpacked lazily)
+# convert an existing backup with: python backups.py <backup file> <format>
+BACKUP_FORMAT = "json"
+
+# backups are thinned out as they age: all are kept for keep_all_hours, then the newest of each hour until
+# keep_hourly_days, then the newest of each day until keep_daily_days (None keeps one a day forever)
+BACKUP_RETENTION = {"keep_all_hours": 24, "keep_hourly_days": 7, "keep_daily_days": None}
+
+# where the shop's state lives between restarts: "json" (backup files plus a journal) or "sqlite" (a database in the
+# backup folder, updated in one transaction per change; set up from the JSON backups the first time it's used)
+STORAGE_BACKEND = "json"
+SQLITE_FILE_NAME = "shop.sqlite3"
+
+# every change between backups is appended to this journal (inside the backup folder) and replayed after a crash
+JOURNAL_FILE_NAME = "journal.jsonl"
+# wait for each journal entry to reach the disk itself (survives power loss as well as crashes, but slower)
+JOURNAL_FSYNC = False
+
+# shop displays are refreshed at most once every this many seconds, no matter how many purchases happen
+DISPLAY_REFRESH_SECONDS = 5
+
+# check the items/ and customers/ folders for new or edited files every this many seconds (None to only sync on command)
+SYNC_POLL_SECONDS = None
+
+# how long the bot waits for an answer to each of its questions before giving up on the command (say 'cancel' to stop sooner)
+PROMPT_TIMEOUT_SECONDS = 120
+
+# how long a command waits for another command working on the same customer or item before giving up
+TRANSACTION_TIMEOUT_SECONDS = 10
+
+# command and shop timings are written here every METRICS_DUMP_SECONDS for a metrics scraper to pick up (None to not write them)
+METRICS_FILE_NAME = "metrics.prom"
+METRICS_DUMP_SECONDS = 60
+
+# every server gets its own shop, loaded the first time it's used there and backed up and unloaded again after this many
+# seconds without a command (None to keep them all loaded)
+SHOP_IDLE_SECONDS = 3600
+
+# the server the bot ran in before shops were per server; its shop keeps using the backup folder, items/ and customers/
+# as they are, every other server's lives in a subfolder of each named after the server's ID (left as None, a bot that's only in one
+# server gives that server the old shop)
+LEGACY_GUILD_ID = None
+
+# settings for particular servers, by server ID, e.g. {123456789012345678: {"prefix": "?", "admin_roles": ["Producer"]}}
+# can set: prefix, backup_folder, customer_roles, admin_roles, spectator_roles, items_folder, customers_folder, mentions
+# anything not set comes from the values in this file
+GUILD_SETTINGS = {}
+
+# register buy, use and give_away as slash commands (with autocomplete) with discord every time the bot starts
+SYNC_SLASH_COMMANDS = True
+
+# number of shards to split the bot's servers between (None lets discord decide, only matters once it's in a lot of servers)
+SHARD_COUNT = None
+
 CUSTOMER_ROLES = ['Castaways', "Guinea Pig"]
 ADMIN_ROLES = ['Host', "Code and Cyphers"]
 SPECTATOR_ROLES = ['Spectators']
\ No newline at end of file
@@ -0,0 +1,285 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+MANIFEST_FILE_NAME = "manifest.json"
+# "json" is one pretty-printed document, "jsonl.gz" is gzipped line-delimited records that can be streamed in
+BACKUP_FORMATS = ("json", "jsonl.gz")
+STREAM_FORMAT_VERSION = 2 # 2 added shared item definitions
+
+class BackupManifest:
+    # index of the backups in a folder (when, how big, checksum, what's in them), so restoring doesn't mean listing and statting the folder
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_FILE_NAME)
+        self.entries = {} # file name -> entry, oldest first
+        if os.path.exists(self.path):
+            self.load()
+        elif os.path.exists(folder):
+            self.rebuild()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+        self.entries = {entry['file']: entry for entry in data.get('backups', [])}
+
+    def save(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'backups': list(self.entries.values())}, file, indent=4)
+        os.replace(temp_path, self.path)
+
+    def rebuild(self):
+        # one-time pass over backups made before there was a manifest
+        backup_files = [f for f in os.listdir(self.folder) if is_backup_file(f)]
+        backup_files.sort(key=lambda f: os.path.getctime(os.path.join(self.folder, f)))
+        self.entries = {}
+        for file_name in backup_files:
+            file_path = os.path.join(self.folder, file_name)
+            try:
+                data = read_backup(file_path)
+            except (OSError, EOFError, ValueError) as e:
+                print(f"Left {file_name} out of the backup manifest, it can't be read: {e}")
+                continue
+            self.entries[file_name] = make_entry(file_name, os.path.getctime(file_path), os.path.getsize(file_path), file_checksum(file_path), data)
+        self.save()
+        print(f"Built backup manifest for {len(self.entries)} existing backups in {self.folder}.")
+
+    def record(self, entry: dict):
+        self.entries.pop(entry['file'], None)
+        self.entries[entry['file']] = entry
+        self.save()
+
+    def replace(self, old_file_name: str, entry: dict):
+        # swaps an entry for another (e.g. the same backup converted to a different format) without changing its place in line
+        self.entries = {(entry['file'] if file_name == old_file_name else file_name): (entry if file_name == old_file_name else old_entry)
+                        for file_name, old_entry in self.entries.items()}
+        self.save()
+
+    def get(self, file_name: str) -> dict | None:
+        return self.entries.get(file_name)
+
+    def latest(self) -> dict | None:
+        return next(reversed(self.entries.values()), None)
+
+    def recent(self, n: int) -> list[dict]:
+        # newest first
+        return list(reversed(self.entries.values()))[:n]
+
+    def verify(self, entry: dict) -> bool:
+        file_path = os.path.join(self.folder, entry['file'])
+        return os.path.exists(file_path) and file_checksum(file_path) == entry['sha256']
+
+    def prune(self, retention: dict, now: float | None = None) -> list[str]:
+        # thins backups out as they age (see BACKUP_RETENTION in config), always keeping the newest
+        now = now or time.time()
+        keep_all = retention.get('keep_all_hours', 24) * 3600
+        keep_hourly = retention.get('keep_hourly_days', 7) * 86400
+        keep_daily = retention.get('keep_daily_days')
+        keep_daily = keep_daily * 86400 if keep_daily is not None else None
+        kept_buckets = set()
+        removed = []
+        for index, entry in enumerate(reversed(list(self.entries.values()))):
+            age = now - entry['timestamp']
+            if index == 0 or age < keep_all:
+                continue
+            if age < keep_hourly:
+                bucket = ('hour', int(entry['timestamp'] // 3600))
+            elif keep_daily is None or age < keep_daily:
+                bucket = ('day', int(entry['timestamp'] // 86400))
+            else:
+                bucket = None
+            if bucket is not None and bucket not in kept_buckets:
+                kept_buckets.add(bucket)
+                continue
+            removed.append(entry['file'])
+        for file_name in removed:
+            del self.entries[file_name]
+            file_path = os.path.join(self.folder, file_name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        if removed:
+            self.save()
+        return removed
+
+_manifests = {}
+
+def manifest_for(folder: str) -> BackupManifest:
+    # one manifest per folder, loaded on first use
+    if folder not in _manifests:
+        _manifests[folder] = BackupManifest(folder)
+    return _manifests[folder]
+
+def is_backup_file(file_name: str) -> bool:
+    return file_name.startswith("shop_backup") and backup_format(file_name) is not None
+
+def backup_format(file_name: str) -> str | None:
+    for format in sorted(BACKUP_FORMATS, key=len, reverse=True):
+        if file_name.endswith("." + format):
+            return format
+    return None
+
+def backup_file_name(now: datetime, format: str = "json") -> str:
+    # get timestamp for EST time zone (UTC-5)
+    timestamp = (now + timedelta(hours=-5)).strftime('%Y-%m-%d_%H:%M:%S')
+    return f'shop_backup_{timestamp}.{format}'
+
+class _HashingWriter:
+    # passes writes through to a file, keeping count of the bytes and their checksum on the way
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+def write_backup(backup_data: dict, backup_folder: str, file_name: str) -> dict:
+    # writes to a hidden temp file first and renames it into place, so a crash never leaves a half-written backup behind
+    # returns the backup's manifest entry
+    if not os.path.exists(backup_folder):
+        os.makedirs(backup_folder)
+    backup_file_path = os.path.join(backup_folder, file_name)
+    fd, temp_path = tempfile.mkstemp(dir=backup_folder, prefix='.' + file_name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            writer = _HashingWriter(file)
+            if backup_format(file_name) == "jsonl.gz":
+                _write_stream(backup_data, writer)
+            else:
+                writer.write(json.dumps(backup_data, indent=4).encode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, backup_file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return make_entry(file_name, time.time(), writer.size, writer.sha256.hexdigest(), backup_data)
+
+def _write_stream(backup_data: dict, writer: _HashingWriter):
+    # a header line, one line per item definition, one line per shop item, then two lines per customer: their details,
+    # then their inventory on its own so it can be left unparsed until it's needed
+    customers = backup_data.get('customers', [])
+    with gzip.GzipFile(fileobj=writer, mode='wb', mtime=0) as stream:
+        header = {'format': 'shop_backup',
+                  'version': STREAM_FORMAT_VERSION,
+                  'journal_seq': backup_data.get('journal_seq', 0),
+                  'definitions': len(backup_data.get('definitions', [])),
+                  'items': len(backup_data.get('inventory', [])),
+                  'customers': len(customers),
+                  'customer_ids': [customer['discordIDstr'] for customer in customers]
+                  }
+        stream.write((json.dumps(header, separators=(',', ':')) + "\n").encode())
+        for definition in backup_data.get('definitions', []):
+            stream.write((json.dumps({'type': 'definition', **definition}, separators=(',', ':')) + "\n").encode())
+        for item in backup_data.get('inventory', []):
+            stream.write((json.dumps({'type': 'item', **item}, separators=(',', ':')) + "\n").encode())
+        for customer in customers:
+            details = {key: value for key, value in customer.items() if key != 'inventory'}
+            stream.write((json.dumps({'type': 'customer', **details}, separators=(',', ':')) + "\n").encode())
+            stream.write((json.dumps(customer.get('inventory', []), separators=(',', ':')) + "\n").encode())
+
+def iter_backup(backup_file_path: str):
+    # yields ('header', {...}) first, then ('definition', {...}), ('item', {...}) and ('customer', {...}, raw_inventory) in file order;
+    # raw_inventory is the customer's inventory as unparsed JSON, or None if it's already inside the customer's dict.
+    # items and inventories in backups with definitions refer to them by index ({'item': index, 'quantity': n}), older
+    # backups have no definitions and write every item out in full
+    if backup_format(backup_file_path) != "jsonl.gz":
+        with open(backup_file_path, 'r') as file:
+            data = json.load(file)
+        yield ('header', {'journal_seq': data.get('journal_seq', 0)})
+        for definition in data.get('definitions', []):
+            yield ('definition', definition)
+        for item in data.get('inventory', []):
+            yield ('item', item)
+        for customer in data.get('customers', []):
+            yield ('customer', customer, None)
+        return
+    with gzip.open(backup_file_path, 'rt') as stream:
+        header = json.loads(next(stream))
+        if header.get('format') != 'shop_backup' or header.get('version', 0) > STREAM_FORMAT_VERSION:
+            raise ValueError(f"{backup_file_path} isn't a shop backup this version can read.")
+        yield ('header', header)
+        for line in stream:
+            record = json.loads(line)
+            record_type = record.pop('type')
+            if record_type == 'definition':
+                yield ('definition', record)
+            elif record_type == 'item':
+                yield ('item', record)
+            elif record_type == 'customer':
+                yield ('customer', record, next(stream))
+
+def read_backup(backup_file_path: str) -> dict:
+    # loads a backup of either format fully into plain data
+    backup_data = {'journal_seq': 0, 'definitions': [], 'inventory': [], 'customers': []}
+    for record in iter_backup(backup_file_path):
+        if record[0] == 'header':
+            backup_data['journal_seq'] = record[1].get('journal_seq', 0)
+        elif record[0] == 'definition':
+            backup_data['definitions'].append(record[1])
+        elif record[0] == 'item':
+            backup_data['inventory'].append(record[1])
+        else:
+            customer, raw_inventory = record[1], record[2]
+            if raw_inventory is not None:
+                customer['inventory'] = json.loads(raw_inventory)
+            backup_data['customers'].append(customer)
+    return backup_data
+
+def convert_backup(backup_file_path: str, format: str, remove_original: bool = True) -> str:
+    # rewrites a backup in another format under the same name, keeping its place in the folder's manifest
+    if format not in BACKUP_FORMATS:
+        raise ValueError(f"Unknown backup format '{format}', pick one of {', '.join(BACKUP_FORMATS)}.")
+    folder, file_name = os.path.split(backup_file_path)
+    old_format = backup_format(file_name)
+    if old_format == format:
+        return backup_file_path
+    new_file_name = file_name[:-len(old_format)] + format
+    entry = write_backup(read_backup(backup_file_path), folder, new_file_name)
+    manifest = manifest_for(folder)
+    old_entry = manifest.get(file_name)
+    if old_entry is not None:
+        entry['timestamp'] = old_entry['timestamp']
+        manifest.replace(file_name, entry)
+    if remove_original:
+        os.remove(backup_file_path)
+    return os.path.join(folder, new_file_name)
+
+def make_entry(file_name: str, timestamp: float, size: int, sha256: str, backup_data: dict) -> dict:
+    return {'file': file_name,
+            'timestamp': timestamp,
+            'size': size,
+            'sha256': sha256,
+            'customers': len(backup_data.get('customers', [])),
+            'items': len(backup_data.get('inventory', []))
+            }
+
+def file_checksum(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+if __name__ == "__main__":
+    # e.g. python backups.py backups/shop_backup_2025-02-01_12:00:00.json jsonl.gz
+    import sys
+    if len(sys.argv) != 3:
+        print(f"usage: python {sys.argv[0]} <backup file> <{'|'.join(BACKUP_FORMATS)}>")
+        sys.exit(1)
+    print(f"Converted to {convert_backup(sys.argv[1], sys.argv[2])}")
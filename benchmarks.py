@@ -0,0 +1,234 @@
+'''
+Times the shop's core operations on synthetic shops of a few sizes, reporting ops/sec, p50/p99 latency and peak memory,
+and writes the results as JSON so two commits' runs can be compared to catch regressions. Runs offline, no bot needed.
+
+usage: python benchmarks.py [--sizes tiny,small,large] [--out results.json] [--compare old_results.json] [--threshold 0.25]
+'''
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta, timezone
+
+if importlib.util.find_spec('config') is None: # no config.py outside a real deployment, the example one has everything the shop needs
+    import EXAMPLE_config
+    sys.modules['config'] = EXAMPLE_config
+
+# the shop only needs discord for the current time (backup names, summary timestamps); a clock that ticks a second per call
+# keeps runs repeatable and every backup file name different, and means discord.py doesn't have to be installed
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def __call__(self) -> datetime:
+        self.now += timedelta(seconds=1)
+        return self.now
+
+try:
+    import discord
+except ImportError:
+    discord = types.ModuleType('discord')
+    discord.utils = types.ModuleType('discord.utils')
+    sys.modules['discord'] = discord
+    sys.modules['discord.utils'] = discord.utils
+discord.utils.utcnow = FakeClock()
+
+import shop
+from storage import JsonStorage
+
+# name -> (customers, shop items, items in each customer's inventory)
+SIZES = {
+    'tiny': (10, 10, 2),
+    'small': (1000, 100, 10),
+    'large': (10000, 1000, 20),
+    'huge': (100000, 5000, 5),
+    'deep': (100, 5000, 1000), # few customers holding a lot each
+}
+DEFAULT_SIZES = ('tiny', 'small', 'large')
+MIN_RUNS = 5
+MAX_RUNS = 2000
+TIME_BUDGET = 1.0 # seconds spent timing each operation, past MIN_RUNS
+MIN_SLOWDOWN_US = 2.0 # p50 changes smaller than this are timer noise, whatever the percentage
+MEMORY_RUNS = 3 # runs traced with tracemalloc for peak memory, separately since tracing slows everything down
+DESCRIPTION = "A well-worn trinket, passed from castaway to castaway. Nobody remembers who found it first."
+
+def build_shop(customer_count: int, item_count: int, inventory_depth: int, folder: str, seed: int = 0) -> shop.Shop:
+    rng = random.Random(seed)
+    bench_shop = shop.Shop(prefix="!", storage=JsonStorage(folder))
+    for i in range(item_count):
+        bench_shop.inventory.add(shop.Item(name=f"item{i}", price=rng.randint(1, 15), quantity=10**9,
+                                           description=DESCRIPTION if i % 2 else None, description_on_use=f"You used item{i}."))
+    for i in range(customer_count):
+        customer = shop.Customer(realname=f"Customer {i}", discordIDstr=f"customer{i}", discordIDint=10**17 + i,
+                                 servernickname=f"Nick {i}" if i % 3 else None, wealth=10**9, tribe=f"tribe{i % 8}")
+        for j in rng.sample(range(item_count), min(inventory_depth, item_count)):
+            customer.inventory.add(shop.Item(name=f"item{j}", quantity=rng.randint(1, 3), description=DESCRIPTION if j % 2 else None,
+                                             description_on_use=f"You used item{j}."))
+        bench_shop.customers.add(customer)
+    return bench_shop
+
+def percentile(sorted_times: list[float], fraction: float) -> float:
+    return sorted_times[min(len(sorted_times) - 1, int(fraction * len(sorted_times)))]
+
+def measure(operation, setup = None) -> dict:
+    # runs operation(*setup()) until MIN_RUNS and TIME_BUDGET are both reached (or MAX_RUNS), timing only the operation
+    times = []
+    spent = 0.0
+    with contextlib.redirect_stdout(io.StringIO()): # backups print where they went
+        while len(times) < MAX_RUNS and (len(times) < MIN_RUNS or spent < TIME_BUDGET):
+            args = setup() if setup else ()
+            start = time.perf_counter()
+            operation(*args)
+            elapsed = time.perf_counter() - start
+            times.append(elapsed)
+            spent += elapsed
+        tracemalloc.start()
+        peak = 0
+        for _ in range(MEMORY_RUNS):
+            args = setup() if setup else ()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            operation(*args)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+    times.sort()
+    return {'runs': len(times),
+            'ops_per_sec': len(times) / spent if spent else None,
+            'p50_us': percentile(times, 0.5) * 1e6,
+            'p99_us': percentile(times, 0.99) * 1e6,
+            'peak_kb': peak / 1024}
+
+def benchmark_size(size: str, seed: int = 0) -> dict:
+    customer_count, item_count, inventory_depth = SIZES[size]
+    rng = random.Random(seed)
+    folder = tempfile.mkdtemp(prefix="shop_bench_")
+    tracemalloc.start()
+    start = time.perf_counter()
+    bench_shop = build_shop(customer_count, item_count, inventory_depth, folder, seed)
+    built = {'customers': customer_count, 'items': item_count, 'inventory_depth': inventory_depth,
+             'build_seconds': time.perf_counter() - start, 'memory_mb': tracemalloc.get_traced_memory()[0] / 2**20}
+    tracemalloc.stop()
+    customers = list(bench_shop.customers)
+    item_names = [f"item{i}" for i in range(item_count)]
+
+    def any_identifier():
+        customer = rng.choice(customers)
+        return (rng.choice([customer.discordIDstr, customer.realname, customer.discordIDint, customer.servernickname or customer.realname]),)
+
+    def owned_item():
+        # a customer and an item they're sure to have one of, put there outside the timing
+        customer = rng.choice(customers)
+        item_name = rng.choice(item_names)
+        customer.inventory.add(shop.Item(name=item_name, quantity=1, description=None, description_on_use="Used."))
+        return customer, item_name
+
+    def give_args():
+        customer, item_name = owned_item()
+        return customer, item_name, rng.choice(customers)
+
+    def cold():
+        shop.render_cache.clear()
+        return ()
+
+    results = {}
+    results['id_to_customer'] = measure(lambda identifier: shop.id_to_customer(bench_shop, identifier), any_identifier)
+    results['id_to_customer (missing)'] = measure(lambda: shop.id_to_customer(bench_shop, "nobody by this name"))
+    results['attemptBuy'] = measure(bench_shop.attemptBuy, lambda: (rng.choice(customers).discordIDstr, rng.choice(item_names)))
+    results['Customer.use'] = measure(lambda customer, item_name: customer.use(item_name), owned_item)
+    results['Customer.give'] = measure(lambda customer, item_name, recipient: customer.give(item_name, recipient), give_args)
+    bench_shop.inventory.suggest(""), bench_shop.customers.suggest("") # built on the first miss, which isn't what's being timed
+    results['suggest item'] = measure(lambda: bench_shop.inventory.suggest(f"itme{rng.randrange(item_count)}"))
+    results['suggest customer'] = measure(lambda: bench_shop.customers.suggest(f"Custmer {rng.randrange(customer_count)}"))
+    results['display (cold)'] = measure(bench_shop.display, cold)
+    results['display (cached)'] = measure(bench_shop.display)
+    results['print_customers (cold)'] = measure(lambda: bench_shop.print_customers(verbose=True), cold)
+    results['print_customers (cached)'] = measure(lambda: bench_shop.print_customers(verbose=True))
+    results['str_detailed_summary (cold)'] = measure(bench_shop.str_detailed_summary, cold)
+    results['backup'] = measure(lambda: bench_shop.backup(folder))
+    with contextlib.redirect_stdout(io.StringIO()):
+        backup_file_path, _ = bench_shop.backup(folder)
+    results['load_backup'] = measure(lambda: shop.Shop(prefix="!", storage=JsonStorage(folder)).load_backup(backup_file_path))
+    shutil.rmtree(folder, ignore_errors=True)
+    return {'shop': built, 'operations': results}
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes = DEFAULT_SIZES, seed: int = 0) -> dict:
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'time': datetime.now(timezone.utc).isoformat(), 'sizes': {}}
+    for size in sizes:
+        print(f"Benchmarking the {size} shop ({SIZES[size][0]} customers, {SIZES[size][1]} items, {SIZES[size][2]} deep)...")
+        report['sizes'][size] = benchmark_size(size, seed)
+        print_results(report['sizes'][size])
+    return report
+
+def print_results(results: dict):
+    built = results['shop']
+    print(f"  built in {built['build_seconds']:.2f}s, {built['memory_mb']:.2f}MB")
+    for name, result in results['operations'].items():
+        print(f"  {name:<28} {result['ops_per_sec']:>12,.0f} ops/s   p50 {result['p50_us']:>10,.1f}us   p99 {result['p99_us']:>10,.1f}us   "
+              f"peak {result['peak_kb']:>9,.1f}KB")
+
+def compare(old: dict, new: dict, threshold: float) -> list[str]:
+    # operations whose p50 got more than threshold (e.g. 0.25 = 25%) slower, as lines to print
+    regressions = []
+    for size, results in new['sizes'].items():
+        old_operations = old.get('sizes', {}).get(size, {}).get('operations', {})
+        for name, result in results['operations'].items():
+            if name not in old_operations:
+                continue
+            before, after = old_operations[name]['p50_us'], result['p50_us']
+            change = (after - before) / before if before else 0.0
+            line = f"{size:<6} {name:<28} p50 {before:>10,.1f}us -> {after:>10,.1f}us ({change:+.0%})"
+            print(line)
+            if change > threshold and after - before > MIN_SLOWDOWN_US:
+                regressions.append(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shop's core operations.")
+    parser.add_argument('--sizes', default=",".join(DEFAULT_SIZES), help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument('--out', default="benchmark_results.json", help="where to write the results")
+    parser.add_argument('--compare', help="results from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="how much slower (0.25 = 25%%) counts as a regression")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown size(s): {', '.join(unknown)}")
+
+    report = run(sizes, args.seed)
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            old = json.load(file)
+        print(f"Compared with {args.compare} (commit {old.get('commit')}):")
+        regressions = compare(old, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} operation(s) got more than {args.threshold:.0%} slower:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("No regressions.")
+
+if __name__ == "__main__":
+    main()
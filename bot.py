@@ -8,10 +8,11 @@ Made by: Kaiden McCready 2/2025
 
 import atexit
 import asyncio
-import json
 import signal
 import sys
+import time
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 from discord.utils import get
 
@@ -21,6 +22,18 @@ import os
 
 from config import *
 import shop
+import backups
+import members
+import metrics
+import outbox
+import importer
+import foldersync
+import guilds
+import names
+import sessions
+import paging
+import render
+import transactions
 
 # set working directory to script's parent directory
 script_dir = Path(__file__).resolve().parent
@@ -30,159 +43,434 @@ os.chdir(script_dir)
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents, help_command=None)
 
-print("Setting up shop...")
-
-todaysShop = shop.Shop(backup_folder=DEFAULT_BACKUP_FOLDER_NAME, from_backup=True, prefix = COMMAND_PREFIX)
+def guild_prefix(message) -> str:
+    return shops.settings(message.guild.id if message.guild else None).prefix
+
+class ShopBot(commands.AutoShardedBot):
+    async def get_context(self, origin, /, *, cls = None):
+        # slash commands (see buy, use and give_away) get a ShopContext too, not just messages
+        return await super().get_context(origin, cls=cls or ShopContext)
+
+    async def setup_hook(self):
+        if SYNC_SLASH_COMMANDS:
+            await self.tree.sync() # tells discord about the slash versions of commands, so it can offer them (and autocomplete)
+
+# sharded automatically once the bot is in enough servers (or into SHARD_COUNT shards), every server's shop is separate so
+# a shard only ever touches its own servers' shops
+bot = ShopBot(command_prefix=lambda bot, message: guild_prefix(message), shard_count=SHARD_COUNT, intents=intents, help_command=None)
+
+memberIndex = members.MemberIndex()
+
+# placeholders item files can use in their descriptions, and the role mentions they become (in the LEGACY_GUILD_ID server)
+ROLE_MENTIONS = {'@Host': "<@&1452373901341622343>", '@Shopkeeper': "<@&1476355335659982908>"}
+
+# every question the bot is waiting on an answer to (see sessions.py)
+prompts = sessions.SessionManager(PROMPT_TIMEOUT_SECONDS, ignore_prefix=guild_prefix)
+
+# everything the bot says goes out through here, a queue per channel (see outbox.py)
+outgoing = outbox.Outbox()
+
+class ShopContext(commands.Context):
+    # a command's replies are queued instead of sent on the spot, so several sends from one command can go out as one message.
+    # sends with a view/embed/file (and wait=True) wait for the message to be sent and return it, the rest return None right away
+    async def send(self, content = None, *, wait: bool = False, **kwargs):
+        return await outgoing.send(self.channel, content, key=self.message.id, wait=wait or bool(kwargs), sender=self.send_now, **kwargs)
+
+    async def send_now(self, content = None, **kwargs):
+        # straight to discord, what the outbox calls once it's this message's turn
+        return await super().send(content, **kwargs)
+
+    loaded_shop = None
+
+    async def load_shop(self) -> guilds.GuildShop:
+        # loads the shop of the server the command was used in if it isn't already, done before every command (see start_command_timer)
+        if self.guild is None:
+            raise commands.NoPrivateMessage("The shop is only open in servers.")
+        self.loaded_shop = await shops.get(self.guild.id)
+        return self.loaded_shop
+
+    @property
+    def guild_shop(self) -> guilds.GuildShop:
+        if self.guild is None:
+            raise commands.NoPrivateMessage("The shop is only open in servers.")
+        return self.loaded_shop
+
+    @property
+    def shop(self) -> shop.Shop:
+        return self.guild_shop.shop
+
+def has_shop_role(*kinds: str):
+    # like commands.has_any_role, with the roles taken from the server's settings; server admins can always use the command
+    def predicate(ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        if ctx.author.guild_permissions.administrator:
+            return True
+        roles = shops.settings(ctx.guild.id).roles(*kinds)
+        if any(role.name in roles for role in ctx.author.roles):
+            return True
+        raise commands.MissingAnyRole(roles)
+    return commands.check(predicate)
+
+SHOP_GREETING = "Hello, weary traveler, it's good to see you. Welcome to my shop! Here's what's for sale:"
 
 ##### Bot events #####
 
 @tasks.loop(minutes = 60) # Backup every hour
 async def automatic_backup():
-    todaysShop.backup() # Backup the shop's state
+    for guild_shop in shops: # only the loaded ones, the rest were backed up when they were unloaded
+        await guild_shop.shop.backup_async() # Backup the shop's state
 
     # only for testing: print backup report to a specific channel (replace channel ID with your own to enable)
     '''channel_id = 1473923988223823942 # Replace with channel ID to print report to
     channel = bot.get_channel(channel_id)
     if channel:
-        await channel.send(todaysShop.str_detailed_summary())
+        await channel.send((await shops.get(channel.guild.id)).shop.str_detailed_summary())
     '''
 
+@tasks.loop(minutes = 5) # look for shops to unload every 5 minutes
+async def evict_idle_shops():
+    evicted = shops.evict_idle(SHOP_IDLE_SECONDS)
+    if evicted:
+        print(f"Unloaded {evicted} idle shops, {len(shops)} still loaded.")
+
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user}.')
+    shops.adopt_legacy([guild.id for guild in bot.guilds])
+    memberIndex.rebuild(bot.get_all_members()) # on_ready also fires after reconnects, when members may have come and gone unseen
     if not automatic_backup.is_running():
         automatic_backup.start() # Start the loop when the bot is ready
+    if SHOP_IDLE_SECONDS and not evict_idle_shops.is_running():
+        evict_idle_shops.start()
+    if metricsDumper is not None:
+        metricsDumper.start()
+
+@bot.event
+async def on_member_join(member):
+    memberIndex.add(member)
+
+@bot.event
+async def on_member_update(before, after):
+    memberIndex.update(before, after)
+
+@bot.event
+async def on_user_update(before, after):
+    memberIndex.update(before, after)
+
+@bot.event
+async def on_member_remove(member):
+    memberIndex.remove(member)
 
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
-    await bot.process_commands(message)
+    if prompts.dispatch(message): # an answer to one of our questions, not a command
+        return
+    if message.author.bot:
+        return
+    await bot.invoke(await bot.get_context(message, cls=ShopContext))
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    # every command works on its server's shop, which mustn't be unloaded until the command is done with it
+    ctx.started = time.perf_counter()
+    if ctx.interaction is not None and not ctx.interaction.response.is_done():
+        # discord only waits 3 seconds for a slash command's first reply, which may be queued behind others or wait on the shop loading
+        await ctx.defer()
+    ctx.active_shop = await ctx.load_shop()
+    ctx.active_shop.active += 1
+
+def release_shop(ctx):
+    # once per command, from whichever of stop_command_timer and on_command_error gets there first
+    if getattr(ctx, 'active_shop', None) is not None:
+        ctx.active_shop.active -= 1
+        ctx.active_shop.last_used = time.monotonic()
+        ctx.active_shop = None
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    # runs whether or not the command raised, once its checks have passed (slash commands skip it when they raise)
+    release_shop(ctx)
+    if getattr(ctx, 'started', None) is not None:
+        metrics.registry.observe('command', ctx.command.qualified_name, time.perf_counter() - ctx.started, error=ctx.command_failed)
+
+def raised_error(error):
+    # what the command itself raised: prefix commands wrap it in a CommandInvokeError, the slash versions of hybrid commands
+    # in a HybridCommandError around app_commands' own CommandInvokeError
+    if isinstance(error, commands.HybridCommandError):
+        error = error.original
+    if isinstance(error, (commands.CommandInvokeError, app_commands.CommandInvokeError)):
+        return error.original
+    return error
 
 @bot.event
 async def on_command_error(ctx, error):
+        release_shop(ctx)
         if isinstance(error, commands.MissingAnyRole):
             await ctx.send("Who do you think you are? *(You don't have the required role to use this command.)*")
+        elif isinstance(error, commands.NoPrivateMessage):
+            await ctx.send("The shop is only open in servers, come find me there!")
+        elif isinstance(raised_error(error), (shop.AmbiguousCustomerError, transactions.TransactionConflict, sessions.SessionEnded, sessions.SessionBusy)):
+            await ctx.send(f"{raised_error(error)}")
         else:
             # if author has admin roles, print error to channel for debugging
-            if ctx.author is not None and (any(role.name in ADMIN_ROLES for role in ctx.author.roles) or ctx.author.guild_permissions.administrator):
+            if ctx.guild is not None and (any(role.name in shops.settings(ctx.guild.id).admin_roles for role in ctx.author.roles) or ctx.author.guild_permissions.administrator):
                 await ctx.send(f"{error}")
                 print(f"Error with {ctx.author}: {error}")
             else: print(f"potential problem with {ctx.author}... {error}")
 
-async def update_shop_displays():
-    for guild in bot.guilds:
-        for channel in guild.text_channels:
-            try:
-                async for message in channel.history(limit=30):
-                    if message.author == bot.user and message.content.startswith("Hello, weary traveler, it's good to see you. Welcome to my shop! Here's what's for sale:"):
-                        await message.edit(content="Hello, weary traveler, it's good to see you. Welcome to my shop! Here's what's for sale:\n" + todaysShop.display())
-            except discord.Forbidden:
-                pass
+def render_shop_display(guild_shop: guilds.GuildShop) -> str:
+    content = SHOP_GREETING + "\n" + guild_shop.shop.display()
+    if len(content) > render.MESSAGE_LIMIT: # a display is one message that gets edited, so it shows the first page only
+        content = guild_shop.shop.display_pages(header=SHOP_GREETING + "\n").page(0) + f"\n-# ...and more, use {guild_shop.shop.prefix}check_shop to see everything"
+    return content
+
+async def update_shop_displays(guild_shop: guilds.GuildShop, content: str | None = None):
+    shopDisplays = guild_shop.displays
+    if not shopDisplays.migrated:
+        await find_old_shop_displays(guild_shop)
+    content = content or render_shop_display(guild_shop)
+    async def edit(channel_id, message_id):
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            return
+        try:
+            # low priority, so a refresh never holds up a reply in the same channel
+            await outgoing.edit(channel, channel.get_partial_message(message_id), content, priority=outbox.BACKGROUND, wait=True)
+        except discord.NotFound: # display (or its channel) was deleted, stop tracking it
+            shopDisplays.remove(message_id)
+        except discord.Forbidden:
+            pass
+    with metrics.span('update_shop_displays'):
+        await asyncio.gather(*(edit(channel_id, message_id) for _, channel_id, message_id in shopDisplays)) # channels are queued separately, so edit them all at once
+
+async def find_old_shop_displays(guild_shop: guilds.GuildShop):
+    # one-time search for shop displays posted in the server before they were tracked in its registry
+    shopDisplays = guild_shop.displays
+    guild = bot.get_guild(guild_shop.guild_id)
+    for channel in (guild.text_channels if guild is not None else []):
+        try:
+            found = [message async for message in channel.history(limit=30) if message.author == bot.user and message.content.startswith(SHOP_GREETING)]
+        except discord.Forbidden:
+            continue
+        for message in reversed(found): # history is newest first, the registry is oldest first
+            shopDisplays.add(guild.id, channel.id, message.id, save=False)
+    shopDisplays.migrated = True
+    shopDisplays.save()
+    print(f"Found {len(shopDisplays)} shop displays to keep updated in server {guild_shop.guild_id}.")
+
+# every server's shop, each with its own backups, displays and settings (see guilds.py)
+shops = guilds.ShopDirectory(render_shop_display, update_shop_displays, resolve_many=memberIndex.resolve_many, legacy_mentions=ROLE_MENTIONS)
+
+metricsDumper = metrics.MetricsDumper(metrics.registry, METRICS_FILE_NAME, METRICS_DUMP_SECONDS) if METRICS_FILE_NAME and METRICS_DUMP_SECONDS else None
+metrics.registry.gauge('shops_loaded', "Servers whose shop is loaded", lambda: len(shops))
+metrics.registry.gauge('customers', "Customers in the loaded shops", lambda: sum(len(guild_shop.shop.customers) for guild_shop in shops))
+metrics.registry.gauge('outbox_queued', "Messages waiting to be sent or edited", lambda: len(outgoing))
+metrics.registry.gauge('prompts_open', "Commands waiting on someone's answer", lambda: len(prompts))
+metrics.registry.gauge('locks_held', "Customers and items a command is holding the lock on", lambda: sum(len(guild_shop.shop.locks) for guild_shop in shops))
 
 ##### Commands #####
 
-# castaway commands (beginning with prefix)
+def existing_customer(in_shop: shop.Shop):
+    # a reply parser, for prompts asking for one of in_shop's customers
+    def parse(reply: str) -> shop.Customer:
+        customer = shop.id_to_customer(in_shop, reply.strip('"')) # remove quotes if user included them
+        if customer is None:
+            raise ValueError(f"Could not find a customer with the ID '{reply}'." + (names.suggestion(in_shop.customers.suggest(reply)) or \
+                             " Make sure you entered it correctly and that they're registered as a customer."))
+        return customer
+    return parse
+
+# the questions asked about a new item, shared by the commands that make one
+ITEM_STEPS = (
+    sessions.Step('name', "Please enter the name of the item:", parse=lambda reply: reply.strip('"')),
+    sessions.Step('price', "Please enter the price of the item:", parse=sessions.whole_number),
+    sessions.Step('description', "Please enter a description for the item (or type 'none'):", parse=sessions.optional_text),
+    sessions.Step('description_on_use', "Please enter a description for the item when used (or type 'none'):", parse=sessions.optional_text),
+)
+NEW_ITEM_FLOW = sessions.Flow(*ITEM_STEPS)
+
+def customer_item_flow(in_shop: shop.Shop) -> sessions.Flow:
+    return sessions.Flow(
+        sessions.Step('customer', lambda answers: "Please pick from the following customers to add an item to their inventory:\n" + in_shop.print_customers(),
+                      parse=existing_customer(in_shop)),
+        *ITEM_STEPS)
+
+# autocomplete for the slash versions of commands; discord gives up on an answer after 3 seconds, so these only read what's
+# already in memory (the name indexes, see names.py) and offer nothing while the server's shop isn't loaded
+AUTOCOMPLETE_LIMIT = 25 # the most choices discord will show
+
+def choices(options) -> list[app_commands.Choice[str]]:
+    # (name shown, value filled in) pairs; discord won't take either over 100 characters
+    return [app_commands.Choice(name=name[:100], value=value[:100]) for name, value in options][:AUTOCOMPLETE_LIMIT]
+
+def interaction_shop(interaction: discord.Interaction) -> shop.Shop | None:
+    guild_shop = shops.peek(interaction.guild_id) if interaction.guild_id is not None else None
+    return guild_shop.shop if guild_shop is not None else None
+
+def interaction_customer(interaction: discord.Interaction) -> shop.Customer | None:
+    in_shop = interaction_shop(interaction)
+    if in_shop is None:
+        return None
+    try:
+        return shop.id_to_customer(in_shop, interaction.user.name)
+    except shop.AmbiguousCustomerError:
+        return None
+
+async def shop_items(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    in_shop = interaction_shop(interaction)
+    if in_shop is None:
+        return []
+    return choices((name, name) for name in in_shop.inventory.names.complete(current, AUTOCOMPLETE_LIMIT))
+
+async def owned_items(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    customer = interaction_customer(interaction)
+    if customer is None:
+        return []
+    return choices((name, name) for name in customer.inventory.names.complete(current, AUTOCOMPLETE_LIMIT))
+
+async def tribemates(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    # everyone else in the tribe, by real name and username (which is what gets filled in, it's the one that's never ambiguous)
+    customer = interaction_customer(interaction)
+    if customer is None:
+        return []
+    labels = {f"{other.realname} ({other.discordIDstr})": other.discordIDstr for other in interaction_shop(interaction).customers.tribe(customer.tribe)
+              if other is not customer}
+    return choices((label, labels[label]) for label in names.NameIndex(labels).complete(current, AUTOCOMPLETE_LIMIT))
+
+# castaway commands (beginning with prefix, buy, use and give_away also work as slash commands)
 @bot.command()
-@commands.check_any(commands.has_any_role(*CUSTOMER_ROLES, *ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('customer', 'admin')
 async def help(ctx):
     await ctx.send("Hello there, traveler! Here are the commands you can use to interact with my shop:" \
-                   + f"\n* {todaysShop.prefix}help - View this help message" \
-                   + f"\n* {todaysShop.prefix}check_shop - View items currently in stock" \
-                   + f"\n* {todaysShop.prefix}check_inventory - View your own inventory" \
-                   + f"\n* {todaysShop.prefix}buy \"<item name>\" - Buy an item from the shop" \
-                   + f"\n* {todaysShop.prefix}use \"<item name>\" - Use an item from your inventory" \
-                   + f"\n* {todaysShop.prefix}give_away \"<item name>\" - Give an item from your inventory to someone else on your tribe (you will be prompted to choose a recipient)")
+                   + f"\n* {ctx.shop.prefix}help - View this help message" \
+                   + f"\n* {ctx.shop.prefix}check_shop - View items currently in stock" \
+                   + f"\n* {ctx.shop.prefix}check_inventory - View your own inventory" \
+                   + f"\n* {ctx.shop.prefix}buy \"<item name>\" - Buy an item from the shop" \
+                   + f"\n* {ctx.shop.prefix}use \"<item name>\" - Use an item from your inventory" \
+                   + f"\n* {ctx.shop.prefix}give_away \"<item name>\" \"<recipient>\" - Give an item from your inventory to someone else on your tribe (you will be prompted to choose a recipient if you leave it out)" \
+                   + "\n-# buy, use and give_away also work as slash commands (/buy), which suggest names as you type")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*CUSTOMER_ROLES, *ADMIN_ROLES, *SPECTATOR_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('customer', 'admin', 'spectator')
 async def check_shop(ctx):
-    await ctx.send("Hello, weary traveler, it's good to see you. Welcome to my shop! Here's what's for sale:\n" + todaysShop.display())
+    if len(SHOP_GREETING + "\n" + ctx.shop.display()) > render.MESSAGE_LIMIT: # too much for one display, page through it instead
+        await paging.send_pages(ctx, ctx.shop.display_pages(header=SHOP_GREETING + "\n"), ctx.author.id)
+        return
+    message = await ctx.send(render_shop_display(ctx.guild_shop), wait=True)
+    ctx.guild_shop.displays.add(ctx.guild.id, ctx.channel.id, message.id)
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*CUSTOMER_ROLES, *ADMIN_ROLES, *SPECTATOR_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('customer', 'admin', 'spectator')
 async def check_inventory(ctx, user: str | None = None):
     if user is None or user.lower() == "myself":
         user = ctx.author.name
-    if (ctx.author.guild_permissions.administrator or any(role.name in ADMIN_ROLES for role in ctx.author.roles)) and user != ctx.author.name:
+    if (ctx.author.guild_permissions.administrator or any(role.name in ctx.guild_shop.settings.admin_roles for role in ctx.author.roles)) and user != ctx.author.name:
         await ctx.send(f"You look inside {user}'s pouch to find...\n")
-        customer = shop.id_to_customer(todaysShop, user)
+        customer = shop.id_to_customer(ctx.shop, user)
         if customer is None:
-            await ctx.send(f"That you could not find a customer with the ID '{user}'.")
+            await ctx.send(f"That you could not find a customer with the ID '{user}'." + names.suggestion(ctx.shop.customers.suggest(user)))
             return
         else:
-            await ctx.send(customer.check_inventory())
+            await paging.send_pages(ctx, customer.inventory_pages(), ctx.author.id)
     else:
         await ctx.send("You look inside your pouch to find...\n")
-        customer = shop.id_to_customer(todaysShop, ctx.author.name)
+        customer = shop.id_to_customer(ctx.shop, ctx.author.name)
         if customer is None:
             await ctx.send("That you aren't a customer yet!")
             return
         else:
-            await ctx.send(customer.check_inventory())
+            await paging.send_pages(ctx, customer.inventory_pages(), ctx.author.id)
 
-@bot.command()
-@commands.check_any(commands.has_any_role(*CUSTOMER_ROLES, *ADMIN_ROLES), commands.has_permissions(administrator=True))
+@bot.hybrid_command()
+@has_shop_role('customer', 'admin')
+@app_commands.describe(item_name="The item to buy")
+@app_commands.autocomplete(item_name=shop_items)
 async def buy(ctx, item_name: str):
-    await ctx.send(todaysShop.attemptBuy(ctx.author.name, item_name))
-    await update_shop_displays() # Update shop displays after a purchase
-
-@bot.command()
-@commands.check_any(commands.has_any_role(*CUSTOMER_ROLES, *ADMIN_ROLES), commands.has_permissions(administrator=True))
+    customer = shop.id_to_customer(ctx.shop, ctx.author.name)
+    async with transactions.transaction(ctx.shop, customers=[customer], items=[item_name], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        result = ctx.shop.attemptBuy(ctx.author.name, item_name)
+    await ctx.send(result)
+    ctx.guild_shop.refresher.mark_dirty() # Update shop displays after a purchase
+
+@bot.hybrid_command()
+@has_shop_role('customer', 'admin')
+@app_commands.describe(item_name="The item from your inventory to use")
+@app_commands.autocomplete(item_name=owned_items)
 async def use(ctx, item_name: str):
-    customer = shop.id_to_customer(todaysShop, ctx.author.name)
+    customer = shop.id_to_customer(ctx.shop, ctx.author.name)
     if customer is None:
         await ctx.send("You aren't a customer yet! You don't have any items to use...")
         return
-    await ctx.send(customer.use(item_name))
-
-@bot.command()
-@commands.check_any(commands.has_any_role(*CUSTOMER_ROLES, *ADMIN_ROLES), commands.has_permissions(administrator=True))
-async def give_away(ctx, item_name: str):
-    customer = shop.id_to_customer(todaysShop, ctx.author.name)
+    async with transactions.transaction(ctx.shop, customers=[customer], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        result = ctx.shop.use(customer, item_name)
+    await ctx.send(result)
+
+@bot.hybrid_command()
+@has_shop_role('customer', 'admin')
+@app_commands.describe(item_name="The item from your inventory to give away", recipient="Who to give it to, someone in your tribe")
+@app_commands.autocomplete(item_name=owned_items, recipient=tribemates)
+async def give_away(ctx, item_name: str, recipient: str | None = None):
+    customer = shop.id_to_customer(ctx.shop, ctx.author.name)
     if customer is None:
         await ctx.send("You aren't a customer yet! You can't give away items if you don't have any...")
         return
-    await ctx.send("Please enter the name of the person you want to give the item to:\n" + todaysShop.print_customers(tribe=customer.tribe))
-    recipientStr = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    recipientStr = recipientStr.strip('"') # remove quotes if user included them
-    recipient = shop.id_to_customer(todaysShop, recipientStr)
     if recipient is None:
-        await ctx.send(f"Could not find a customer with the ID '{recipientStr}'. Make sure you entered it correctly and that the recipient is registered as a customer.")
-        return
-    if recipient.tribe != customer.tribe:
-        await ctx.send(f"Nice try... {recipient.realname} is **not** in your party, sneaky sneaky.")
-        return
-    await ctx.send(customer.give(item_name, recipient))
+        recipient = await prompts.ask(ctx, "Please enter the name of the person you want to give the item to:\n" + ctx.shop.print_customers(tribe=customer.tribe),
+                                      parse=existing_customer(ctx.shop))
+    else:
+        try:
+            recipient = existing_customer(ctx.shop)(recipient)
+        except ValueError as e:
+            await ctx.send(f"{e}")
+            return
+    # either of them could have been removed or moved tribes while we were waiting on the reply, so check again under the locks
+    async with transactions.transaction(ctx.shop, customers=[customer, recipient], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        if recipient.tribe != customer.tribe:
+            result = f"Nice try... {recipient.realname} is **not** in your party, sneaky sneaky."
+        else:
+            result = ctx.shop.give(customer, item_name, recipient)
+    await ctx.send(result)
 
 # admin commands (beginning with prefix)
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def help_admin(ctx):
-    await ctx.send("Here are the admin commands you can use:" + \
-                   f"\n* {todaysShop.prefix}add_customer <userID> <wealth> <tribe> - Add a new customer to the shop with an optional starting wealth and tribe (you can say \"myself\")" + \
-                   f"\n* {todaysShop.prefix}check_customers - View a list of all customers (use verbose=True for more details)" + \
-                   f"\n* {todaysShop.prefix}swap_tribe <customerID> <newTribe> - Move a customer to a new tribe" + \
-                   f"\n* {todaysShop.prefix}remove_customer <userID> - Remove a customer from the shop (you can say \"myself\")" + \
-                   f"\n* {todaysShop.prefix}move_money <userID> <amount> - Add or remove money from a user's account (you can say \"myself\")" + \
-                   f"\n* {todaysShop.prefix}move_money_tribe <tribe> <amount> - Add or remove money from all members of a tribe" +
-                   f"\n* {todaysShop.prefix}add_shop_item - Add a new item to the shop (you will be prompted for item details)" +
-                   f"\n* {todaysShop.prefix}add_customer_item - Give a new item to a customer (you will be prompted for customer and item details)" + \
-                   f"\n* {todaysShop.prefix}remove_shop_item <item name> - Remove an item from the shop" +       
-                   f"\n* {todaysShop.prefix}remove_customer_item <customer name> <item name> - Remove an item from a customer's inventory" + \
-                   f"\n* {todaysShop.prefix}change_shop_quantity <item name> <new quantity> - Change the quantity of an item in the shop" + \
+    await paging.send_long(ctx, "Here are the admin commands you can use:" + \
+                   f"\n* {ctx.shop.prefix}add_customer <userID> <wealth> <tribe> - Add a new customer to the shop with an optional starting wealth and tribe (you can say \"myself\")" + \
+                   f"\n* {ctx.shop.prefix}check_customers - View a list of all customers (use verbose=True for more details)" + \
+                   f"\n* {ctx.shop.prefix}swap_tribe <customerID> <newTribe> - Move a customer to a new tribe" + \
+                   f"\n* {ctx.shop.prefix}remove_customer <userID> - Remove a customer from the shop (you can say \"myself\")" + \
+                   f"\n* {ctx.shop.prefix}move_money <userID> <amount> - Add or remove money from a user's account (you can say \"myself\")" + \
+                   f"\n* {ctx.shop.prefix}move_money_tribe <tribe> <amount> - Add or remove money from all members of a tribe" +
+                   f"\n* {ctx.shop.prefix}grant_tribe <tribe> <item name> <quantity> - Give every member of a tribe an item (a copy of the shop's, if it sells one)" + \
+                   f"\n* {ctx.shop.prefix}rename_tribe <tribe> <new name> - Rename a tribe, or merge it into another by giving that tribe's name" + \
+                   f"\n* {ctx.shop.prefix}tribe_details <tribe> - View a tribe's members, wealth and the items they hold between them" + \
+                   f"\n* {ctx.shop.prefix}add_shop_item - Add a new item to the shop (you will be prompted for item details)" +
+                   f"\n* {ctx.shop.prefix}add_customer_item - Give a new item to a customer (you will be prompted for customer and item details)" + \
+                   f"\n* {ctx.shop.prefix}remove_shop_item <item name> - Remove an item from the shop" +       
+                   f"\n* {ctx.shop.prefix}remove_customer_item <customer name> <item name> - Remove an item from a customer's inventory" + \
+                   f"\n* {ctx.shop.prefix}change_shop_quantity <item name> <new quantity> - Change the quantity of an item in the shop" + \
+                   f"\n* {ctx.shop.prefix}tribe_totals - View each tribe's member count and total wealth" + \
+                   f"\n* {ctx.shop.prefix}who_owns <item name> - View which customers hold an item" + \
+                   f"\n* {ctx.shop.prefix}render_stats - View how often shop/inventory/customer lists are served from the render cache" + \
+                   f"\n* {ctx.shop.prefix}stats [command/span/discord] - View how long commands, shop operations and discord requests are taking" + \
                    "\n**Mega Admin Commands (usable by hosts only):**" + \
-                   f"\n* {todaysShop.prefix}backup - Manually trigger a backup of the shop's state" + \
-                   f"\n* {todaysShop.prefix}restore - Manually restore the shop's state from the latest backup" + \
-                   f"\n* {todaysShop.prefix}clear_shop - Clear all items and customer data from the shop (use with extreme caution!)" + \
-                   f"\n* {todaysShop.prefix}restore_specific <n> - Restore the shop's state from a specific backup file (you will be prompted to choose from recent n backups, default 10)" + \
-                   f"\n* {todaysShop.prefix}add_folder_items <folder path> (default \"items\") - Add all items from a specified folder to the shop" + \
-                   f"\n* {todaysShop.prefix}add_folder_customers <folder path> (default \"customers\") - Add all customers from a specified folder to the shop")
+                   f"\n* {ctx.shop.prefix}backup - Manually trigger a backup of the shop's state" + \
+                   f"\n* {ctx.shop.prefix}restore - Manually restore the shop's state from the latest backup" + \
+                   f"\n* {ctx.shop.prefix}clear_shop - Clear all items and customer data from the shop (use with extreme caution!)" + \
+                   f"\n* {ctx.shop.prefix}restore_specific <n> - Restore the shop's state from a specific backup file (you will be prompted to choose from recent n backups, default 10)" + \
+                   f"\n* {ctx.shop.prefix}convert_backup <backup file> <json|jsonl.gz> - Rewrite a backup in the other backup format" + \
+                   f"\n* {ctx.shop.prefix}add_folder_items <folder path> (default \"{ctx.guild_shop.settings.items_folder}\") <dry run> - Add all items from a specified folder to the shop (dry run True only reports what would be added)" + \
+                   f"\n* {ctx.shop.prefix}sync_items <folder path> (default \"{ctx.guild_shop.settings.items_folder}\") <dry run> - Add new item files and apply edits to changed ones, leaving everything else alone" + \
+                   f"\n* {ctx.shop.prefix}sync_customers <folder path> (default \"{ctx.guild_shop.settings.customers_folder}\") <dry run> - Same as sync_items, for customer files" + \
+                   f"\n* {ctx.shop.prefix}add_folder_customers <folder path> (default \"{ctx.guild_shop.settings.customers_folder}\") <dry run> - Add all customers from a specified folder to the shop (dry run True only reports what would be added)")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def echo(ctx, channel_id: str, *message: str):
     # check if channel_id has form <#int>
     if not channel_id.startswith("<#") or not channel_id.endswith(">"):
@@ -195,304 +483,359 @@ async def echo(ctx, channel_id: str, *message: str):
         return
     channel = bot.get_channel(channel_id)
     if channel:
-        await channel.send(" ".join(message))
+        await outgoing.send(channel, " ".join(message))
     else:
         await ctx.send(f"Could not find a channel with the ID '{channel_id}'.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def add_customer(ctx, userID: str, wealth: int = 0, tribe: str | None = None):
     if userID == "myself":
         userID = ctx.author.name
-    if shop.id_to_customer(todaysShop, userID) is not None:
+    if shop.id_to_customer(ctx.shop, userID) is not None:
         await ctx.send(f"{userID} is already registered as a customer.")
         return
-    await ctx.send(f"Please enter the real name of the customer (or type 'none'):")
-    realname = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if realname.lower() == 'none':
-        realname = userID
+    discordIDint, servernickname = memberIndex.resolve(userID)
+    realname = sessions.optional_text(await prompts.ask(ctx, "Please enter the real name of the customer (or type 'none'):")) or userID
     new_customer = shop.Customer(
         realname=realname, 
         discordIDstr=userID, 
-        discordIDint=await get_discord_id_from_str(userID), 
-        servernickname=await get_server_nickname_from_str(userID), 
+        discordIDint=discordIDint, 
+        servernickname=servernickname, 
         wealth=wealth,
         tribe=tribe
     )
-    todaysShop.customers.append(new_customer)
+    async with ctx.shop.locks.hold([transactions.customer_key(new_customer)], TRANSACTION_TIMEOUT_SECONDS):
+        if shop.id_to_customer(ctx.shop, userID) is not None: # someone else added them while we were asking for the name
+            await ctx.send(f"{userID} is already registered as a customer.")
+            return
+        ctx.shop.add_customer(new_customer)
     await ctx.send(f"{userID} has been added as a customer with {wealth} coins.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def check_customers(ctx, verbose: bool = False):
-    await ctx.send(todaysShop.print_customers(verbose=verbose))
+    await paging.send_pages(ctx, ctx.shop.customer_pages(verbose=verbose), ctx.author.id)
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def swap_tribe(ctx, customerID: str, newTribe: str):
-    customer = shop.id_to_customer(todaysShop, customerID)
+    customer = shop.id_to_customer(ctx.shop, customerID)
     if customer is None:
-        await ctx.send(f"Could not find a customer with the ID '{customerID}'.")
+        await ctx.send(f"Could not find a customer with the ID '{customerID}'." + names.suggestion(ctx.shop.customers.suggest(customerID)))
         return
-    oldTribe = customer.tribe
-    customer.tribe = newTribe
+    async with transactions.transaction(ctx.shop, customers=[customer], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        oldTribe = customer.tribe
+        ctx.shop.swap_tribe(customer, newTribe)
     await ctx.send(f"{customer.realname} has been moved from tribe '{oldTribe}' to tribe '{newTribe}'.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def remove_customer(ctx, userID: str):
     if userID == "myself":
         userID = ctx.author.name
-    customer = shop.id_to_customer(todaysShop, userID)
+    customer = shop.id_to_customer(ctx.shop, userID)
     if customer is None:
-        await ctx.send(f"Could not find a customer with the ID '{userID}'.")
+        await ctx.send(f"Could not find a customer with the ID '{userID}'." + names.suggestion(ctx.shop.customers.suggest(userID)))
         return
-    await ctx.send(f"Are you sure you want to remove {customer.realname} from the shop? Type 'yes' to confirm.")
-    confirmation = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if confirmation.lower() != 'yes':
+    if not sessions.yes(await prompts.ask(ctx, f"Are you sure you want to remove {customer.realname} from the shop? Type 'yes' to confirm.")):
         await ctx.send("Customer removal cancelled.")
         return
-    todaysShop.customers.remove(customer)
+    async with transactions.transaction(ctx.shop, customers=[customer], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        ctx.shop.remove_customer(customer)
     await ctx.send(f"{customer.realname} has been removed from the shop.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role([*ADMIN_ROLES]), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def move_money(ctx, userID: str, howMuch: int):
     if userID == "myself":
         userID = ctx.author.name
-    customer = shop.id_to_customer(todaysShop, userID)
+    customer = shop.id_to_customer(ctx.shop, userID)
     if customer is None:
-        await ctx.send(f"Could not find a customer with the ID '{userID}'.")
+        await ctx.send(f"Could not find a customer with the ID '{userID}'." + names.suggestion(ctx.shop.customers.suggest(userID)))
         return
-    customer.wealth += howMuch
+    async with transactions.transaction(ctx.shop, customers=[customer], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        ctx.shop.move_money(customer, howMuch)
     await ctx.send(f"done. {userID}'s wealth is now {customer.wealth}")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def move_money_tribe(ctx, tribe: str, howMuch: int):
-    for customer in todaysShop.customers:
-        if customer.tribe == tribe:
-            customer.wealth += howMuch
+    tribe_members = ctx.shop.customers.tribe(tribe)
+    async with transactions.transaction(ctx.shop, customers=tribe_members, timeout=TRANSACTION_TIMEOUT_SECONDS):
+        ctx.shop.move_money_tribe(tribe, howMuch)
     await ctx.send(f"All members of {tribe} have had their wealth adjusted by {howMuch} coins.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
-async def add_shop_item(ctx):
-    await ctx.send("Please enter the name of the item:")
-    item_name = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    item_name = item_name.strip('"') # remove quotes if user included them
-    await ctx.send("Please enter the price of the item:")
-    item_price = int((await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content)
-
-    await ctx.send("Please enter a description for the item (or type 'none'):")
-    item_description = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if item_description.lower() == 'none':
-        item_description = None
+@has_shop_role('admin')
+async def grant_tribe(ctx, tribe: str, item_name: str, quantity: int = 1):
+    if quantity < 1:
+        await ctx.send(f"Can't hand out {quantity}x {item_name}, it has to be at least 1.")
+        return
+    tribe_members = ctx.shop.customers.tribe(tribe)
+    if not tribe_members:
+        await ctx.send(f"Nobody is in a tribe called '{tribe}'.")
+        return
+    item = ctx.shop.inventory.get(item_name)
+    if item is not None: # hand out copies of what the shop sells, without touching its stock
+        item = item.copy()
+        item.quantity = quantity
     else:
-        item_description = item_description.strip('"') # remove quotes if user included them
-    await ctx.send("Please enter a description for the item when used (or type 'none'):")
-    item_description_on_use = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if item_description_on_use.lower() == 'none':
-        item_description_on_use = None
+        await ctx.send(f"The shop doesn't sell {item_name}, so I'll need a few details.")
+        answers = await prompts.run(ctx, sessions.Flow(*ITEM_STEPS[2:]))
+        item = shop.Item(name=item_name, price=0, quantity=quantity, description=answers['description'], description_on_use=answers['description_on_use'])
+    tribe_members = ctx.shop.customers.tribe(tribe) # the tribe may have changed while we were asking
+    async with transactions.transaction(ctx.shop, customers=tribe_members, timeout=TRANSACTION_TIMEOUT_SECONDS):
+        tribe_members = ctx.shop.grant_tribe(tribe, item)
+    await ctx.send(f"{len(tribe_members)} members of {tribe} each got {quantity}x {item.name}.")
+
+@bot.command()
+@has_shop_role('admin')
+async def rename_tribe(ctx, tribe: str, newTribe: str):
+    tribe_members = ctx.shop.customers.tribe(tribe)
+    if not tribe_members:
+        await ctx.send(f"Nobody is in a tribe called '{tribe}'.")
+        return
+    merging = len(ctx.shop.customers.tribe(newTribe))
+    async with transactions.transaction(ctx.shop, customers=tribe_members, timeout=TRANSACTION_TIMEOUT_SECONDS):
+        tribe_members = ctx.shop.rename_tribe(tribe, newTribe)
+    if merging:
+        await ctx.send(f"Merged {tribe} into {newTribe}, which now has {len(tribe_members) + merging} members.")
     else:
-        item_description_on_use
+        await ctx.send(f"{tribe} is now called {newTribe} ({len(tribe_members)} members).")
+
+@bot.command()
+@has_shop_role('admin')
+async def tribe_details(ctx, tribe: str):
+    tribe_members = ctx.shop.customers.tribe(tribe)
+    if not tribe_members:
+        await ctx.send(f"Nobody is in a tribe called '{tribe}'.")
+        return
+    output = f"{tribe}: {len(tribe_members)} members, {sum(customer.wealth or 0 for customer in tribe_members)}g total\n"
+    output += "".join(f"* {customer.realname}: {customer.wealth}g\n" for customer in tribe_members)
+    items = ctx.shop.tribe_inventory(tribe)
+    output += "Items held:\n" + ("".join(f"* {quantity}x {name}\n" for name, quantity in items.items()) if items else "* nothing\n")
+    await paging.send_long(ctx, output)
 
-    new_item = shop.Item(name=item_name, price=item_price, description=item_description, description_on_use=item_description_on_use)
-    todaysShop.stock(new_item)
+@bot.command()
+@has_shop_role('admin')
+async def add_shop_item(ctx):
+    answers = await prompts.run(ctx, NEW_ITEM_FLOW)
+    item_name, item_price = answers['name'], answers['price']
+    new_item = shop.Item(name=item_name, price=item_price, description=answers['description'], description_on_use=answers['description_on_use'])
+    try:
+        ctx.shop.stock(new_item)
+    except ValueError as e:
+        await ctx.send(f"{e} Use {ctx.shop.prefix}change_shop_quantity to restock it instead.")
+        return
+    ctx.guild_shop.refresher.mark_dirty()
     await ctx.send(f"{item_name} has been added to the shop with a price of {item_price} coins.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def add_customer_item(ctx):
-    await ctx.send("Please pick from the following customers to add an item to their inventory:\n" + todaysShop.print_customers())
-    userID = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    customer = shop.id_to_customer(todaysShop, userID)
-    if customer is None:
-        await ctx.send(f"Could not find a customer with the ID '{userID}'. Make sure you entered it correctly and that the customer is registered.")
-        return
-    await ctx.send("Please enter the name of the item:")
-    item_name = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    await ctx.send("Please enter the price of the item:")
-    item_price = int((await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content)
-    await ctx.send("Please enter a description for the item (or type 'none'):")
-    item_description = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if item_description.lower() == 'none':
-        item_description = None
-    await ctx.send("Please enter a description for the item when used (or type 'none'):")
-    item_description_on_use = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if item_description_on_use.lower() == 'none':
-        item_description_on_use = None
-    new_item = shop.Item(name=item_name, price=item_price, description=item_description, description_on_use=item_description_on_use)
-    customer.inventory.append(new_item)
+    answers = await prompts.run(ctx, customer_item_flow(ctx.shop))
+    customer, item_name = answers['customer'], answers['name']
+    new_item = shop.Item(name=item_name, price=answers['price'], description=answers['description'], description_on_use=answers['description_on_use'])
+    async with transactions.transaction(ctx.shop, customers=[customer], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        ctx.shop.add_customer_item(customer, new_item)
     await ctx.send(f"{item_name} has been added to {customer.realname}'s inventory.")
     
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def remove_customer_item(ctx, customer_name:str, item_name: str):
-    for customer in todaysShop.customers:
-        if customer.realname.lower() == customer_name.lower():
-            for item in customer.inventory:
-                if item.name.lower() == item_name.lower():
-                    customer.inventory.remove(item)
-                    await ctx.send(f"{item_name} has been removed from {customer.realname}'s inventory.")
-                    return
-            await ctx.send(f"Could not find an item named {item_name} in {customer.realname}'s inventory.")
+    customer = shop.id_to_customer(ctx.shop, customer_name)
+    if customer is None:
+        await ctx.send(f"Could not find a customer named {customer_name}." + names.suggestion(ctx.shop.customers.suggest(customer_name)))
+        return
+    async with transactions.transaction(ctx.shop, customers=[customer], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        if item_name not in customer.inventory:
+            await ctx.send(f"Could not find an item named {item_name} in {customer.realname}'s inventory." + names.suggestion(customer.inventory.suggest(item_name)))
             return
-    await ctx.send(f"Could not find a customer named {customer_name}.")
+        ctx.shop.remove_customer_item(customer, item_name)
+    await ctx.send(f"{item_name} has been removed from {customer.realname}'s inventory.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def remove_shop_item(ctx, item_name: str):
-    for item in todaysShop.inventory:
-        if item.name.lower() == item_name.lower():
-            todaysShop.remove_all_of(item)
-            await ctx.send(f"{item_name} has been removed from the shop.")
+    async with transactions.transaction(ctx.shop, items=[item_name], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        item = ctx.shop.inventory.get(item_name)
+        if item is None:
+            await ctx.send(f"Could not find an item named {item_name} in the shop." + names.suggestion(ctx.shop.inventory.suggest(item_name)))
             return
-    await ctx.send(f"Could not find an item named {item_name} in the shop.")
+        ctx.shop.remove_all_of(item)
+    ctx.guild_shop.refresher.mark_dirty()
+    await ctx.send(f"{item_name} has been removed from the shop.")
 
 @bot.command()
-@commands.check_any(commands.has_any_role(*ADMIN_ROLES), commands.has_permissions(administrator=True))
+@has_shop_role('admin')
 async def change_shop_quantity(ctx, item_name: str, new_quantity: int):
-    for item in todaysShop.inventory:
-        if item.name.lower() == item_name.lower():
-            item.quantity = new_quantity
-            await ctx.send(f"The quantity of {item_name} has been updated to {new_quantity}.")
+    async with transactions.transaction(ctx.shop, items=[item_name], timeout=TRANSACTION_TIMEOUT_SECONDS):
+        item = ctx.shop.inventory.get(item_name)
+        if item is None:
+            await ctx.send(f"Could not find an item named {item_name} in the shop." + names.suggestion(ctx.shop.inventory.suggest(item_name)))
             return
-    await ctx.send(f"Could not find an item named {item_name} in the shop.")
+        ctx.shop.change_quantity(item, new_quantity)
+    ctx.guild_shop.refresher.mark_dirty()
+    await ctx.send(f"The quantity of {item_name} has been updated to {new_quantity}.")
+
+@bot.command()
+@has_shop_role('admin')
+async def tribe_totals(ctx):
+    output = "Tribes:\n"
+    for tribe, member_count, wealth in ctx.shop.tribe_totals():
+        output += f"* {tribe}: {member_count} members, {wealth}g total\n"
+    await paging.send_long(ctx, output)
+
+@bot.command()
+@has_shop_role('admin')
+async def who_owns(ctx, item_name: str):
+    owners = ctx.shop.owners_of(item_name)
+    if not owners:
+        await ctx.send(f"Nobody has a {item_name}.")
+        return
+    await paging.send_long(ctx, f"{item_name} is held by:\n" + "".join(f"* {realname} ({quantity}x)\n" for realname, quantity in owners))
+
+@bot.command()
+@has_shop_role('admin')
+async def render_stats(ctx):
+    guild_shop = ctx.guild_shop
+    await ctx.send(shop.render_cache.stats() + \
+                   f"\nShop displays: {len(guild_shop.displays)} tracked, {guild_shop.refresher.refreshes} refreshes, {guild_shop.refresher.coalesced} changes coalesced, {guild_shop.refresher.skipped} unchanged refreshes skipped" + \
+                   f"\n{guild_shop.shop.locks.stats()}" + \
+                   f"\n{shops.stats()}" + \
+                   f"\n{prompts.stats()}" + \
+                   f"\n{outgoing.stats()}")
+
+@bot.command()
+@has_shop_role('admin')
+async def stats(ctx, family: str | None = None):
+    # family narrows it down to one of command, span or discord
+    if family is not None and family not in metrics.FAMILIES:
+        await ctx.send(f"Invalid stats type '{family}', must be one of {', '.join(metrics.FAMILIES)}.")
+        return
+    await paging.send_long(ctx, metrics.registry.render(family))
 
 # mega admin commands (use with caution)
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def backup(ctx):
-    todaysShop.backup()
-    await ctx.send("Backup complete!")
+    start = time.perf_counter()
+    backup_file_path, size = await ctx.shop.backup_async()
+    await ctx.send(f"Backup complete! Wrote {size / 1024:.1f} KB to {os.path.basename(backup_file_path)} in {time.perf_counter() - start:.2f}s.")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def restore(ctx):
-    todaysShop.restore(backup_folder=DEFAULT_BACKUP_FOLDER_NAME)
+    ctx.shop.restore()
+    ctx.guild_shop.refresher.mark_dirty()
     await ctx.send("Restore complete!")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def restore_specific(ctx, n: int = 10):
-    backup_folder = DEFAULT_BACKUP_FOLDER_NAME
-    if backup_folder and os.path.exists(backup_folder):
-        backup_files = [f for f in os.listdir(backup_folder) if f.startswith("shop_backup") and f.endswith(".json")]
-        if backup_files:
-            backup_files.sort(key=lambda f: os.path.getctime(os.path.join(backup_folder, f)), reverse=True)
-            recent_backups = backup_files[:n] # show n most recent backups
-            backup_list_message = "Please choose a backup to restore from the list below by typing its number:\n"
-            for i, backup in enumerate(recent_backups):
-                backup_list_message += f"{i + 1}. {backup}\n"
-            await ctx.send(backup_list_message)
-
-            def check(m):
-                return m.author == ctx.author and m.content.isdigit() and 1 <= int(m.content) <= len(recent_backups)
-
-            try:
-                response = await bot.wait_for('message', check=check, timeout=60)
-                chosen_backup = recent_backups[int(response.content) - 1]
-                todaysShop.load_backup(os.path.join(backup_folder, chosen_backup))
-                await ctx.send(f"Restore from {chosen_backup} complete!")
-            except asyncio.TimeoutError:
-                await ctx.send("No response received. Restore cancelled.")
-        else:
-            await ctx.send("No backup files found. Cannot restore.")
+    backup_folder = ctx.guild_shop.settings.backup_folder
+    manifest = backups.manifest_for(backup_folder)
+    recent_backups = manifest.recent(n) # show n most recent backups
+    if not recent_backups:
+        await ctx.send("No backup files found. Cannot restore.")
+        return
+    backup_list_message = "Please choose a backup to restore from the list below by typing its number:\n"
+    for i, backup in enumerate(recent_backups):
+        backup_list_message += f"{i + 1}. {backup['file']} ({backup['customers']} customers, {backup['items']} items, {backup['size'] / 1024:.1f} KB)\n"
+
+    def pick(reply):
+        number = sessions.whole_number(reply)
+        if not 1 <= number <= len(recent_backups):
+            raise ValueError(f"Pick a number from 1 to {len(recent_backups)}.")
+        return recent_backups[number - 1]['file']
+
+    chosen_backup = await prompts.ask(ctx, backup_list_message, parse=pick, timeout=60)
+    try:
+        ctx.shop.restore_from(os.path.join(backup_folder, chosen_backup))
+        ctx.guild_shop.refresher.mark_dirty()
+        await ctx.send(f"Restore from {chosen_backup} complete!")
+    except ValueError as e:
+        await ctx.send(f"{e} Restore cancelled.")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def convert_backup(ctx, backup_file: str, format: str):
+    try:
+        converted = await asyncio.to_thread(backups.convert_backup, os.path.join(ctx.guild_shop.settings.backup_folder, backup_file), format)
+    except (OSError, ValueError) as e:
+        await ctx.send(f"Couldn't convert {backup_file}: {e}")
+        return
+    await ctx.send(f"Converted {backup_file} to {os.path.basename(converted)}.")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def clear_shop(ctx, type: str | None = None):
-    await ctx.send("Are you sure you want to clear the shop? This will delete all items and/or customer data. Type 'yes' to confirm.")
-    confirmation = (await bot.wait_for('message', check=lambda m: m.author == ctx.author)).content
-    if confirmation.lower() != 'yes':
+    if not sessions.yes(await prompts.ask(ctx, "Are you sure you want to clear the shop? This will delete all items and/or customer data. Type 'yes' to confirm.")):
         await ctx.send("Shop clear cancelled.")
         return
-    global todaysShop
-    if type == "items":
-        todaysShop.inventory = []
-    elif type == "customers":
-        todaysShop.customers = []
-    else:
-        todaysShop = shop.Shop(backup_folder=DEFAULT_BACKUP_FOLDER_NAME, from_backup=False, prefix=COMMAND_PREFIX)
-    todaysShop.backup()
+    if type != "customers":
+        ctx.shop.clear_inventory()
+    if type != "items":
+        ctx.shop.clear_customers()
+    await ctx.shop.backup_async()
+    ctx.guild_shop.refresher.mark_dirty()
     await ctx.send("Shop cleared!")
 
 
 @bot.command()
 @commands.has_permissions(administrator=True)
-async def add_folder_customers(ctx, folder_path: str = "customers"):
-    await import_folder(todaysShop, folder_path, object_type="customer")
-    await ctx.send(f"All customers from folder '{folder_path}' have been added to the shop.")
+async def add_folder_customers(ctx, folder_path: str | None = None, dry_run: bool = False):
+    folder_path = folder_path or ctx.guild_shop.settings.customers_folder
+    report = await importer.import_folder(ctx.shop, folder_path, "customer", resolve_many=memberIndex.resolve_many, dry_run=dry_run)
+    await paging.send_long(ctx, report.summary())
 
 @bot.command()
 @commands.has_permissions(administrator=True)
-async def add_folder_items(ctx, folder_path: str = "items"):
-    await import_folder(todaysShop, folder_path, object_type="item")
-    await ctx.send(f"All items from folder '{folder_path}' have been added to the shop.")
-
-async def get_discord_id_from_str(discordIDstr: str) -> int:
-    users = bot.get_all_members()
-    for user in users:
-        if user.name == discordIDstr:
-            return user.id or "No ID"
-    raise ValueError(f"Could not find user with global name '{discordIDstr}' for finding Discord ID.")
-
-async def get_server_nickname_from_str(discordIDstr: str) -> str:
-    users = bot.get_all_members()
-    for user in users:
-        if user.name == discordIDstr:
-            return user.global_name or "No nickname"
-    raise ValueError(f"Could not find user with global name '{discordIDstr}' for finding server nickname")
-
-async def import_folder(shop_to_add_to: shop.Shop, folder_path: str, object_type: str):
-    if not os.path.exists(folder_path):
-            raise Exception(f"Folder '{folder_path}' does not exist.")
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.json') and not filename.startswith('.'): # don't include hidden files
-            if object_type == "customer":
-                with open(os.path.join(folder_path, filename), 'r') as f:
-                    customer_data = json.load(f)
-                    new_customer = shop.Customer(
-                        realname=customer_data['realname'], 
-                        discordIDstr=customer_data['discordIDstr'], 
-                        discordIDint=customer_data.get('discordIDint') or await get_discord_id_from_str(customer_data['discordIDstr']), 
-                        servernickname=customer_data.get('servernickname') or await get_server_nickname_from_str(customer_data['discordIDstr']), 
-                        wealth=customer_data.get('wealth', None),
-                        tribe=customer_data.get('tribe', None))
-                    new_customer.inventory = [shop.Item(**item) for item in customer_data.get('inventory', [])]
-                    shop_to_add_to.populate(new_customer)
-            elif object_type == "item":
-                with open(os.path.join(folder_path, filename), 'r') as f:
-                    item_data = json.load(f)
-                    description_on_use_str = item_data.get('description_on_use')
-                    description_on_use_str = description_on_use_str.replace('@Host', "<@&1452373901341622343>")
-                    description_on_use_str = description_on_use_str.replace('@Shopkeeper', "<@&1476355335659982908>")
-                    new_item = shop.Item(name=item_data['name'], price=item_data['price'], description=item_data.get('description'), description_on_use=description_on_use_str, quantity=item_data.get('quantity'))
-                    shop_to_add_to.stock(new_item)
-            else:
-                raise Exception(f"Invalid object type '{object_type}' specified. Must be 'folder' or 'item'.")
-            # change file to hidden
-            #os.rename(os.path.join(folder_path, filename), os.path.join(folder_path, '.' + filename))
-            print(f"Imported {object_type} '{filename}' and hid filename.")
-
+async def add_folder_items(ctx, folder_path: str | None = None, dry_run: bool = False):
+    folder_path = folder_path or ctx.guild_shop.settings.items_folder
+    report = await importer.import_folder(ctx.shop, folder_path, "item", mentions=ctx.guild_shop.settings.mentions, dry_run=dry_run)
+    if report.added and not dry_run:
+        ctx.guild_shop.refresher.mark_dirty()
+    await paging.send_long(ctx, report.summary())
 
-##### Run the bot #####
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def sync_items(ctx, folder_path: str | None = None, dry_run: bool = False):
+    folder_path = folder_path or ctx.guild_shop.settings.items_folder
+    report = await foldersync.sync_folder(ctx.shop, folder_path, "item", mentions=ctx.guild_shop.settings.mentions, dry_run=dry_run, timeout=TRANSACTION_TIMEOUT_SECONDS)
+    if (report.added or report.updated) and not dry_run:
+        ctx.guild_shop.refresher.mark_dirty()
+    await paging.send_long(ctx, report.summary())
 
-bot.run(API_KEY)
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def sync_customers(ctx, folder_path: str | None = None, dry_run: bool = False):
+    folder_path = folder_path or ctx.guild_shop.settings.customers_folder
+    report = await foldersync.sync_folder(ctx.shop, folder_path, "customer", resolve_many=memberIndex.resolve_many, dry_run=dry_run,
+                                          timeout=TRANSACTION_TIMEOUT_SECONDS)
+    await paging.send_long(ctx, report.summary())
 
 ##### Shutdown handlers #####
 
+def backup_all():
+    for guild_shop in shops:
+        guild_shop.shop.backup()
+
 def exit_handler():
     print('Initiating shutdown...')
-    todaysShop.backup()
-
-atexit.register(exit_handler)
+    backup_all()
 
 def sigint_handler(sig, frame):
     print('Initiating shutdown...')
-    todaysShop.backup()
+    backup_all()
     asyncio.create_task(bot.close())
     sys.exit(0)
 
-signal.signal(signal.SIGINT, sigint_handler)
+##### Run the bot #####
+
+# only when run directly, so the bot's commands can be loaded without connecting (see loadtest.py)
+if __name__ == "__main__":
+    bot.run(API_KEY)
+    atexit.register(exit_handler)
+    signal.signal(signal.SIGINT, sigint_handler)
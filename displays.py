@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+
+# older posts than this in a channel stop being refreshed (like they used to once they scrolled out of the last 30 messages)
+MAX_DISPLAYS_PER_CHANNEL = 5
+
+class DisplayRegistry:
+    # remembers every shop display the bot has posted, so refreshing them doesn't mean searching channel history
+    def __init__(self, path: str):
+        self.path = path
+        self.displays = {} # message id -> (guild id, channel id), oldest first
+        self.migrated = False # whether displays posted before the registry existed have been looked for yet
+        self.load()
+
+    def __iter__(self):
+        return iter([(guild_id, channel_id, message_id) for message_id, (guild_id, channel_id) in self.displays.items()])
+
+    def __len__(self):
+        return len(self.displays)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+        self.migrated = data.get('migrated', False)
+        self.displays = {display['message']: (display['guild'], display['channel']) for display in data.get('displays', [])}
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        data = {
+            'migrated': self.migrated,
+            'displays': [{'guild': guild_id, 'channel': channel_id, 'message': message_id} for guild_id, channel_id, message_id in self]
+        }
+        with open(self.path, 'w') as file:
+            json.dump(data, file, indent=4)
+
+    def add(self, guild_id: int | None, channel_id: int, message_id: int, save: bool = True):
+        self.displays[message_id] = (guild_id, channel_id)
+        in_channel = [other_id for other_id, (_, other_channel_id) in self.displays.items() if other_channel_id == channel_id]
+        for old_id in in_channel[:-MAX_DISPLAYS_PER_CHANNEL]:
+            del self.displays[old_id]
+        if save:
+            self.save()
+
+    def remove(self, message_id: int, save: bool = True):
+        if self.displays.pop(message_id, None) is not None and save:
+            self.save()
+
+class DisplayRefresher:
+    # collects "the shop changed" notices and refreshes the displays at most once per window, off the command that caused it
+    def __init__(self, render, edit_all, window: float):
+        self.render = render # () -> str, the text every display should show
+        self.edit_all = edit_all # async (str) -> None, pushes that text to every display
+        self.window = window
+        self.last_content = None
+        self.pending = 0 # changes since the last refresh
+        self.refreshes = 0
+        self.coalesced = 0 # changes that didn't need a refresh of their own
+        self.skipped = 0 # refreshes dropped because the text hadn't changed
+        self._dirty = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def mark_dirty(self):
+        self.pending += 1
+        self._dirty.set()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.window)
+            self._dirty.clear()
+            changes, self.pending = self.pending, 0
+            self.coalesced += changes - 1
+            try:
+                content = self.render()
+                if content == self.last_content:
+                    self.skipped += 1
+                    continue
+                await self.edit_all(content)
+                self.last_content = content
+                self.refreshes += 1
+                print(f"Refreshed shop displays ({changes} changes coalesced into one refresh).")
+            except Exception as e:
+                print(f"Problem refreshing shop displays... {e}")
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import importer
+import transactions
+
+# kept inside the synced folder, hidden so imports never take it for an item or customer file
+SYNC_MANIFEST_FILE_NAME = ".sync_manifest.json"
+
+class SyncManifest:
+    # what each file in a folder looked like the last time it was synced, so only new or edited files get read again
+    def __init__(self, folder: str):
+        self.path = os.path.join(folder, SYNC_MANIFEST_FILE_NAME)
+        self.files = {} # file name -> {'mtime', 'size', 'sha256', 'key', 'data'}, data being the file's contents as last applied
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.files = json.load(file).get('files', {})
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'files': self.files}, file, indent=4)
+        os.replace(temp_path, self.path)
+
+def _scan(folder_path: str) -> dict:
+    # file name -> (mtime, size) for every visible .json file
+    stats = {}
+    for entry in os.scandir(folder_path):
+        if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.is_file():
+            stat = entry.stat()
+            stats[entry.name] = (stat.st_mtime, stat.st_size)
+    return stats
+
+def _read_and_hash(path: str):
+    # (sha256, parsed JSON), with the exception in place of the JSON if the file couldn't be read or parsed
+    try:
+        with open(path, 'rb') as file:
+            raw = file.read()
+    except OSError as e:
+        return None, e
+    try:
+        return hashlib.sha256(raw).hexdigest(), json.loads(raw)
+    except ValueError as e:
+        return hashlib.sha256(raw).hexdigest(), e
+
+def _read_all(folder_path: str, file_names: list[str]) -> dict:
+    with ThreadPoolExecutor(max_workers=importer.READ_THREADS) as pool:
+        return dict(zip(file_names, pool.map(_read_and_hash, [os.path.join(folder_path, f) for f in file_names])))
+
+def _inventory_changes(old: list[dict], new: list[dict]) -> list[dict]:
+    # what was edited in a customer file's inventory, as items with how many more (or, negative, fewer) of each the customer should
+    # have, so applying it leaves alone whatever they've bought, used or been given since the file was last synced
+    old_quantities = {item['name'].lower(): item['quantity'] for item in old}
+    changes = []
+    for item in new:
+        difference = item['quantity'] - old_quantities.pop(item['name'].lower(), 0)
+        if difference:
+            changes.append({**item, 'quantity': difference})
+    changes += [{**item, 'quantity': -item['quantity']} for item in old if item['name'].lower() in old_quantities]
+    return changes
+
+async def sync_folder(shop_to_sync, folder_path: str, kind: str, resolve_many = None, mentions: dict | None = None, dry_run: bool = False,
+                      timeout: float | None = None) -> importer.ImportReport:
+    # brings the shop up to date with a folder of item or customer files: new files are added, and for edited files only the
+    # fields that changed in the file are applied, so e.g. fixing an item's description doesn't reset how many are left.
+    # an edited customer file describing someone no longer in the shop adds them back, an edited item file only restocks a sold out
+    # (or removed) item if its quantity was changed. edits to an existing customer's wealth and inventory are applied as differences
+    # (ten more gold, one more of this, one fewer of that), so what they've spent, bought or been given since isn't lost.
+    # like importer.import_folder, either every change is applied as one journaled change or, if a file is bad, none are.
+    if kind not in importer.IMPORT_KINDS:
+        raise ValueError(f"Invalid sync type '{kind}', must be one of {', '.join(importer.IMPORT_KINDS)}.")
+    if not os.path.exists(folder_path):
+        raise ValueError(f"Folder '{folder_path}' does not exist.")
+    mentions = mentions or {}
+    manifest = SyncManifest(folder_path)
+    report = importer.ImportReport(kind, folder_path, dry_run)
+    key_field = 'name' if kind == "item" else 'discordIDstr'
+    def lookup(name):
+        return shop_to_sync.inventory.get(name) if kind == "item" else shop_to_sync.customers.get(name)
+
+    start = time.perf_counter()
+    stats = await asyncio.to_thread(_scan, folder_path)
+    changed = [file_name for file_name, (mtime, size) in stats.items()
+               if file_name not in manifest.files or (manifest.files[file_name]['mtime'], manifest.files[file_name]['size']) != (mtime, size)]
+    contents = await asyncio.to_thread(_read_all, folder_path, changed)
+    report.timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    entries = {file_name: entry for file_name, entry in manifest.files.items() if file_name in stats}
+    for file_name in manifest.files.keys() - stats.keys():
+        report.skipped.append((file_name, "the file was deleted, what it described was left in the shop"))
+    owners = {entry['key']: file_name for file_name, entry in entries.items() if file_name not in contents} # key -> file describing it
+    plan = [] # (name, full details, just the fields that changed in the file, whether to add it if it isn't in the shop)
+    for file_name, (sha256, data) in contents.items():
+        mtime, size = stats[file_name]
+        entry = manifest.files.get(file_name)
+        if isinstance(data, Exception):
+            report.errors.append((file_name, f"couldn't read it ({data})"))
+            continue
+        if entry is not None and entry['sha256'] == sha256: # touched, but not actually edited
+            entries[file_name] = {**entry, 'mtime': mtime, 'size': size}
+            continue
+        try:
+            parsed = (importer.parse_item if kind == "item" else importer.parse_customer)(data, mentions)
+        except (TypeError, ValueError) as e:
+            report.errors.append((file_name, str(e)))
+            continue
+        full = parsed.to_dict()
+        name = full[key_field]
+        key = name.lower()
+        if owners.get(key, file_name) != file_name:
+            report.skipped.append((file_name, f"{name} is already in {owners[key]}"))
+            continue
+        owners[key] = file_name
+        if entry is None or entry['key'] != key:
+            # a file we haven't seen before: anything it describes that's already in the shop is just tracked from now on
+            changes = None if lookup(name) is not None else {}
+            if changes is None:
+                report.skipped.append((file_name, f"{name} is already in the shop, edits to the file will be synced from now on"))
+        else:
+            changes = {field: value for field, value in full.items() if entry['data'].get(field) != value}
+            if 'wealth' in changes:
+                wealth_change = (changes.pop('wealth') or 0) - (entry['data'].get('wealth') or 0)
+                if wealth_change:
+                    changes['wealth_change'] = wealth_change
+            if 'inventory' in changes:
+                inventory_changes = _inventory_changes(entry['data'].get('inventory', []), changes.pop('inventory'))
+                if inventory_changes:
+                    changes['inventory_changes'] = inventory_changes
+        if changes is not None:
+            plan.append((name, full, changes, entry is None or kind == "customer" or 'quantity' in changes))
+        entries[file_name] = {'mtime': mtime, 'size': size, 'sha256': sha256, 'key': key, 'data': dict(full)} # as in the file, before member lookups
+    report.timings['validate'] = time.perf_counter() - start
+
+    if kind == "customer" and resolve_many is not None and not report.errors:
+        start = time.perf_counter()
+        unresolved = [name for name, full, _, _ in plan if lookup(name) is None and (full['discordIDint'] is None or full['servernickname'] is None)]
+        try:
+            resolved = resolve_many(unresolved) if unresolved else {}
+        except ValueError as e:
+            report.errors.append(("member lookup", str(e)))
+        else:
+            for name, full, _, _ in plan:
+                discordIDint, servernickname = resolved.get(name, (None, None))
+                full['discordIDint'] = full['discordIDint'] if full['discordIDint'] is not None else discordIDint
+                full['servernickname'] = full['servernickname'] if full['servernickname'] is not None else servernickname
+        report.timings['resolve'] = time.perf_counter() - start
+
+    if report.errors:
+        print(report.summary())
+        return report
+    start = time.perf_counter()
+    key_of = transactions.item_key if kind == "item" else transactions.customer_id_key
+    async with shop_to_sync.locks.hold([key_of(name) for name, _, _, _ in plan], timeout):
+        # decided only now, under the locks, since a customer may have been removed or an item sold out while we were reading
+        upserts = []
+        for name, full, changes, restock in plan:
+            if lookup(name) is None:
+                if not restock:
+                    report.skipped.append((name, "it's sold out or was removed, change the quantity in its file to restock it"))
+                    continue
+                upserts.append(full)
+                report.added.append(name)
+            elif changes:
+                upserts.append({key_field: name, **changes})
+                report.updated.append(name)
+        if not dry_run:
+            if upserts:
+                shop_to_sync.upsert(**{'items' if kind == "item" else 'customers': upserts})
+            manifest.files = entries
+            manifest.save()
+    report.timings['apply'] = time.perf_counter() - start
+    if report.added or report.updated or report.skipped:
+        print(report.summary())
+    return report
+
+class FolderWatcher:
+    # syncs the item and customer folders every so often, so hosts can edit files mid-season without running a command
+    def __init__(self, shop_to_sync, folders: dict, interval: float, resolve_many = None, mentions: dict | None = None,
+                 on_change = None, timeout: float | None = None):
+        self.shop = shop_to_sync
+        self.folders = folders # kind ("item"/"customer") -> folder path
+        self.interval = interval
+        self.resolve_many = resolve_many
+        self.mentions = mentions
+        self.on_change = on_change # called with the report of every sync that added or updated something
+        self.timeout = timeout
+        self.syncs = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for kind, folder in self.folders.items():
+                if not os.path.exists(folder):
+                    continue
+                try:
+                    report = await sync_folder(self.shop, folder, kind, resolve_many=self.resolve_many, mentions=self.mentions, timeout=self.timeout)
+                    self.syncs += 1
+                    if (report.added or report.updated) and self.on_change is not None:
+                        self.on_change(report)
+                except Exception as e:
+                    print(f"Problem syncing {folder}... {e}")
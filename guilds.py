@@ -0,0 +1,182 @@
+import asyncio
+import os
+import time
+
+from config import *
+import backups
+import displays
+import foldersync
+import shop
+import storage
+
+# the keys a server's entry in GUILD_SETTINGS can override, anything left out comes from the rest of the config
+SETTING_KEYS = ('prefix', 'backup_folder', 'customer_roles', 'admin_roles', 'spectator_roles', 'items_folder', 'customers_folder', 'mentions')
+
+def has_saved_shop(folder: str) -> bool:
+    # whether a shop has been backed up or journaled straight into folder
+    return os.path.isdir(folder) and any(backups.is_backup_file(name) or name in (JOURNAL_FILE_NAME, SQLITE_FILE_NAME) for name in os.listdir(folder))
+
+class GuildSettings:
+    # one server's prefix, roles and folders; the server the bot ran in before shops were per server (LEGACY_GUILD_ID)
+    # keeps the old folders, so its backups carry on where they left off
+    def __init__(self, guild_id: int | None, overrides: dict | None = None, legacy: bool = False, mentions: dict | None = None):
+        self.guild_id = guild_id
+        self.prefix = COMMAND_PREFIX
+        if legacy:
+            self.backup_folder = DEFAULT_BACKUP_FOLDER_NAME
+            self.items_folder = "items"
+            self.customers_folder = "customers"
+        else:
+            self.backup_folder = os.path.join(DEFAULT_BACKUP_FOLDER_NAME, str(guild_id))
+            self.items_folder = os.path.join("items", str(guild_id))
+            self.customers_folder = os.path.join("customers", str(guild_id))
+        self.customer_roles = list(CUSTOMER_ROLES)
+        self.admin_roles = list(ADMIN_ROLES)
+        self.spectator_roles = list(SPECTATOR_ROLES)
+        self.mentions = mentions or {} # placeholders item files can use in their descriptions -> the role mentions they become
+        for key, value in (overrides or {}).items():
+            if key not in SETTING_KEYS:
+                raise ValueError(f"Unknown setting '{key}' for server {guild_id}, must be one of {', '.join(SETTING_KEYS)}.")
+            setattr(self, key, value)
+
+    def roles(self, *kinds: str) -> list[str]:
+        # kinds are "customer", "admin" and/or "spectator"
+        return [role for kind in kinds for role in getattr(self, f"{kind}_roles")]
+
+class GuildShop:
+    # one server's shop, along with everything that used to hang off the bot's one global shop: its storage, its displays,
+    # the task refreshing them and the task syncing its folders
+    def __init__(self, settings: GuildSettings, render, edit_all, resolve_many = None):
+        self.settings = settings
+        self.guild_id = settings.guild_id
+        self.storage = storage.open_storage(STORAGE_BACKEND, settings.backup_folder, JOURNAL_FILE_NAME, SQLITE_FILE_NAME, fsync=JOURNAL_FSYNC)
+        self.shop = shop.Shop(backup_folder=settings.backup_folder, from_backup=True, prefix=settings.prefix, storage=self.storage)
+        self.displays = displays.DisplayRegistry(os.path.join(settings.backup_folder, "shop_displays.json"))
+        self.refresher = displays.DisplayRefresher(lambda: render(self), lambda content: edit_all(self, content), DISPLAY_REFRESH_SECONDS)
+        self.watcher = foldersync.FolderWatcher(self.shop, {"item": settings.items_folder, "customer": settings.customers_folder}, SYNC_POLL_SECONDS,
+                                                resolve_many=resolve_many, mentions=settings.mentions, on_change=self._synced,
+                                                timeout=TRANSACTION_TIMEOUT_SECONDS)
+        self.active = 0 # commands running against this shop right now, including ones waiting on an answer
+        self.last_used = time.monotonic()
+
+    def _synced(self, report):
+        if report.kind == "item":
+            self.refresher.mark_dirty()
+
+    def start(self):
+        self.refresher.start()
+        if SYNC_POLL_SECONDS:
+            self.watcher.start()
+
+    def busy(self) -> bool:
+        # whether unloading it now would lose or interrupt something
+        return self.active > 0 or len(self.shop.locks) > 0 or self.refresher.pending > 0
+
+    async def close(self):
+        # backs up (off the event loop) and lets go of its files; the directory keeps it as closing until this is done, so the
+        # shop isn't loaded again (opening the same journal a second time) before this one is done with it
+        self.refresher.stop()
+        self.watcher.stop()
+        shop.render_cache.forget([self.shop, *self.shop.customers]) # nothing renders it once it's unloaded
+        await self.shop.backup_async()
+        self.storage.close()
+
+class ShopDirectory:
+    # every server's shop, loaded the first time something in that server needs it and unloaded again once it's been idle a while.
+    # nothing is shared between servers, so with a sharded bot each shard (or process) only ever loads its own servers' shops
+    def __init__(self, render, edit_all, resolve_many = None, legacy_mentions: dict | None = None):
+        self.render = render # (GuildShop) -> str, what its displays show
+        self.edit_all = edit_all # async (GuildShop, str) -> None, pushes that to its displays
+        self.resolve_many = resolve_many
+        self.legacy_mentions = legacy_mentions
+        self._settings = {} # guild id -> GuildSettings, kept after the shop is unloaded since they're cheap
+        self.legacy_guild_id = LEGACY_GUILD_ID # see adopt_legacy
+        self._shops = {} # guild id -> GuildShop, only the loaded ones
+        self._closing = {} # guild id -> the task backing up and closing its shop after it was unloaded
+        self._loading = {} # guild id -> the task loading its shop
+        self.loads = 0
+        self.evictions = 0
+
+    def __iter__(self):
+        return iter(list(self._shops.values()))
+
+    def __len__(self):
+        return len(self._shops)
+
+    def settings(self, guild_id: int | None) -> GuildSettings:
+        # also answers for direct messages (guild_id None), which only need the defaults, e.g. the prefix
+        settings = self._settings.get(guild_id)
+        if settings is None:
+            legacy = guild_id is not None and guild_id == self.legacy_guild_id
+            settings = GuildSettings(guild_id, GUILD_SETTINGS.get(guild_id), legacy=legacy, mentions=self.legacy_mentions if legacy else None)
+            self._settings[guild_id] = settings
+        return settings
+
+    def adopt_legacy(self, guild_ids: list[int]):
+        # a bot upgraded from when it had one shop still has that shop straight in the backup folder, where no server looks for it
+        # unless LEGACY_GUILD_ID says whose it is; if the bot is only in one server it can only be that one's, otherwise say so loudly
+        # rather than have every server quietly start with an empty shop
+        if self.legacy_guild_id is not None or not has_saved_shop(DEFAULT_BACKUP_FOLDER_NAME):
+            return
+        if len(guild_ids) == 1 and guild_ids[0] not in self._shops and guild_ids[0] not in self._loading and not has_saved_shop(self.settings(guild_ids[0]).backup_folder):
+            self.legacy_guild_id = guild_ids[0]
+            del self._settings[guild_ids[0]]
+            print(f"Found the shop from before shops were per server in {DEFAULT_BACKUP_FOLDER_NAME}, it's now server {guild_ids[0]}'s shop "
+                  f"(set LEGACY_GUILD_ID = {guild_ids[0]} in the config to keep it that way).")
+            return
+        print("!" * 100 + f"\nERROR: there's a shop from before shops were per server in {DEFAULT_BACKUP_FOLDER_NAME}, but LEGACY_GUILD_ID isn't set "
+              "and the bot is in more than one server (or its one server already has a shop of its own), so no server is using it.\n"
+              "Set LEGACY_GUILD_ID in the config to the ID of the server it belongs to and restart the bot.\n" + "!" * 100)
+
+    def peek(self, guild_id: int) -> GuildShop | None:
+        # the server's shop if it's loaded, without loading it (or counting as using it)
+        return self._shops.get(guild_id)
+
+    async def get(self, guild_id: int) -> GuildShop:
+        # loads the shop if it isn't already, after waiting for it to finish closing if it was just unloaded
+        while guild_id in self._closing:
+            await asyncio.shield(self._closing[guild_id]) # a cancelled command mustn't cancel the close it was waiting on
+        guild_shop = self._shops.get(guild_id)
+        if guild_shop is None:
+            # everyone after the same unloaded shop waits on the one load, which a cancelled command mustn't cancel either
+            if guild_id not in self._loading:
+                self._loading[guild_id] = asyncio.create_task(self._load(guild_id))
+            guild_shop = await asyncio.shield(self._loading[guild_id])
+        guild_shop.last_used = time.monotonic()
+        return guild_shop
+
+    async def _load(self, guild_id: int) -> GuildShop:
+        # reading the backup and replaying the journal can take a while for a big shop, so it's done in a worker thread
+        try:
+            print(f"Setting up shop for server {guild_id}...")
+            guild_shop = await asyncio.to_thread(GuildShop, self.settings(guild_id), self.render, self.edit_all, self.resolve_many)
+            self._shops[guild_id] = guild_shop
+            guild_shop.start()
+            self.loads += 1
+            return guild_shop
+        finally:
+            del self._loading[guild_id]
+
+    def evict_idle(self, max_idle: float) -> int:
+        # unloads every shop nobody has used for max_idle seconds and starts backing them up, returns how many
+        now = time.monotonic()
+        evicted = 0
+        for guild_shop in self:
+            if now - guild_shop.last_used < max_idle or guild_shop.busy():
+                continue
+            del self._shops[guild_shop.guild_id]
+            self._closing[guild_shop.guild_id] = asyncio.create_task(self._close(guild_shop))
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    async def _close(self, guild_shop: GuildShop):
+        try:
+            await guild_shop.close()
+        except Exception as e:
+            print(f"Problem unloading the shop for server {guild_shop.guild_id}... {e}")
+        finally:
+            del self._closing[guild_shop.guild_id]
+
+    def stats(self) -> str:
+        return f"Shops: {len(self)} loaded, {len(self._loading)} loading, {len(self._closing)} closing, {self.loads} loads, {self.evictions} unloaded after going idle"
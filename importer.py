@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import shop
+
+IMPORT_KINDS = ("item", "customer")
+READ_THREADS = 8
+SUMMARY_NAMES = 20 # names listed in a report before it just says how many more there were
+TYPE_NAMES = {int: "a whole number", str: "text", list: "a list"}
+
+class ImportReport:
+    # what an import did (or, for a dry run, would do), and how long each stage took
+    def __init__(self, kind: str, folder: str, dry_run: bool):
+        self.kind = kind
+        self.folder = folder
+        self.dry_run = dry_run
+        self.added = [] # names of the items/customers added
+        self.updated = [] # names of the items/customers changed (folder syncs only)
+        self.skipped = [] # (file name, reason) for files that were left out but don't stop the import
+        self.errors = [] # (file name, problem) for files that stop the whole import
+        self.timings = {} # stage -> seconds
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def summary(self) -> str:
+        kind = f"{self.kind}s"
+        if self.errors:
+            output = f"Nothing was imported from '{self.folder}', {len(self.errors)} file(s) need fixing first:\n"
+            output += "".join(f"* {file_name}: {problem}\n" for file_name, problem in self.errors)
+        else:
+            output = f"{'Would add' if self.dry_run else 'Added'} {len(self.added)} {kind} from '{self.folder}'" \
+                     + (f": {_list_names(self.added)}.\n" if self.added else ".\n")
+        if self.updated:
+            output += f"{'Would update' if self.dry_run else 'Updated'} {len(self.updated)} {kind}: {_list_names(self.updated)}.\n"
+        if self.skipped:
+            output += f"Skipped {len(self.skipped)} file(s):\n" + "".join(f"* {file_name}: {reason}\n" for file_name, reason in self.skipped)
+        output += "Took " + ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.timings.items())
+        return output
+
+def _list_names(names: list[str]) -> str:
+    return ", ".join(names[:SUMMARY_NAMES]) + (f" and {len(names) - SUMMARY_NAMES} more" if len(names) > SUMMARY_NAMES else "")
+
+def _read_file(path: str):
+    # runs on a worker thread; problems come back as the result so one bad file doesn't stop the others being read
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        return e
+
+def read_folder(folder_path: str) -> dict:
+    # file name -> parsed JSON (or the exception reading it raised), for every visible .json file in the folder
+    file_names = sorted(f for f in os.listdir(folder_path) if f.endswith('.json') and not f.startswith('.')) # don't include hidden files
+    with ThreadPoolExecutor(max_workers=READ_THREADS) as pool:
+        return dict(zip(file_names, pool.map(_read_file, [os.path.join(folder_path, f) for f in file_names])))
+
+def _replace_mentions(text: str | None, mentions: dict) -> str | None:
+    if text is None:
+        return None
+    for placeholder, mention in mentions.items():
+        text = text.replace(placeholder, mention)
+    return text
+
+def _required(data: dict, field: str, kind: type):
+    value = data.get(field)
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise ValueError(f"'{field}' is missing or isn't {TYPE_NAMES[kind]}")
+    return value
+
+def _optional(data: dict, field: str, kind: type, default = None):
+    value = data.get(field, default)
+    if value is not None and (not isinstance(value, kind) or isinstance(value, bool)):
+        raise ValueError(f"'{field}' should be {TYPE_NAMES[kind]}")
+    return value
+
+def parse_item(data: dict, mentions: dict, owned: bool = False) -> shop.Item:
+    # owned items (in a customer's inventory) can leave out their price, customers' items didn't always keep one
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    quantity = _optional(data, 'quantity', int)
+    return shop.Item(name=_required(data, 'name', str),
+                     price=(_optional(data, 'price', int) or 0) if owned else _required(data, 'price', int),
+                     quantity=1 if quantity is None else quantity,
+                     description=_replace_mentions(_optional(data, 'description', str), mentions),
+                     description_on_use=_replace_mentions(_optional(data, 'description_on_use', str), mentions))
+
+def parse_customer(data: dict, mentions: dict) -> shop.Customer:
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    inventory = _optional(data, 'inventory', list, [])
+    customer = shop.Customer(realname=_required(data, 'realname', str),
+                             discordIDstr=_required(data, 'discordIDstr', str),
+                             discordIDint=_optional(data, 'discordIDint', int),
+                             servernickname=_optional(data, 'servernickname', str),
+                             wealth=_optional(data, 'wealth', int),
+                             tribe=_optional(data, 'tribe', str))
+    customer.inventory = shop.Inventory(parse_item(item, mentions, owned=True) for item in inventory)
+    return customer
+
+async def import_folder(shop_to_add_to: shop.Shop, folder_path: str, kind: str, resolve_many = None, mentions: dict | None = None,
+                        dry_run: bool = False) -> ImportReport:
+    # reads every file in the folder on worker threads, checks the whole batch, then adds it to the shop as one change
+    # resolve_many (e.g. MemberIndex.resolve_many) fills in customers' missing Discord IDs and nicknames
+    # mentions maps placeholders in item descriptions (e.g. "@Host") to what they should become
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Invalid import type '{kind}', must be one of {', '.join(IMPORT_KINDS)}.")
+    if not os.path.exists(folder_path):
+        raise ValueError(f"Folder '{folder_path}' does not exist.")
+    mentions = mentions or {}
+    report = ImportReport(kind, folder_path, dry_run)
+
+    start = time.perf_counter()
+    files = await asyncio.to_thread(read_folder, folder_path)
+    report.timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse = parse_item if kind == "item" else parse_customer
+    batch = {} # key -> (file name, parsed item/customer)
+    for file_name, data in files.items():
+        if isinstance(data, Exception):
+            report.errors.append((file_name, f"couldn't read it ({data})"))
+            continue
+        try:
+            parsed = parse(data, mentions)
+        except (TypeError, ValueError) as e:
+            report.errors.append((file_name, str(e)))
+            continue
+        name = parsed.name if kind == "item" else parsed.discordIDstr
+        key = name.lower()
+        if key in batch:
+            report.skipped.append((file_name, f"{name} is already in {batch[key][0]}"))
+        elif (shop_to_add_to.inventory.get(name) if kind == "item" else shop_to_add_to.customers.get(name)) is not None:
+            report.skipped.append((file_name, f"{name} is already in the shop"))
+        else:
+            batch[key] = (file_name, parsed)
+    report.timings['validate'] = time.perf_counter() - start
+
+    if kind == "customer" and resolve_many is not None and not report.errors:
+        start = time.perf_counter()
+        unresolved = [customer.discordIDstr for _, customer in batch.values() if customer.discordIDint is None or customer.servernickname is None]
+        try:
+            resolved = resolve_many(unresolved) if unresolved else {}
+        except ValueError as e:
+            report.errors.append(("member lookup", str(e)))
+        else:
+            for _, customer in batch.values():
+                discordIDint, servernickname = resolved.get(customer.discordIDstr, (None, None))
+                if customer.discordIDint is None:
+                    customer.discordIDint = discordIDint
+                if customer.servernickname is None:
+                    customer.servernickname = servernickname
+        report.timings['resolve'] = time.perf_counter() - start
+
+    if report.errors:
+        print(report.summary())
+        return report
+    start = time.perf_counter()
+    report.added = [parsed.name if kind == "item" else parsed.discordIDstr for _, parsed in batch.values()]
+    if not dry_run and batch:
+        parsed = [parsed for _, parsed in batch.values()]
+        if kind == "item":
+            shop_to_add_to.import_batch(items=parsed)
+        else:
+            shop_to_add_to.import_batch(customers=parsed)
+    report.timings['apply'] = time.perf_counter() - start
+    print(report.summary())
+    return report
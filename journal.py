@@ -0,0 +1,48 @@
+import json
+import os
+
+class Journal:
+    # append-only log of every change to the shop since the last backup, replayed on top of that backup after a crash
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync # also wait for the disk, not just the OS, on every append (survives power loss, costs more per change)
+        self.last_seq = 0
+        for record in self.records():
+            self.last_seq = record['seq']
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._file = open(path, 'a')
+
+    def append(self, record: dict):
+        self._file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.last_seq = record['seq']
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError: # only the last line can be cut off, by a crash mid-write
+                    print(f"Skipped unreadable journal entry in {self.path}.")
+
+    def compact(self, upto_seq: int):
+        # drops everything a backup already covers, keeping changes made since it was taken
+        keep = [record for record in self.records() if record['seq'] > upto_seq]
+        self._file.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            for record in keep:
+                file.write(json.dumps(record, separators=(',', ':')) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'a')
+
+    def close(self):
+        self._file.close()
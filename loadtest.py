@@ -0,0 +1,428 @@
+'''
+Replays a stream of commands through bot.py's real command set against a fake Discord (guild, channels, members with roles,
+message history, per-channel rate limits), then reports end-to-end command latency, messages sent/edited and whether the
+shop ended up consistent. Runs offline against a throwaway shop, nothing touches the real backups.
+
+A stream is JSONL, one command per line: {"user": "customer3", "channel": "tribe1", "content": "!give_away \\"item2\\"", "replies": ["customer7"]}
+replies are sent by the same user, in the same channel, whenever the bot is waiting on an answer from them.
+Users named host<n> get the host role, everyone else is a castaway (and a customer with STARTING_WEALTH gold).
+
+usage: python loadtest.py [--stream commands.jsonl | --generate 300] [--record commands.jsonl] [--concurrency 40]
+                          [--items 10] [--rate-limit 5/5] [--rest-ms 50] [--refresh-seconds 0.5] [--seed 0]
+'''
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timezone
+
+import discord
+
+STARTING_WEALTH = 100
+STARTING_STOCK = 50
+TRIBES = 4
+CASTAWAY_ROLE = "Castaways"
+HOST_ROLE = "Host"
+SHOP_CHANNEL = "shop"
+WAIT_FOR_PROMPT_SECONDS = 10 # how long a reply waits for the bot to ask its question before the stream entry is counted as stuck
+
+_ids = itertools.count(10**17) # snowflake-sized ids for everything fake
+
+##### Fake discord #####
+
+class RateLimiter:
+    # discord's per-channel message limit (e.g. 5 per 5 seconds): a request over it waits for the oldest to age out, like
+    # discord.py does after a 429
+    def __init__(self, count: int, per: float):
+        self.count = count
+        self.per = per
+        self.sent = [] # times of the requests still inside the window
+        self.hits = 0
+        self.waited = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.perf_counter()
+            self.sent = [sent for sent in self.sent if now - sent < self.per]
+            if len(self.sent) < self.count:
+                self.sent.append(now)
+                return
+            wait = self.per - (now - self.sent[0])
+            self.hits += 1
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+class FakeResponse:
+    # enough of an aiohttp response for discord.NotFound
+    status = 404
+    reason = "Not Found"
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+
+class FakeMember:
+    def __init__(self, name: str, guild, roles: list, bot: bool = False):
+        self.id = next(_ids)
+        self.name = name
+        self.global_name = name.capitalize()
+        self.display_name = self.global_name
+        self.mention = f"<@{self.id}>"
+        self.guild = guild
+        self.roles = roles
+        self.bot = bot
+        self.guild_permissions = discord.Permissions.none()
+
+    def get_role(self, role_id: int):
+        return discord.utils.get(self.roles, id=role_id)
+
+    def __str__(self):
+        return self.name
+
+class FakeMessage:
+    def __init__(self, state, channel, author, content: str | None, view = None):
+        self._state = state
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content or ""
+        self.view = view
+        self.attachments = []
+        self.created_at = datetime.now(timezone.utc)
+        self.edits = 0
+
+    async def edit(self, content = ..., view = ...):
+        await self.channel.request()
+        if self.id not in self.channel.messages:
+            raise discord.NotFound(FakeResponse(), "Unknown Message")
+        if content is not ...:
+            self.content = content
+        if view is not ...:
+            self.view = view
+        self.edits += 1
+        self.channel.edited += 1
+
+class FakeChannel:
+    type = discord.ChannelType.text
+
+    def __init__(self, name: str, guild, rate_limit: tuple[int, float], rest_seconds: float):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.guild = guild
+        self.messages = {} # message id -> FakeMessage, oldest first
+        self.limiter = RateLimiter(*rate_limit)
+        self.rest_seconds = rest_seconds # how long every request takes, as if it went over the network
+        self.sent = 0
+        self.edited = 0
+
+    async def request(self):
+        await self.limiter.acquire()
+        await asyncio.sleep(self.rest_seconds)
+
+    async def send(self, content = None, view = None, **kwargs):
+        await self.request()
+        message = FakeMessage(self.guild.state, self, self.guild.me, content, view)
+        self.messages[message.id] = message
+        self.sent += 1
+        return message
+
+    def post(self, author, content: str) -> FakeMessage:
+        # a message from a user, which doesn't go through the bot's rate limits
+        message = FakeMessage(self.guild.state, self, author, content)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id: int):
+        return self.messages.get(message_id) or _GoneMessage(self, message_id)
+
+    async def history(self, limit: int | None = 100):
+        for message in list(reversed(self.messages.values()))[:limit]:
+            yield message
+
+    def permissions_for(self, member):
+        return member.guild_permissions
+
+class _GoneMessage:
+    # what get_partial_message gives for a message that was never sent or was deleted, editing it raises NotFound
+    def __init__(self, channel, message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self.channel.request()
+        raise discord.NotFound(FakeResponse(), "Unknown Message")
+
+class FakeGuild:
+    def __init__(self, state, name: str = "Survivor"):
+        self.state = state
+        self.id = next(_ids)
+        self.name = name
+        self.roles = {name: FakeRole(name) for name in (CASTAWAY_ROLE, HOST_ROLE)}
+        self.members = {} # username -> FakeMember
+        self.channels = {} # name -> FakeChannel
+        self.me = None
+
+    @property
+    def text_channels(self):
+        return list(self.channels.values())
+
+    def member(self, name: str) -> FakeMember:
+        if name not in self.members:
+            self.members[name] = FakeMember(name, self, [self.roles[HOST_ROLE if name.startswith("host") else CASTAWAY_ROLE]])
+        return self.members[name]
+
+    def channel(self, name: str, rate_limit: tuple[int, float], rest_seconds: float) -> FakeChannel:
+        if name not in self.channels:
+            self.channels[name] = FakeChannel(name, self, rate_limit, rest_seconds)
+        return self.channels[name]
+
+##### Loading the bot #####
+
+def load_bot(folder: str, refresh_seconds: float):
+    # imports bot.py with a config pointing every file at a throwaway folder; the module's own code runs as-is
+    try:
+        import config as real_config
+    except ImportError: # no config.py outside a real deployment, the example one has everything the bot needs
+        import EXAMPLE_config as real_config
+    harness_config = types.ModuleType('config')
+    harness_config.__dict__.update({name: value for name, value in vars(real_config).items() if not name.startswith('__')})
+    harness_config.__dict__.update(DEFAULT_BACKUP_FOLDER_NAME=os.path.join(folder, "backups"), STORAGE_BACKEND="json", JOURNAL_FSYNC=False,
+                                   DISPLAY_REFRESH_SECONDS=refresh_seconds, SYNC_POLL_SECONDS=None, METRICS_FILE_NAME=None,
+                                   CUSTOMER_ROLES=[CASTAWAY_ROLE], ADMIN_ROLES=[HOST_ROLE], SPECTATOR_ROLES=[])
+    sys.modules['config'] = harness_config
+    cwd = os.getcwd()
+    try:
+        import bot as bot_module
+    finally:
+        os.chdir(cwd) # bot.py moves to its own folder
+    return bot_module
+
+##### Streams #####
+
+def generate(commands: int, castaways: int, items: int, seed: int = 0) -> list[dict]:
+    # castaways shopping at an item drop: mostly buying, with some checking, using and giving away what they got
+    rng = random.Random(seed)
+    prefix = sys.modules['config'].COMMAND_PREFIX if 'config' in sys.modules else "!"
+    names = [f"customer{i}" for i in range(castaways)]
+    stream = []
+    for _ in range(commands):
+        user = rng.choice(names)
+        tribe = int(user.removeprefix("customer")) % TRIBES
+        channel = f"tribe{tribe}"
+        item = f"item{rng.randrange(items)}"
+        kind = rng.choices(["buy", "check_inventory", "use", "give_away", "check_shop", "help"], [40, 20, 15, 10, 5, 10])[0]
+        entry = {'user': user, 'channel': channel, 'content': f"{prefix}{kind}"}
+        if kind in ("buy", "use", "give_away"):
+            entry['content'] += f' "{item}"'
+        if kind == "check_shop":
+            entry['channel'] = SHOP_CHANNEL
+        if kind == "give_away":
+            tribemates = [name for i, name in enumerate(names) if i % TRIBES == tribe and name != user] or [user]
+            entry['replies'] = [rng.choice(tribemates)]
+        stream.append(entry)
+    return stream
+
+def tribe_of(username: str, position: int) -> str:
+    # customer<n> is in tribe n % TRIBES, like generate() assumes; anyone else goes by the order they turn up in
+    number = username.removeprefix("customer")
+    return f"tribe{(int(number) if number.isdigit() else position) % TRIBES}"
+
+def read_stream(path: str) -> list[dict]:
+    with open(path, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def write_stream(path: str, stream: list[dict]):
+    with open(path, 'w') as file:
+        for entry in stream:
+            file.write(json.dumps(entry) + "\n")
+
+##### The run #####
+
+class Harness:
+    def __init__(self, bot_module, rate_limit: tuple[int, float], rest_seconds: float):
+        self.bot_module = bot_module
+        self.bot = bot_module.bot
+        self.rate_limit = rate_limit
+        self.rest_seconds = rest_seconds
+        self.guild = FakeGuild(self.bot._connection)
+        self.guild.me = FakeMember("shopkeeper", self.guild, [], bot=True)
+        self.latencies = {} # command name -> [seconds]
+        self.stuck = 0 # stream entries whose replies were never asked for
+
+    def channel(self, name: str) -> FakeChannel:
+        return self.guild.channel(name, self.rate_limit, self.rest_seconds)
+
+    @property
+    def guild_shop(self):
+        # the fake server's shop, as the bot's commands see it
+        return self.bot_module.shops.peek(self.guild.id)
+
+    async def start(self, stream: list[dict], items: int):
+        bot_module = self.bot_module
+        await self.bot._async_setup_hook() # what logging in would do: hands the bot the running event loop
+        self.bot._connection.user = self.guild.me
+        self.bot.get_channel = lambda channel_id: next((channel for channel in self.guild.channels.values() if channel.id == channel_id), None)
+        self.bot.get_guild = lambda guild_id: self.guild if guild_id == self.guild.id else None
+        harness = self
+
+        class FakeContext(bot_module.ShopContext):
+            async def send_now(self, content = None, **kwargs):
+                return await harness.channel(self.channel.name).send(content, **kwargs)
+        bot_module.ShopContext = FakeContext # what on_message builds contexts with
+
+        for entry in stream:
+            self.guild.member(entry['user'])
+            self.channel(entry['channel'])
+            for reply_user in entry.get('replies', ()):
+                self.guild.member(reply_user)
+        shop_module, todaysShop = bot_module.shop, (await bot_module.shops.get(self.guild.id)).shop
+        for i in range(items):
+            todaysShop.stock(shop_module.Item(name=f"item{i}", price=1 + i % 15, quantity=STARTING_STOCK, description=f"A thing castaways want, number {i}.",
+                                              description_on_use=f"You used item{i}!"))
+        castaways = [member for member in self.guild.members.values() if CASTAWAY_ROLE in (role.name for role in member.roles)]
+        for position, member in enumerate(castaways):
+            todaysShop.add_customer(shop_module.Customer(realname=member.global_name, discordIDstr=member.name, discordIDint=member.id,
+                                                         servernickname=member.display_name, wealth=STARTING_WEALTH, tribe=tribe_of(member.name, position)))
+        bot_module.memberIndex.rebuild(self.guild.members.values())
+        self.guild_shop.displays.migrated = True # nothing was posted before this run
+        # a host posts the shop display everyone's purchases keep refreshing
+        host = self.guild.member("host0")
+        host.guild_permissions = discord.Permissions.all()
+        await self.run_entry({'user': "host0", 'channel': SHOP_CHANNEL, 'content': f"{todaysShop.prefix}check_shop"})
+
+    async def run_entry(self, entry: dict):
+        author = self.guild.member(entry['user'])
+        channel = self.channel(entry['channel'])
+        start = time.perf_counter()
+        command = asyncio.create_task(self.bot_module.on_message(channel.post(author, entry['content'])))
+        for reply in entry.get('replies', ()):
+            deadline = time.perf_counter() + WAIT_FOR_PROMPT_SECONDS
+            while not self.bot_module.prompts.waiting(channel.id, author.id) and not command.done():
+                if time.perf_counter() > deadline:
+                    self.stuck += 1
+                    break
+                await asyncio.sleep(0.001)
+            if command.done():
+                break
+            await self.bot_module.on_message(channel.post(author, reply))
+        await command
+        await self.bot_module.outgoing.delivered(channel) # the command's replies have all reached the channel
+        name = entry['content'].removeprefix(self.guild_shop.shop.prefix).split(" ")[0]
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    async def replay(self, stream: list[dict], concurrency: int) -> float:
+        # concurrency users, each sending their next command once the last one's replies have arrived
+        queue = iter(stream)
+        async def user():
+            for entry in queue:
+                await self.run_entry(entry)
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+    async def settle(self):
+        # lets the last display refresh happen and everything queued go out
+        refresher = self.guild_shop.refresher
+        while refresher.pending or refresher._dirty.is_set():
+            await asyncio.sleep(refresher.window / 2)
+        await self.bot_module.outgoing.flush()
+        await asyncio.sleep(0) # the refresher records its last refresh after the edits finish
+
+    def invariants(self, stream: list[dict], start_gold: int, start_stock: dict) -> list[tuple[str, bool]]:
+        bot_module = self.bot_module
+        guild_shop = self.guild_shop
+        todaysShop = guild_shop.shop
+        customers = list(todaysShop.customers)
+        spent = start_gold - sum(customer.wealth for customer in customers)
+        sold = sum(price * (quantity - (todaysShop.inventory.get(name).quantity if name in todaysShop.inventory else 0))
+                   for name, (price, quantity) in start_stock.items())
+        replayed = bot_module.shop.Shop(prefix=todaysShop.prefix, from_backup=True,
+                                        storage=bot_module.shop.JsonStorage(todaysShop.storage.backup_folder, todaysShop.storage.journal.path))
+        display = bot_module.render_shop_display(guild_shop)
+        displays = [getattr(self.bot.get_channel(channel_id), 'messages', {}).get(message_id) for _, channel_id, message_id in guild_shop.displays]
+        checks = [] if any(entry['user'].startswith("host") for entry in stream) else \
+                 [("gold spent matches the price of everything sold", spent == sold)] # hosts can hand out gold and items
+        return checks + [
+            ("nobody's wealth went negative", all(customer.wealth >= 0 for customer in customers)),
+            ("no empty or negative stacks", all(item.quantity > 0 for customer in customers for item in customer.inventory)
+                                            and all(item.quantity >= 0 for item in todaysShop.inventory)),
+            ("journal replays to the same shop", replayed.snapshot() == todaysShop.snapshot()),
+            ("every shop display shows the current shop", bool(displays) and all(message is not None and message.content == display for message in displays)),
+            ("no locks left held", len(todaysShop.locks) == 0),
+            ("no prompts left open", len(bot_module.prompts) == 0),
+            ("outbox drained", len(bot_module.outgoing) == 0),
+        ]
+
+    def close(self):
+        for channel in self.guild.channels.values():
+            for message in channel.messages.values():
+                if message.view is not None:
+                    message.view.stop()
+        for guild_shop in self.bot_module.shops:
+            guild_shop.refresher.stop()
+
+def percentile(sorted_times: list[float], fraction: float) -> float:
+    return sorted_times[min(len(sorted_times) - 1, int(fraction * len(sorted_times)))]
+
+def report(harness: Harness, stream: list[dict], elapsed: float, invariants: list[tuple[str, bool]]) -> bool:
+    print(f"{len(stream)} commands in {elapsed:.2f}s ({len(stream) / elapsed:.1f}/s), {harness.stuck} stuck waiting for a prompt")
+    print(f"{'command':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, times in sorted(harness.latencies.items()):
+        times.sort()
+        print(f"{name:<18}{len(times):>7}{1000 * percentile(times, 0.5):>10.1f}{1000 * percentile(times, 0.95):>10.1f}"
+              f"{1000 * percentile(times, 0.99):>10.1f}{1000 * times[-1]:>10.1f}")
+    channels = harness.guild.channels.values()
+    print(f"Messages: {sum(channel.sent for channel in channels)} sent, {sum(channel.edited for channel in channels)} edited, "
+          f"{sum(channel.limiter.hits for channel in channels)} rate limited ({sum(channel.limiter.waited for channel in channels):.1f}s waiting)")
+    print(harness.bot_module.outgoing.stats())
+    refresher = harness.guild_shop.refresher
+    print(f"Shop displays: {refresher.refreshes} refreshes, {refresher.coalesced} changes coalesced")
+    for description, held in invariants:
+        print(f"{'ok  ' if held else 'FAIL'} {description}")
+    return all(held for _, held in invariants)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay commands through the bot against a fake Discord.")
+    parser.add_argument('--stream', help="JSONL file of commands to replay")
+    parser.add_argument('--generate', type=int, default=300, help="commands to generate when there's no --stream")
+    parser.add_argument('--castaways', type=int, default=40, help="castaways in a generated stream")
+    parser.add_argument('--record', help="write the stream that was replayed here")
+    parser.add_argument('--concurrency', type=int, default=40, help="users sending commands at once")
+    parser.add_argument('--items', type=int, default=10, help="items in the shop")
+    parser.add_argument('--rate-limit', default="5/5", help="messages per seconds discord allows in each channel")
+    parser.add_argument('--rest-ms', type=float, default=50, help="how long each discord request takes")
+    parser.add_argument('--refresh-seconds', type=float, default=0.5, help="DISPLAY_REFRESH_SECONDS for the run")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    count, per = args.rate_limit.split("/")
+
+    folder = tempfile.mkdtemp(prefix="shop_loadtest_")
+    bot_module = load_bot(folder, args.refresh_seconds)
+    stream = read_stream(args.stream) if args.stream else generate(args.generate, args.castaways, args.items, args.seed)
+    if args.record:
+        write_stream(args.record, stream)
+    harness = Harness(bot_module, (int(count), float(per)), args.rest_ms / 1000)
+    await harness.start(stream, args.items)
+    todaysShop = harness.guild_shop.shop
+    start_gold = sum(customer.wealth for customer in todaysShop.customers)
+    start_stock = {item.name: (item.price, item.quantity) for item in todaysShop.inventory}
+    print(f"Replaying {len(stream)} commands from {len(harness.guild.members)} users in {len(harness.guild.channels)} channels, "
+          f"{args.concurrency} at a time (shop files in {folder})...")
+    elapsed = await harness.replay(stream, args.concurrency)
+    await harness.settle()
+    ok = report(harness, stream, elapsed, harness.invariants(stream, start_gold, start_stock))
+    harness.close()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+class MemberIndex:
+    # every server member the bot can see, keyed by username, so looking someone up doesn't mean walking every guild's member list
+    # built once when the bot connects, then kept current from the member join/update/leave events
+    def __init__(self):
+        self._members = {} # username -> (discord id, display name)
+        self._guilds = {} # username -> ids of the guilds they're seen in, so leaving one server doesn't drop them from the index
+        self.ready = False
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, username: str):
+        return username in self._members
+
+    def rebuild(self, members):
+        self._members.clear()
+        self._guilds.clear()
+        for member in members:
+            self.add(member)
+        self.ready = True
+        print(f"Indexed {len(self)} server members.")
+
+    def add(self, member):
+        self._members[member.name] = (member.id, member.global_name)
+        self._guilds.setdefault(member.name, set()).add(member.guild.id)
+
+    def remove(self, member):
+        guilds = self._guilds.get(member.name)
+        if guilds is None:
+            return
+        guilds.discard(member.guild.id)
+        if not guilds:
+            del self._guilds[member.name]
+            del self._members[member.name]
+
+    def update(self, before, after):
+        # members and users both work here, a username or display name change comes as a user update
+        if before.name != after.name and before.name in self._members:
+            self._members[after.name] = self._members.pop(before.name)
+            self._guilds[after.name] = self._guilds.pop(before.name)
+        if after.name in self._members:
+            self._members[after.name] = (after.id, after.global_name)
+
+    def resolve(self, username: str) -> tuple[int, str]:
+        # (discord id, display name) for a username
+        if username not in self._members:
+            raise ValueError(f"Could not find user with global name '{username}' for finding Discord ID and server nickname.")
+        discord_id, nickname = self._members[username]
+        return discord_id, nickname or "No nickname"
+
+    def resolve_many(self, usernames) -> dict[str, tuple[int, str]]:
+        # looks up a whole import at once, naming everyone who couldn't be found rather than stopping at the first
+        missing = sorted({username for username in usernames if username not in self._members})
+        if missing:
+            raise ValueError(f"Could not find users with global names {', '.join(repr(username) for username in missing)}.")
+        return {username: self.resolve(username) for username in usernames}
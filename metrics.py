@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the latency histogram buckets, anything slower goes in a last +Inf bucket
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# what's being timed -> its description in the exposition file
+FAMILIES = {
+    'command': "Time from a command's checks passing to it returning",
+    'span': "Time spent in parts of the shop and bot (lookups, renders, backups, display refreshes)",
+    'discord': "Time discord took to send or edit a message, rate limit waits included",
+}
+
+class Histogram:
+    # counts per latency bucket, so memory stays the same however many observations there are
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, error: bool = False):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction: float) -> float:
+        # upper bound of the bucket the quantile falls in (the slowest observation, for the last one)
+        if not self.count:
+            return 0.0
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= fraction * self.count:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+class Metrics:
+    # latency histograms plus call and error counts for everything timed, keyed by (family, name)
+    def __init__(self):
+        self.histograms = {} # (family, name) -> Histogram
+        self.gauges = {} # name -> (description, () -> number), read whenever stats are shown or dumped
+        self.started = time.time()
+
+    def observe(self, family: str, name: str, seconds: float, error: bool = False):
+        histogram = self.histograms.get((family, name))
+        if histogram is None:
+            histogram = self.histograms[(family, name)] = Histogram()
+        histogram.observe(seconds, error)
+
+    @contextmanager
+    def span(self, family: str, name: str):
+        # times the block, counting it as an error if it raises
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(family, name, time.perf_counter() - start, error)
+
+    def gauge(self, name: str, description: str, read):
+        self.gauges[name] = (description, read)
+
+    def render(self, family: str | None = None) -> str:
+        # a table for the stats command, slowest first
+        rows = sorted(((key, histogram) for key, histogram in self.histograms.items() if family is None or key[0] == family),
+                      key=lambda row: row[1].total, reverse=True)
+        uptime = time.time() - self.started
+        output = f"Metrics over the last {uptime / 3600:.1f}h:\n"
+        for (row_family, name), histogram in rows:
+            error_rate = f", {100 * histogram.errors / histogram.count:.1f}% errors" if histogram.errors else ""
+            output += f"* {row_family} {name}: {histogram.count} calls, p50 {1000 * histogram.quantile(0.5):.2f}ms, " \
+                      f"p99 {1000 * histogram.quantile(0.99):.2f}ms, max {1000 * histogram.max:.2f}ms{error_rate}\n"
+        if not rows:
+            output += "Nothing timed yet.\n"
+        for name, (_, read) in self.gauges.items():
+            output += f"* {name}: {read()}\n"
+        return output
+
+    def exposition(self) -> str:
+        # everything in the plain text format metrics scrapers (e.g. prometheus' node exporter textfile collector) read
+        lines = []
+        for family, description in FAMILIES.items():
+            rows = [(name, histogram) for (row_family, name), histogram in sorted(self.histograms.items()) if row_family == family]
+            if not rows:
+                continue
+            metric = f"shop_{family}_seconds"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+            for name, histogram in rows:
+                label = f'name="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{label}}} {histogram.total}")
+                lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+            lines += [f"# HELP shop_{family}_errors_total Calls that raised", f"# TYPE shop_{family}_errors_total counter"]
+            lines += [f'shop_{family}_errors_total{{name="{_escape(name)}"}} {histogram.errors}' for name, histogram in rows]
+        for name, (description, read) in self.gauges.items():
+            lines += [f"# HELP shop_{name} {description}", f"# TYPE shop_{name} gauge", f"shop_{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, text: str | None = None):
+        # replaced in one go, so a scraper never reads half a file
+        text = self.exposition() if text is None else text
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+registry = Metrics() # the one the bot and the shop record into
+
+def span(name: str, family: str = 'span'):
+    return registry.span(family, name)
+
+def timed(name: str):
+    # decorator version of span, for a whole function
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with registry.span('span', name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class MetricsDumper:
+    # writes the exposition file every so often
+    def __init__(self, metrics: Metrics, path: str, interval: float):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # rendered here, so nothing changes the histograms halfway through; only the writing is done on a thread
+                await asyncio.to_thread(self.metrics.write, self.path, self.metrics.exposition())
+            except OSError as e:
+                print(f"Couldn't write metrics to {self.path}... {e}")
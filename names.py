@@ -0,0 +1,123 @@
+import bisect
+
+# suggestions scoring under this (out of 1, see NameIndex.suggest) are too far off to be worth offering
+MIN_SIMILARITY = 0.25
+# trigrams more names than this have are only checked against the names already found by rarer ones (see NameIndex.suggest)
+COMMON_TRIGRAM = 64
+
+def normalize(name: str) -> str:
+    return name.strip().strip('"').lower() # remove quotes if user included them
+
+def trigrams(key: str) -> set[str]:
+    # padded so short names still have a few, and the start of a name counts for more than the middle
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    # names (of items, or customers' aliases) split into trigrams, so something that doesn't match any name exactly can be matched
+    # to the names it was most likely meant to be without comparing it against every one of them; kept in step with the names
+    # it indexes by whoever owns it, rather than rebuilt for every lookup
+    def __init__(self, names = ()):
+        self._names = {} # key -> [name as it was first added, times added, how many trigrams it has], insertion ordered
+        self._grams = {} # trigram -> keys that have it
+        self._sorted = [] # keys in order, for completing prefixes
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name: str):
+        return normalize(name) in self._names
+
+    def add(self, name: str):
+        # the same name can be added more than once (e.g. two customers called Sam), it stays until removed as often
+        key = normalize(name)
+        entry = self._names.get(key)
+        if entry is not None:
+            entry[1] += 1
+            return
+        grams = trigrams(key)
+        self._names[key] = [name, 1, len(grams)]
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(key)
+        bisect.insort(self._sorted, key)
+
+    def remove(self, name: str):
+        key = normalize(name)
+        entry = self._names.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del self._names[key]
+        for gram in trigrams(key):
+            keys = self._grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self._grams[gram]
+        del self._sorted[bisect.bisect_left(self._sorted, key)]
+
+    def clear(self):
+        self._names.clear()
+        self._grams.clear()
+        self._sorted.clear()
+
+    def suggest(self, text: str, limit: int = 3) -> list[str]:
+        # the names most like text, best first: ones starting with it, then by how many trigrams they share with it
+        query = normalize(text)
+        if not query:
+            return []
+        grams = trigrams(query)
+        shared = {} # key -> trigrams it has in common with query
+        # rarest trigrams first: once a trigram is common and there are fewer candidates than names with it, only the candidates
+        # are checked for it, so a trigram most names have (e.g. the start of "customer...") doesn't mean going through all of them
+        for gram in sorted(grams, key=lambda gram: len(self._grams.get(gram, ()))):
+            keys = self._grams.get(gram, ())
+            if shared and len(keys) > max(len(shared), COMMON_TRIGRAM):
+                for key in shared:
+                    if key in keys:
+                        shared[key] += 1
+            else:
+                for key in keys:
+                    shared[key] = shared.get(key, 0) + 1
+        scored = []
+        for key, count in shared.items():
+            score = 2 * count / (len(grams) + self._names[key][2])
+            if key.startswith(query):
+                score += 1
+            if score >= MIN_SIMILARITY:
+                scored.append((-score, key))
+        scored.sort()
+        return [self._names[key][0] for _, key in scored[:limit]]
+
+    def complete(self, text: str, limit: int = 25) -> list[str]:
+        # for autocomplete: names starting with text in alphabetical order, topped up with the closest other names
+        # (everything, in the order it was added, when nothing has been typed yet)
+        query = normalize(text)
+        if not query:
+            return [entry[0] for entry in list(self._names.values())[:limit]]
+        start = bisect.bisect_left(self._sorted, query)
+        keys = []
+        for key in self._sorted[start:start + limit]:
+            if not key.startswith(query):
+                break
+            keys.append(key)
+        names = [self._names[key][0] for key in keys]
+        if len(names) < limit:
+            names += [name for name in self.suggest(query, limit) if normalize(name) not in keys][:limit - len(names)]
+        return names
+
+def did_you_mean(suggestions: list[str]) -> str:
+    # the end of a "couldn't find that" message
+    if not suggestions:
+        return "did you misspell it?"
+    return f"did you mean {' or '.join(f'**{suggestion}**' for suggestion in suggestions)}?"
+
+def suggestion(suggestions: list[str]) -> str:
+    # a sentence to tack onto a "couldn't find that" message, or nothing if nothing was close
+    if not suggestions:
+        return ""
+    sentence = did_you_mean(suggestions)
+    return f" {sentence[0].upper()}{sentence[1:]}"
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import metrics
+import render
+
+# lower goes first
+REPLY = 0 # answers to someone's command
+BACKGROUND = 1 # e.g. refreshing shop displays, nobody is waiting on these
+
+class _Job:
+    def __init__(self, kind: str, deliver, content: str | None, kwargs: dict, key, wait: bool):
+        self.kind = kind # "send", "edit", or "mark" (nothing to send, see Outbox.delivered)
+        self.deliver = deliver # async (content, **kwargs) -> result
+        self.content = content
+        self.kwargs = kwargs
+        self.key = key # sends with the same key (e.g. the command's message id) can be merged
+        self.future = asyncio.get_running_loop().create_future() if wait else None
+        self.queued = time.perf_counter()
+
+class Outbox:
+    # everything the bot sends or edits, queued per channel (which is also discord's rate limit bucket for messages) and
+    # sent one at a time per channel: replies before background edits, and consecutive sends from one command merged into
+    # one message when they fit
+    def __init__(self, limit: int = render.MESSAGE_LIMIT):
+        self.limit = limit
+        self._queues = {} # channel id -> heap of (priority, order, job)
+        self._workers = {} # channel id -> task sending that channel's queue, only while it has anything in it
+        self._order = itertools.count()
+        self.sent = 0
+        self.merged = 0 # sends that went out as part of another message
+        self.edits = 0
+        self.failed = 0
+        self.waits = {} # channel id -> [requests, total seconds queued, longest seconds queued]
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def send(self, channel, content: str | None = None, priority: int = REPLY, key = None, wait: bool = False, sender = None, **kwargs):
+        # queues a message for channel; returns the sent message if wait, otherwise returns right away with None
+        # sender replaces channel.send (e.g. a command context's send), kwargs go to it as-is and keep the message from being merged
+        job = _Job("send", sender or channel.send, content, kwargs, key, wait)
+        self._put(channel.id, priority, job)
+        return await job.future if wait else None
+
+    async def edit(self, channel, message, content: str, priority: int = BACKGROUND, wait: bool = False):
+        # queues an edit to one of the bot's messages in channel
+        job = _Job("edit", lambda content: message.edit(content=content), content, {}, None, wait)
+        self._put(channel.id, priority, job)
+        return await job.future if wait else None
+
+    async def delivered(self, channel, priority: int = REPLY):
+        # returns once everything queued for channel so far, at priority or ahead of it, has been sent
+        job = _Job("mark", None, None, {}, None, True)
+        self._put(channel.id, priority, job)
+        await job.future
+
+    async def flush(self):
+        # returns once every queue is empty
+        while self._workers:
+            await asyncio.wait(list(self._workers.values()))
+
+    def _put(self, channel_id: int, priority: int, job: _Job):
+        heapq.heappush(self._queues.setdefault(channel_id, []), (priority, next(self._order), job))
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    def _mergeable(self, jobs: list[_Job], job: _Job) -> bool:
+        first = jobs[0]
+        return first.kind == job.kind == "send" and first.key is not None and job.key == first.key \
+               and not first.kwargs and not job.kwargs and job.future is None and first.content is not None and job.content is not None \
+               and len(self._merge([*jobs, job])) <= self.limit
+
+    @staticmethod
+    def _merge(jobs: list[_Job]) -> str:
+        parts = []
+        for job in jobs:
+            if parts and not parts[-1].endswith("\n"):
+                parts.append("\n")
+            parts.append(job.content)
+        return "".join(parts)
+
+    async def _drain(self, channel_id: int):
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                _, _, job = heapq.heappop(queue)
+                jobs = [job]
+                while queue and self._mergeable(jobs, queue[0][2]):
+                    jobs.append(heapq.heappop(queue)[2])
+                await self._deliver(channel_id, jobs)
+        finally:
+            del self._workers[channel_id]
+            if not queue:
+                del self._queues[channel_id]
+
+    async def _deliver(self, channel_id: int, jobs: list[_Job]):
+        if jobs[0].kind == "mark":
+            jobs[0].future.set_result(None)
+            return
+        started = time.perf_counter()
+        waits = self.waits.setdefault(channel_id, [0, 0.0, 0.0])
+        for job in jobs:
+            waits[0] += 1
+            waits[1] += started - job.queued
+            waits[2] = max(waits[2], started - job.queued)
+            metrics.registry.observe('span', 'outbox_wait', started - job.queued)
+        first = jobs[0]
+        try:
+            with metrics.span(first.kind, family='discord'):
+                result = await first.deliver(self._merge(jobs) if len(jobs) > 1 else first.content, **first.kwargs)
+        except Exception as e:
+            self.failed += 1
+            if first.future is not None:
+                first.future.set_exception(e)
+            else:
+                print(f"Couldn't {first.kind} a message in channel {channel_id}... {e}")
+            return
+        if first.kind == "edit":
+            self.edits += 1
+        else:
+            self.sent += 1
+            self.merged += len(jobs) - 1
+        if first.future is not None:
+            first.future.set_result(result)
+
+    def stats(self) -> str:
+        output = f"Outbox: {len(self)} queued in {len(self._queues)} channels, {self.sent} sent ({self.merged} more merged into them), " \
+                 f"{self.edits} edits, {self.failed} failed"
+        busiest = sorted(self.waits.items(), key=lambda entry: entry[1][2], reverse=True)[:3]
+        for channel_id, (requests, total, longest) in busiest:
+            output += f"\n* <#{channel_id}>: {requests} requests, {1000 * total / requests:.0f}ms average wait, {1000 * longest:.0f}ms longest"
+        return output
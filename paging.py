@@ -0,0 +1,60 @@
+import discord
+
+import render
+
+PAGE_VIEW_TIMEOUT = 300 # seconds the page buttons keep working after the last press
+NOTHING_TO_SHOW = "*(Nothing to show here.)*" # sent instead of an empty message when there are no pages at all
+
+class PageView(discord.ui.View):
+    # previous/next buttons under a paged message, rendering each page only when someone turns to it
+    def __init__(self, pages: render.Pages, author_id: int | None = None):
+        super().__init__(timeout=PAGE_VIEW_TIMEOUT)
+        self.pages = pages
+        self.author_id = author_id # only whoever asked can turn the pages, None for anyone
+        self.current = 0
+        self.message = None
+
+    def content(self) -> str:
+        total = f"/{len(self.pages)}" if self.pages.done else ""
+        return self.pages.page(self.current) + f"\n-# page {self.current + 1}{total}"
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.current == 0
+        self.next_page.disabled = not self.pages.has_page(self.current + 1)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return self.author_id is None or interaction.user.id == self.author_id
+
+    async def _turn(self, interaction: discord.Interaction, step: int):
+        self.current += step
+        self._update_buttons()
+        await interaction.response.edit_message(content=self.content(), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._turn(interaction, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._turn(interaction, 1)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+async def send_pages(destination, pages: render.Pages, author_id: int | None = None):
+    # sends the first page, with buttons to page through the rest if there's more than one; returns the message
+    if not pages.has_page(1):
+        return await destination.send(pages.page(0) or pages.header + NOTHING_TO_SHOW)
+    view = PageView(pages, author_id)
+    view._update_buttons()
+    view.message = await destination.send(view.content(), view=view)
+    return view.message
+
+async def send_long(destination, text: str):
+    # sends text as however many messages it takes, cut at line breaks
+    for message in render.chunk(text.splitlines(keepends=True)):
+        await destination.send(message)
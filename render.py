@@ -0,0 +1,91 @@
+from collections import OrderedDict
+
+class RenderCache:
+    # remembers rendered text (or Pages) per (view, object, parameters), reusable until the object's version number moves on
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # (view, id(owner), params) -> (owner, version, text), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, view: str, owner, version: int, params: tuple, render):
+        key = (view, id(owner), params)
+        entry = self.entries.get(key)
+        # the owner is kept in the entry, so its id can't be handed to a new object while the entry exists
+        if entry is not None and entry[0] is owner and entry[1] == version:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[2]
+        self.misses += 1
+        text = render()
+        self.entries[key] = (owner, version, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return text
+
+    def forget(self, owners):
+        # drops everything rendered for these objects, e.g. a shop and its customers once it's unloaded, so the cache doesn't keep them alive
+        ids = {id(owner) for owner in owners}
+        for key in [key for key, entry in self.entries.items() if id(entry[0]) in ids]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = f"{100 * self.hits / lookups:.1f}%" if lookups else "n/a"
+        return f"Render cache: {self.hits} hits, {self.misses} misses ({hit_rate} hit rate), {len(self.entries)}/{self.max_entries} entries"
+
+MESSAGE_LIMIT = 2000 # the most characters discord allows in one message
+
+def _split_block(block: str, limit: int):
+    # pieces of a block too long for one message, cut after newlines where there are any
+    while len(block) > limit:
+        cut = block.rfind("\n", 0, limit) + 1 or limit
+        yield block[:cut]
+        block = block[cut:]
+    if block:
+        yield block
+
+def chunk(blocks, limit: int = MESSAGE_LIMIT):
+    # joins blocks of text (each kept whole where possible, e.g. one item and its description) into messages of at most limit characters
+    page, size = [], 0
+    for block in blocks:
+        for piece in (_split_block(block, limit) if len(block) > limit else (block,)):
+            if page and size + len(piece) > limit:
+                yield "".join(page)
+                page, size = [], 0
+            page.append(piece)
+            size += len(piece)
+    if page:
+        yield "".join(page)
+
+class Pages:
+    # a long rendering split into messages, split only as far as the furthest page anyone has asked for. the blocks are all
+    # read when it's made, so every page shows the same moment even if what they came from changes while someone pages through
+    FOOTER_SPACE = 40 # room kept on each page for a "page x" line
+
+    def __init__(self, blocks, limit: int = MESSAGE_LIMIT, header: str = ""):
+        self._chunks = chunk(list(blocks), limit - self.FOOTER_SPACE - len(header))
+        self.header = header # repeated at the top of every page
+        self._pages = []
+        self.done = False # whether the last page has been reached
+
+    def page(self, n: int) -> str | None:
+        # the nth page (from 0), or None if there aren't that many
+        while len(self._pages) <= n and not self.done:
+            next_page = next(self._chunks, None)
+            if next_page is None:
+                self.done = True
+            else:
+                self._pages.append(next_page)
+        return self.header + self._pages[n] if n < len(self._pages) else None
+
+    def has_page(self, n: int) -> bool:
+        return self.page(n) is not None
+
+    def __len__(self):
+        # pages worked out so far (all of them once done is True)
+        return len(self._pages)
@@ -0,0 +1,159 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import render
+
+CANCEL_WORDS = ('cancel', 'stop')
+
+class SessionEnded(Exception):
+    # a prompt was abandoned partway, nothing after it happened
+    pass
+
+class SessionCancelled(SessionEnded):
+    pass
+
+class SessionTimedOut(SessionEnded):
+    pass
+
+class SessionBusy(Exception):
+    # the user is already in the middle of answering another command's questions
+    pass
+
+class Step:
+    # one question in a Flow
+    # prompt is the text to send, or a function of the answers so far that returns it
+    # parse turns the reply into the answer (raising ValueError re-asks with the error's message), default is the text as-is
+    # next names the step after this one, or is a function of the answers returning that name (None ends the flow);
+    # by default it's the step listed after this one
+    def __init__(self, name: str, prompt, parse = None, next = ..., timeout: float | None = None):
+        self.name = name
+        self.prompt = prompt
+        self.parse = parse
+        self.next = next
+        self.timeout = timeout
+
+class Flow:
+    # a multi-step conversation written down as its steps, run with SessionManager.run
+    def __init__(self, *steps: Step):
+        self.steps = {step.name: step for step in steps}
+        self.first = steps[0].name
+        self._following = {step.name: following.name for step, following in zip(steps, steps[1:])}
+
+    def after(self, step: Step, answers: dict) -> Step | None:
+        name = self._following.get(step.name) if step.next is ... else step.next(answers) if callable(step.next) else step.next
+        return self.steps[name] if name is not None else None
+
+class Session:
+    def __init__(self, manager, channel, author, send = None):
+        self.manager = manager
+        self.channel = channel
+        self.author = author
+        self.send = send or channel.send # e.g. the command's ctx.send, so prompts stay in order with its other replies
+        self._reply = None # future for the reply currently being waited on
+
+    def feed(self, message) -> bool:
+        if self._reply is None or self._reply.done():
+            return False
+        self._reply.set_result(message)
+        return True
+
+    async def ask(self, prompt: str | None, timeout: float | None = None) -> str:
+        # sends the prompt and waits for this user's next message in this channel
+        if prompt:
+            for message in render.chunk(prompt.splitlines(keepends=True)): # e.g. a long customer list
+                await self.send(message)
+        self._reply = asyncio.get_running_loop().create_future()
+        try:
+            message = await asyncio.wait_for(self._reply, timeout or self.manager.timeout)
+        except asyncio.TimeoutError:
+            self.manager.timeouts += 1
+            raise SessionTimedOut("No response received, so I stopped waiting... nothing was changed.")
+        finally:
+            self._reply = None
+        if message.content.strip().lower() in CANCEL_WORDS:
+            self.manager.cancelled += 1
+            raise SessionCancelled("Cancelled, nothing was changed.")
+        return message.content
+
+class SessionManager:
+    # every open prompt, keyed by (channel, author) so an incoming message finds its prompt in one lookup
+    # instead of being run past every pending bot.wait_for check; each user can only be in one at a time
+    def __init__(self, timeout: float, ignore_prefix = None):
+        self.timeout = timeout # default seconds to wait for each reply
+        self.ignore_prefix = ignore_prefix # messages starting with this (commands) are never taken as replies; a str, or (message) -> str
+        self._sessions = {} # (channel id, author id) -> Session
+        self._users = {} # author id -> (channel id, author id), for the one-at-a-time rule
+        self.started = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def waiting(self, channel_id: int, author_id: int) -> bool:
+        # whether a prompt in that channel is waiting on that user's answer right now
+        session = self._sessions.get((channel_id, author_id))
+        return session is not None and session._reply is not None and not session._reply.done()
+
+    def dispatch(self, message) -> bool:
+        # hands the message to the prompt waiting on it; False if nobody was, so it should be handled as usual
+        prefix = self.ignore_prefix(message) if callable(self.ignore_prefix) else self.ignore_prefix
+        if prefix and message.content.startswith(prefix):
+            return False
+        session = self._sessions.get((message.channel.id, message.author.id))
+        return session is not None and session.feed(message)
+
+    @asynccontextmanager
+    async def session(self, channel, author, send = None):
+        if author.id in self._users:
+            raise SessionBusy("You're still answering one of my earlier questions... finish that first, or say 'cancel'.")
+        key = (channel.id, author.id)
+        session = Session(self, channel, author, send)
+        self._sessions[key] = session
+        self._users[author.id] = key
+        self.started += 1
+        try:
+            yield session
+        finally:
+            del self._sessions[key]
+            del self._users[author.id]
+
+    async def ask(self, ctx, prompt: str, parse = None, timeout: float | None = None):
+        # a one-question flow
+        return (await self.run(ctx, Flow(Step('answer', prompt, parse=parse, timeout=timeout))))['answer']
+
+    async def run(self, ctx, flow: Flow, answers: dict | None = None) -> dict:
+        # walks the flow's steps with the command's author, returning every step's answer by name
+        answers = dict(answers or {})
+        async with self.session(ctx.channel, ctx.author, ctx.send) as session:
+            step = flow.steps[flow.first]
+            retrying = False
+            while step is not None:
+                prompt = None if retrying else step.prompt(answers) if callable(step.prompt) else step.prompt
+                reply = await session.ask(prompt, step.timeout)
+                try:
+                    answers[step.name] = step.parse(reply) if step.parse else reply
+                except ValueError as e:
+                    await ctx.send(f"{e} Try again (or say 'cancel'):")
+                    retrying = True
+                    continue
+                retrying = False
+                step = flow.after(step, answers)
+        return answers
+
+    def stats(self) -> str:
+        return f"Prompts: {len(self)} open, {self.started} started, {self.timeouts} timed out, {self.cancelled} cancelled"
+
+# common ways to read a reply
+def optional_text(reply: str) -> str | None:
+    # 'none' means no answer
+    return None if reply.strip().lower() == 'none' else reply.strip('"')
+
+def whole_number(reply: str) -> int:
+    try:
+        return int(reply.strip())
+    except ValueError:
+        raise ValueError(f"'{reply}' isn't a whole number.")
+
+def yes(reply: str) -> bool:
+    return reply.strip().lower() == 'yes'
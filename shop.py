@@ -1,160 +1,844 @@
+import asyncio
 import json
 import os
+import weakref
 import discord
-from datetime import timedelta
+from abc import ABC, abstractmethod
 
 from config import *
+import backups
+import metrics
+from names import NameIndex, did_you_mean
+from storage import JsonStorage, Storage
+from transactions import LockTable
+from render import Pages, RenderCache
+
+render_cache = RenderCache()
+
+class ItemDefinition:
+    # what an item is, as opposed to how many of it there are. one is shared by the shop's stack of an item and every
+    # customer's stack of it, so it can never change once made; ask define() for one with different details instead
+    __slots__ = ('name', 'price', 'description', 'description_on_use', '__weakref__')
+
+    def __init__(self, name: str, price: int, description: str | None, description_on_use: str | None):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'price', price)
+        object.__setattr__(self, 'description', description)
+        object.__setattr__(self, 'description_on_use', description_on_use)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Item definitions can't be changed, use replace() to get one with a different {name}.")
+
+    def __delattr__(self, name):
+        raise AttributeError("Item definitions can't be changed.")
+
+    def __repr__(self):
+        return f"ItemDefinition({self.name!r}, {self.price!r})"
+
+    def replace(self, **fields) -> 'ItemDefinition':
+        return define(**{**self.to_dict(), **fields})
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'price': self.price, 'description': self.description, 'description_on_use': self.description_on_use}
+
+_definitions = weakref.WeakValueDictionary() # (name, price, description, description_on_use) -> the ItemDefinition for it, while anything uses it
+
+def define(name: str, price: int = 0, description: str | None = None, description_on_use: str | None = None) -> ItemDefinition:
+    # the one definition with these details, so however many stacks of an item there are, its descriptions are kept once
+    key = (name, price, description, description_on_use)
+    definition = _definitions.get(key)
+    if definition is None:
+        definition = _definitions[key] = ItemDefinition(name, price, description, description_on_use)
+    return definition
 
 class Item:
+    # a stack of some item: which one, and how many. the shop's stock and customers' inventories hold these, so each
+    # owned item costs the same few bytes however long its descriptions are
+    __slots__ = ('definition', 'quantity')
+
     def __init__(self, name: str, price: int = 0, quantity: int = 1, \
                  description: str | None = None, description_on_use: str | None = None):
-        self.name = name
-        self.price = price
+        self.definition = define(name, price, description, description_on_use)
         self.quantity = quantity
-        self.description = description
-        self.description_on_use = description_on_use
-    
+
+    @classmethod
+    def stack(cls, definition: ItemDefinition, quantity: int = 1) -> 'Item':
+        item = object.__new__(cls)
+        item.definition = definition
+        item.quantity = quantity
+        return item
+
+    @classmethod
+    def from_dict(cls, data: dict, definitions: list[ItemDefinition] | None = None) -> 'Item':
+        # either a stack as written in backups since definitions were shared ({'item': its definition's index in definitions,
+        # 'quantity': n}), or an item with all its details (older backups, the journal, item files)
+        if 'item' in data:
+            return cls.stack(definitions[data['item']], data['quantity'])
+        return cls(**data)
+
+    def to_dict(self) -> dict:
+        return {**self.definition.to_dict(), 'quantity': self.quantity}
+
+    @property
+    def name(self) -> str:
+        return self.definition.name
+
+    @property
+    def price(self) -> int:
+        return self.definition.price
+
+    @property
+    def description(self) -> str | None:
+        return self.definition.description
+
+    @property
+    def description_on_use(self) -> str | None:
+        return self.definition.description_on_use
+
     def discountHalf(self):
-        self.price = (self.price // 2) + 1
+        self.definition = self.definition.replace(price=(self.price // 2) + 1)
 
     def use(self):
         return self.description_on_use or f"You used the {self.name}!"
      
     def copy(self):
-        return Item(self.name, self.price, self.quantity, self.description, self.description_on_use)  
+        return Item.stack(self.definition, self.quantity)
+
+class ItemCollection(ABC):
+    # items kept in insertion order and keyed by lowercased name, so lookups don't have to scan
+    def __init__(self, items = ()):
+        self._items = {}
+        self.version = 0 # bumped on every change, so rendered views know when they're stale
+        self.on_change = None # called after every change (a customer uses this to notice its inventory changing)
+        self._names = None # the items' names for suggestions, only built once something's been looked for and not found
+        for item in items:
+            self.add(item)
+
+    def _changed(self):
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change()
+
+    def _named(self, item: Item):
+        if self._names is not None:
+            self._names.add(item.name)
+
+    def _unnamed(self, item: Item):
+        if self._names is not None:
+            self._names.remove(item.name)
+
+    @property
+    def names(self) -> NameIndex:
+        if self._names is None:
+            self._names = NameIndex(item.name for item in self._items.values())
+        return self._names
+
+    def suggest(self, item_name: str, limit: int = 3) -> list[str]:
+        # names of the items most like item_name, for when there's nothing called that
+        return self.names.suggest(item_name, limit)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item_name: str):
+        return item_name.lower() in self._items
+
+    def get(self, item_name: str) -> Item | None:
+        return self._items.get(item_name.lower())
+
+    @abstractmethod
+    def add(self, item: Item):
+        # how an item joins the collection differs: the shop refuses a second stack of something, an inventory merges them
+        ...
+
+    def remove(self, item_name: str) -> Item:
+        item = self._items.pop(item_name.lower())
+        self._unnamed(item)
+        self._changed()
+        return item
+
+    def clear(self):
+        self._items.clear()
+        if self._names is not None:
+            self._names.clear()
+        self._changed()
+
+class Catalog(ItemCollection):
+    # the shop's stock, one entry per item name
+    def add(self, item: Item):
+        if item.name.lower() in self._items:
+            raise ValueError(f"The shop already stocks an item called {self._items[item.name.lower()].name}.")
+        self._items[item.name.lower()] = item
+        self._named(item)
+        self._changed()
+
+    def decrement(self, item_name: str) -> Item:
+        # takes one off the shelf, dropping the item once it's sold out
+        item = self._items[item_name.lower()]
+        item.quantity += -1
+        if item.quantity < 1:
+            del self._items[item_name.lower()]
+            self._unnamed(item)
+        self._changed()
+        return item
+
+    def set_quantity(self, item_name: str, quantity: int) -> Item:
+        item = self._items[item_name.lower()]
+        item.quantity = quantity
+        self._changed()
+        return item
+
+    def update(self, item_name: str, fields: dict) -> Item:
+        # changes some of an item's details (its name stays the same); only the shop's stack gets the new definition,
+        # what customers already own stays as it was
+        item = self._items[item_name.lower()]
+        details = {field: value for field, value in fields.items() if field not in ('name', 'quantity')}
+        if details:
+            item.definition = item.definition.replace(**details)
+        if 'quantity' in fields:
+            item.quantity = fields['quantity']
+        self._changed()
+        return item
+
+class Inventory(ItemCollection):
+    # a customer's belongings, items with the same name always share one stack
+    def add(self, item: Item):
+        stack = self._items.get(item.name.lower())
+        if stack is None:
+            self._items[item.name.lower()] = item
+            self._named(item)
+        else:
+            stack.quantity += item.quantity
+        self._changed()
+
+    def take(self, item_name: str, quantity: int = 1) -> Item:
+        # splits quantity units off the named stack and returns them as their own item
+        stack = self._items[item_name.lower()]
+        if quantity > stack.quantity:
+            raise ValueError(f"Only {stack.quantity}x {stack.name} to take from.")
+        if quantity == stack.quantity:
+            return self.remove(item_name)
+        stack.quantity += -quantity
+        taken = Item.stack(stack.definition, quantity)
+        self._changed()
+        return taken
+
+    def adjust(self, changes: list[dict]):
+        # each change is an item and how many more of it to have, or fewer if negative (never going below none)
+        for data in changes:
+            stack = self._items.get(data['name'].lower())
+            if data['quantity'] > 0:
+                self.add(Item(**data))
+            elif stack is not None:
+                self.take(stack.name, min(-data['quantity'], stack.quantity))
+
 class Customer:
     def __init__(self, realname: str, discordIDstr: str, servernickname: str, discordIDint: int, wealth: int | None = 0, tribe: str | None = None):
+          self._version = 0
+          self._registry = None # the CustomerRegistry this customer is in, told about every change so it can reindex
+          self._inventory = None
+          self._raw_inventory = None # inventory as unparsed JSON, until something first needs it
+          self._raw_definitions = None # the item definitions the unparsed inventory refers to, if it came from a backup that shares them
           self.realname = realname
           self.discordIDstr = discordIDstr
           self.servernickname = servernickname
           self.discordIDint = discordIDint
           self.tribe = tribe
           self.wealth = wealth
-          self.inventory = []
+          self.inventory = Inventory()
+
+    def __setattr__(self, name, value):
+        old_value = self.__dict__.get(name)
+        object.__setattr__(self, name, value)
+        if name.startswith('_'):
+            return
+        if name == 'inventory':
+            value.on_change = self._changed
+        self._changed(name, old_value)
+
+    def _changed(self, field: str | None = None, old_value = None):
+        self._version += 1
+        if self._registry is not None:
+            self._registry._member_changed(self, field, old_value)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def inventory(self) -> Inventory:
+        if self._inventory is None:
+            self._inventory = Inventory(Item.from_dict(item, self._raw_definitions) for item in json.loads(self._raw_inventory))
+            self._inventory.on_change = self._changed
+            self._raw_inventory = None
+            self._raw_definitions = None
+        return self._inventory
+
+    @inventory.setter
+    def inventory(self, inventory: Inventory):
+        self._inventory = inventory
+        self._raw_inventory = None
+        self._raw_definitions = None
+
+    def to_dict(self, definition_ids: dict | None = None) -> dict:
+        # with definition_ids (ItemDefinition -> its index in a backup's list of definitions, added to as new ones turn up)
+        # the inventory refers to definitions by index, otherwise every item is written out in full
+        return {'servernickname': self.servernickname,
+                'discordIDstr': self.discordIDstr,
+                'realname': self.realname,
+                'discordIDint': self.discordIDint,
+                'tribe': self.tribe,
+                'wealth': self.wealth, 
+                'inventory': self._inventory_data(definition_ids)
+                }
+
+    def _inventory_data(self, definition_ids: dict | None) -> list[dict]:
+        if self._inventory is None:
+            entries = json.loads(self._raw_inventory)
+            if definition_ids is None and self._raw_definitions is None:
+                return entries # an inventory nobody has looked at since loading is copied straight from its JSON
+            items = [Item.from_dict(entry, self._raw_definitions) for entry in entries]
+        else:
+            items = self.inventory
+        if definition_ids is None:
+            return [item.to_dict() for item in items]
+        return [{'item': definition_ids.setdefault(item.definition, len(definition_ids)), 'quantity': item.quantity} for item in items]
+
+    @classmethod
+    def from_dict(cls, customer_data: dict, raw_inventory: str | None = None, definitions: list[ItemDefinition] | None = None):
+        # definitions are the ones the backup being loaded shares between stacks, see Shop.snapshot
+        customer = cls(
+            servernickname = customer_data['servernickname'],
+            discordIDstr = customer_data['discordIDstr'],
+            realname = customer_data['realname'],
+            discordIDint = customer_data['discordIDint'],
+            tribe = customer_data.get('tribe'),
+            wealth = customer_data['wealth']
+        )
+        if raw_inventory is not None:
+            object.__setattr__(customer, '_inventory', None)
+            object.__setattr__(customer, '_raw_inventory', raw_inventory)
+            object.__setattr__(customer, '_raw_definitions', definitions or None)
+        else:
+            customer.inventory = Inventory(Item.from_dict(item, definitions) for item in customer_data.get('inventory', []))
+        return customer
     
     def add_item(self, item: Item):
-         self.inventory.append(item)
+         self.inventory.add(item)
          
     def buy(self, newItem: Item):
         newItem.quantity = 1
         if newItem.price > self.wealth:
              raise Exception("Sorry, something went VERY wrong in my code... Tell Kaiden 'Exit code 0'.") 
         self.wealth = self.wealth - newItem.price
-        for item in self.inventory:
-            if item.name.lower() == newItem.name.lower():
-                item.quantity += 1
-                return
-        del newItem.price
-        self.inventory.append(newItem)
+        self.inventory.add(newItem)
     
     def use(self, requestedItemName: str) -> str:
-        for item in self.inventory:
-             if item.name.lower() == requestedItemName.lower():
-                item.quantity += -1
-                if item.quantity <= 0:
-                    self.inventory.remove(item)
-                return item.use()
-        return f"No item in your inventory by the name of {requestedItemName}... did you misspell it?"
+        if requestedItemName not in self.inventory:
+            return f"No item in your inventory by the name of {requestedItemName}... {did_you_mean(self.inventory.suggest(requestedItemName))}"
+        return self.inventory.take(requestedItemName).use()
     
     def check_inventory(self) -> str:
-        output = ''
+        return render_cache.get('inventory', self, self.version, (), self._render_inventory)
+
+    def inventory_pages(self) -> Pages:
+        # cached like check_inventory, so paging through an unchanged inventory again doesn't render it again
+        return render_cache.get('inventory pages', self, self.version, (), lambda: Pages(self._inventory_blocks()))
+
+    def _render_inventory(self) -> str:
+        return "".join(self._inventory_blocks())
+
+    def _inventory_blocks(self):
+        # the inventory a piece at a time (one per line or item), so it can be split across messages without cutting an item in half
+        empty = True
         if self.wealth > 0:
-            output += f"* {self.wealth}x Gold Coins \n"
+            empty = False
+            yield f"* {self.wealth}x Gold Coins \n"
         for item in self.inventory:
-             output += f"* {item.quantity}x {item.name}{":\n-# \"" + item.description + "\"\n" if item.description else "\n"}"
-        if output == '':
-            return "Nothing! It seems material wealth alludes you..."
-        else: 
-            return output
+            empty = False
+            yield f"* {item.quantity}x {item.name}{":\n-# \"" + item.description + "\"\n" if item.description else "\n"}"
+        if empty:
+            yield "Nothing! It seems material wealth alludes you..."
          
-    def give(self, item_name: str, recipient) -> str:
-        for item in self.inventory:
-            if item.name == item_name:
-                self.inventory.remove(item)
-                recipient.add_item(item)
-                return f"Successfully gave {item_name} to {recipient.realname}!"
-        return f"No item in your inventory by the name of {item_name}... did you misspell it?"
+    def give(self, item_name: str, recipient, quantity: int = 1) -> str:
+        if item_name not in self.inventory:
+            return f"No item in your inventory by the name of {item_name}... {did_you_mean(self.inventory.suggest(item_name))}"
+        if quantity > self.inventory.get(item_name).quantity:
+            return f"You only have {self.inventory.get(item_name).quantity}x {item_name} to give."
+        recipient.add_item(self.inventory.take(item_name, quantity))
+        return f"Successfully gave {item_name} to {recipient.realname}!"
+class AmbiguousCustomerError(Exception):
+    def __init__(self, user_identifier, matches):
+        self.user_identifier = user_identifier
+        self.matches = matches
+        super().__init__(f"'{user_identifier}' could refer to more than one customer: {', '.join(customer.realname for customer in matches)}. Try their discord username instead.")
+
+class CustomerRegistry:
+    # fields a customer can be looked up by; an exact discord username wins outright, the names after it are searched together
+    ALIAS_FIELDS = ('discordIDstr', 'realname', 'servernickname')
+
+    def __init__(self, customers = ()):
+        self._customers = {} # insertion ordered, used as an ordered set
+        self._by_id_int = {}
+        self._by_alias = {field: {} for field in self.ALIAS_FIELDS}
+        self._by_tribe = {} # tribe -> its members, insertion ordered like _customers
+        self._names = None # every alias for suggestions, only built once a customer's been looked for and not found
+        self.version = 0 # bumped when customers join, leave or change
+        for customer in customers:
+            self.add(customer)
+
+    def __iter__(self):
+        return iter(list(self._customers))
+
+    def __len__(self):
+        return len(self._customers)
+
+    def __contains__(self, customer):
+        return customer in self._customers
+
+    def add(self, customer: Customer):
+        if customer in self._customers:
+            return
+        self._customers[customer] = None
+        self._index(customer)
+        customer._registry = self
+        self.version += 1
+
+    def remove(self, customer: Customer):
+        del self._customers[customer]
+        self._unindex(customer)
+        customer._registry = None
+        self.version += 1
+
+    def clear(self):
+        for customer in self._customers:
+            customer._registry = None
+        self._customers.clear()
+        self._by_id_int.clear()
+        for index in self._by_alias.values():
+            index.clear()
+        self._by_tribe.clear()
+        if self._names is not None:
+            self._names.clear()
+        self.version += 1
+
+    def _member_changed(self, customer: Customer, field: str | None, old_value):
+        # keeps the indexes right when a customer's name or ID is edited in place
+        if field == 'discordIDint':
+            self._discard(self._by_id_int, old_value, customer)
+            self._by_id_int.setdefault(customer.discordIDint, []).append(customer)
+        elif field in self.ALIAS_FIELDS:
+            if old_value is not None:
+                self._discard(self._by_alias[field], str(old_value).lower(), customer)
+                if self._names is not None:
+                    self._names.remove(str(old_value))
+            if getattr(customer, field) is not None:
+                self._by_alias[field].setdefault(str(getattr(customer, field)).lower(), []).append(customer)
+                if self._names is not None:
+                    self._names.add(str(getattr(customer, field)))
+        elif field == 'tribe':
+            self._leave_tribe(old_value, customer)
+            self._by_tribe.setdefault(customer.tribe, {})[customer] = None
+        self.version += 1
+
+    def _index(self, customer: Customer):
+        self._by_id_int.setdefault(customer.discordIDint, []).append(customer)
+        for field in self.ALIAS_FIELDS:
+            value = getattr(customer, field)
+            if value is not None:
+                self._by_alias[field].setdefault(str(value).lower(), []).append(customer)
+                if self._names is not None:
+                    self._names.add(str(value))
+        self._by_tribe.setdefault(customer.tribe, {})[customer] = None
+
+    def _unindex(self, customer: Customer):
+        self._discard(self._by_id_int, customer.discordIDint, customer)
+        for field in self.ALIAS_FIELDS:
+            value = getattr(customer, field)
+            if value is not None:
+                self._discard(self._by_alias[field], str(value).lower(), customer)
+                if self._names is not None:
+                    self._names.remove(str(value))
+        self._leave_tribe(customer.tribe, customer)
+
+    def _leave_tribe(self, tribe, customer):
+        members = self._by_tribe.get(tribe)
+        if members is None:
+            return
+        members.pop(customer, None)
+        if not members:
+            del self._by_tribe[tribe]
+
+    @staticmethod
+    def _discard(index, key, customer):
+        matches = index.get(key)
+        if matches is None:
+            return
+        matches.remove(customer)
+        if not matches:
+            del index[key]
+
+    def get(self, discordIDstr: str) -> Customer | None:
+        # exact lookup by discord username only, used where the customer has to be pinned down unambiguously (e.g. the journal)
+        matches = self._by_alias['discordIDstr'].get(discordIDstr.lower())
+        return matches[0] if matches else None
+
+    def tribe(self, tribe: str | None) -> list[Customer]:
+        # a tribe's members (customers without one are under None)
+        return list(self._by_tribe.get(tribe, ()))
+
+    def tribes(self) -> list[str | None]:
+        return list(self._by_tribe)
+
+    @property
+    def names(self) -> NameIndex:
+        if self._names is None:
+            self._names = NameIndex(str(getattr(customer, field)) for customer in self._customers for field in self.ALIAS_FIELDS
+                                    if getattr(customer, field) is not None)
+        return self._names
+
+    def suggest(self, user_identifier, limit: int = 3) -> list[str]:
+        # the aliases most like user_identifier, for when nobody goes by it; only the closest one of each customer's
+        suggestions = []
+        seen = set()
+        for alias in self.names.suggest(str(user_identifier), limit * len(self.ALIAS_FIELDS)):
+            matches = [customer for field in self.ALIAS_FIELDS for customer in self._by_alias[field].get(alias.lower(), ())]
+            if any(customer not in seen for customer in matches):
+                suggestions.append(alias)
+                seen.update(matches)
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+    def find(self, user_identifier) -> Customer | None:
+        matches = self._by_id_int.get(user_identifier) if isinstance(user_identifier, int) else None
+        if not matches and isinstance(user_identifier, str):
+            key = user_identifier.lower()
+            matches = self._by_alias['discordIDstr'].get(key)
+            if not matches:
+                # one customer's real name can be another's nickname, that's as ambiguous as two customers with the same real name
+                matches = list(dict.fromkeys(customer for field in self.ALIAS_FIELDS[1:] for customer in self._by_alias[field].get(key, ())))
+        if not matches:
+            return None
+        if len(matches) > 1:
+            raise AmbiguousCustomerError(user_identifier, matches)
+        return matches[0]
+
 class Shop:
-    def __init__(self, prefix: str, backup_folder: str | None = None, from_backup: bool = False, import_items_from_folder: str | None = None):
-        self.inventory = []
-        self.customers = []
+    def __init__(self, prefix: str, backup_folder: str | None = None, from_backup: bool = False, import_items_from_folder: str | None = None, storage: Storage | None = None):
+        self.inventory = Catalog()
+        self.customers = CustomerRegistry()
         self.backup_folder = backup_folder
         self.name = "Carl Nook"
         self.prefix = prefix
+        self.seq = 0 # number of the last recorded change reflected in the shop
+        self._replaying = False
+        self.locks = LockTable() # see transactions.transaction, for commands that wait on something before changing the shop
+        self.storage = storage or JsonStorage(backup_folder or DEFAULT_BACKUP_FOLDER_NAME)
+        self.storage.attach(self)
         if from_backup:
             self.restore()
         if import_items_from_folder:
             self.import_items_from_folder(import_items_from_folder)
             
     def restore(self):
-        backup_folder = self.backup_folder or DEFAULT_BACKUP_FOLDER_NAME
-        if backup_folder and os.path.exists(backup_folder):
-            backup_files = [f for f in os.listdir(backup_folder) if f.startswith("shop_backup") and f.endswith(".json")]
-            if backup_files:
-                latest_backup = max(backup_files, key=lambda f: os.path.getctime(os.path.join(backup_folder, f)))
-                self.load_backup(os.path.join(backup_folder, latest_backup))
-                print(f"Loaded backup from {latest_backup}")
-            else:
-                print("No backup files found. Starting with an empty shop.")
-
-    def backup(self, backup_folder: str = DEFAULT_BACKUP_FOLDER_NAME):
-        backup_data = {
-            'inventory': [vars(item) for item in self.inventory],
-            'customers': [{'servernickname': customer.servernickname,
-                           'discordIDstr': customer.discordIDstr,
-                           'realname': customer.realname,
-                           'discordIDint': customer.discordIDint,
-                           'tribe': customer.tribe,
-                           'wealth': customer.wealth, 
-                           'inventory': [vars(item) for item in customer.inventory]
-                           } for customer in self.customers]
+        self.storage.load(self)
+
+    def restore_from(self, backup_file_path: str):
+        # deliberately going back to an older backup: changes recorded since shouldn't be replayed on top of it
+        manifest = backups.manifest_for(os.path.dirname(backup_file_path))
+        entry = manifest.get(os.path.basename(backup_file_path))
+        if entry is not None and not manifest.verify(entry):
+            raise ValueError(f"Backup {entry['file']} doesn't match its checksum, it may be corrupted.")
+        self.load_backup(backup_file_path)
+        self.storage.reset(self)
+        self.backup()
+
+    def _record(self, op: str, customers = (), items = (), **fields):
+        # every change to the shop ends here, so storage can save it (customers and items are what it touched)
+        if self._replaying:
+            return
+        self.seq += 1
+        self.storage.record(self, {'seq': self.seq, 'op': op, **fields}, customers, items)
+
+    def apply(self, record: dict):
+        # redoes a journaled change, going through the same methods that made it the first time
+        op = record['op']
+        customer = self.customers.get(record['customer']) if 'customer' in record else None
+        if op == 'stock':
+            self.stock(Item(**record['item']))
+        elif op == 'remove_item':
+            self.remove_all_of(self.inventory.get(record['item']))
+        elif op == 'set_quantity':
+            self.change_quantity(self.inventory.get(record['item']), record['quantity'])
+        elif op == 'clear_inventory':
+            self.clear_inventory()
+        elif op == 'add_customer':
+            self.add_customer(Customer.from_dict(record['data']))
+        elif op == 'remove_customer':
+            self.remove_customer(customer)
+        elif op == 'swap_tribe':
+            self.swap_tribe(customer, record['tribe'])
+        elif op == 'clear_customers':
+            self.clear_customers()
+        elif op == 'move_money':
+            self.move_money(customer, record['amount'])
+        elif op == 'move_money_tribe':
+            self.move_money_tribe(record['tribe'], record['amount'])
+        elif op == 'grant_tribe':
+            self.grant_tribe(record['tribe'], Item(**record['item']))
+        elif op == 'rename_tribe':
+            self.rename_tribe(record['tribe'], record['new_tribe'])
+        elif op == 'buy':
+            self.attemptBuy(customer.discordIDstr, record['item'])
+        elif op == 'use':
+            self.use(customer, record['item'])
+        elif op == 'give':
+            self.give(customer, record['item'], self.customers.get(record['recipient']), record['quantity'])
+        elif op == 'add_customer_item':
+            self.add_customer_item(customer, Item(**record['item']))
+        elif op == 'remove_customer_item':
+            self.remove_customer_item(customer, record['item'])
+        elif op == 'upsert':
+            self.upsert(record['items_data'], record['customers_data'])
+        elif op == 'import':
+            self.import_batch([Item(**item) for item in record['items_data']], [Customer.from_dict(data) for data in record['customers_data']])
+        else:
+            raise ValueError(f"Unknown journal entry '{op}'.")
+
+    def snapshot(self) -> dict:
+        # copies the shop's state into plain data, so it can be written out while the shop keeps changing
+        # each item's details are written once under 'definitions', every stack of it refers to them by index
+        definition_ids = {}
+        inventory = [{'item': definition_ids.setdefault(item.definition, len(definition_ids)), 'quantity': item.quantity} for item in self.inventory]
+        customers = [customer.to_dict(definition_ids) for customer in self.customers]
+        return {
+            'journal_seq': self.seq,
+            'definitions': [definition.to_dict() for definition in definition_ids],
+            'inventory': inventory,
+            'customers': customers
         }
-        if not os.path.exists(backup_folder):
-            os.makedirs(backup_folder)
-        # get timestamp for EST time zone (UTC-5)
-        timestamp = (discord.utils.utcnow() + timedelta(hours=-5)).strftime('%Y-%m-%d_%H:%M:%S')
-        backup_file_path = os.path.join(backup_folder, f'shop_backup_{timestamp}.json')
-        with open(backup_file_path, 'w') as file:
-            json.dump(backup_data, file, indent=4)
+
+    @metrics.timed('backup')
+    def backup(self, backup_folder: str | None = None) -> tuple[str, int]:
+        backup_folder = backup_folder or self.backup_folder or DEFAULT_BACKUP_FOLDER_NAME
+        backup_data = self.snapshot()
+        entry = backups.write_backup(backup_data, backup_folder, backups.backup_file_name(discord.utils.utcnow(), BACKUP_FORMAT))
+        return self._backed_up(backup_data, backup_folder, entry)
+
+    async def backup_async(self, backup_folder: str | None = None) -> tuple[str, int]:
+        # only the snapshot is taken on the event loop, serializing and writing happen in a worker thread
+        backup_folder = backup_folder or self.backup_folder or DEFAULT_BACKUP_FOLDER_NAME
+        with metrics.span('snapshot'):
+            backup_data = self.snapshot()
+        with metrics.span('backup_async'):
+            entry = await asyncio.to_thread(backups.write_backup, backup_data, backup_folder, backups.backup_file_name(discord.utils.utcnow(), BACKUP_FORMAT))
+            return self._backed_up(backup_data, backup_folder, entry)
+
+    def _backed_up(self, backup_data: dict, backup_folder: str, entry: dict) -> tuple[str, int]:
+        backup_file_path = os.path.join(backup_folder, entry['file'])
         print(f"Shop state backed up to {backup_file_path}")
+        manifest = backups.manifest_for(backup_folder)
+        manifest.record(entry)
+        pruned = manifest.prune(BACKUP_RETENTION)
+        if pruned:
+            print(f"Pruned {len(pruned)} old backups: {', '.join(pruned)}")
+        self.storage.backed_up(self, backup_data['journal_seq'])
+        return backup_file_path, entry['size']
 
+    @metrics.timed('load_backup')
     def load_backup(self, backup_file_path: str):
-        with open(backup_file_path, 'r') as file:
-            data = json.load(file)
-            self.inventory = [Item(**item) for item in data.get('inventory', [])]
-            self.customers = []
-            for customer_data in data.get('customers', []):
-                customer = Customer(
-                    servernickname = customer_data['servernickname'],
-                    discordIDstr = customer_data['discordIDstr'],
-                    realname = customer_data['realname'],
-                    discordIDint = customer_data['discordIDint'],
-                    tribe = customer_data.get('tribe'),
-                    wealth = customer_data['wealth']
-                )
-                customer.inventory = [Item(**item) for item in customer_data.get('inventory', [])]
-                self.customers.append(customer)
+        # streams either backup format in; customers from .jsonl.gz backups only unpack their inventories once they're looked at
+        self.load_records(backups.iter_backup(backup_file_path))
+
+    def load_records(self, records):
+        # records as given by backups.iter_backup: a header, then item definitions (in backups that share them), items and customers
+        header = next(records)[1]
+        # refill rather than replace the collections, so their version numbers keep counting up
+        self.inventory.clear()
+        self.customers.clear()
+        definitions = [] # in the order the backup's stacks refer to them by
+        for record in records:
+            if record[0] == 'definition':
+                definitions.append(define(**record[1]))
+            elif record[0] == 'item':
+                self._load_stock(Item.from_dict(record[1], definitions))
+            else:
+                self.customers.add(Customer.from_dict(record[1], raw_inventory=record[2], definitions=definitions))
+        self.seq = header.get('journal_seq', 0)
+
+    def _load_stock(self, item: Item):
+        # backups written before the catalog was keyed by name can list an item more than once, its stacks are merged into the first
+        stocked = self.inventory.get(item.name)
+        if stocked is None:
+            self.inventory.add(item)
+            return
+        print(f"The backup lists {item.name} more than once, adding its {item.quantity} to the {stocked.quantity} already loaded.")
+        self.inventory.set_quantity(item.name, stocked.quantity + item.quantity)
+
+    def tribe_totals(self) -> list[tuple[str | None, int, int]]:
+        # (tribe, members, total wealth) for every tribe
+        return self.storage.tribe_totals(self)
+
+    def tribe_inventory(self, tribe: str | None) -> dict[str, int]:
+        # item name -> how many the tribe's members hold between them
+        totals = {}
+        for customer in self.customers.tribe(tribe):
+            for item in customer.inventory:
+                totals[item.name] = totals.get(item.name, 0) + item.quantity
+        return totals
+
+    def owners_of(self, item_name: str) -> list[tuple[str, int]]:
+        # (customer's real name, how many they have) for everyone holding the item
+        return self.storage.owners_of(self, item_name)
 
     def stock(self, item: Item):
-        self.inventory.append(item)
+        # raises ValueError if an item by that name is already in stock
+        self.inventory.add(item)
+        self._record('stock', items=(item.name,), item=item.to_dict())
         
     def populate(self, customers):
         if isinstance(customers, Customer):
-            if customers not in self.customers:
-                self.customers.append(customers)
+            self.add_customer(customers)
         elif isinstance(customers, dict):
             for customer in customers.values():
-                if customer not in self.customers:
-                    self.customers.append(customer)
+                self.add_customer(customer)
 
-    def remove_one_of(self, item: Item):
-        item.quantity += -1
+    def import_batch(self, items = (), customers = ()):
+        # adds a whole import as one change, so it's all there or none of it is (see importer.py)
+        # raises ValueError, before changing anything, if an item is already stocked or a customer already registered
+        items, customers = list(items), list(customers)
+        for item in items:
+            if item.name in self.inventory:
+                raise ValueError(f"The shop already stocks an item called {self.inventory.get(item.name).name}.")
+        for customer in customers:
+            if self.customers.get(customer.discordIDstr) is not None:
+                raise ValueError(f"{customer.discordIDstr} is already registered as a customer.")
+        for item in items:
+            self.inventory.add(item)
+        for customer in customers:
+            self.customers.add(customer)
+        self._record('import', customers=customers, items=[item.name for item in items],
+                     items_data=[item.to_dict() for item in items], customers_data=[customer.to_dict() for customer in customers])
+
+    def upsert(self, items = (), customers = ()):
+        # one change that adds or updates a batch of items and customers (see foldersync.py)
+        # each is a dict: the full details for one that isn't in the shop yet, otherwise its name/discordIDstr and just the fields to change
+        # (with a customer's wealth and inventory changed by 'wealth_change' and 'inventory_changes', see Inventory.adjust, rather than replaced)
+        items, customers = list(items), list(customers)
+        touched = []
+        for data in items:
+            if data['name'] in self.inventory:
+                self.inventory.update(data['name'], data)
+            else:
+                self.inventory.add(Item(**data))
+        for data in customers:
+            customer = self.customers.get(data['discordIDstr'])
+            if customer is None:
+                customer = Customer.from_dict(data)
+                self.customers.add(customer)
+            else:
+                for field, value in data.items():
+                    if field == 'inventory':
+                        customer.inventory = Inventory(Item(**item) for item in value)
+                    elif field == 'inventory_changes':
+                        customer.inventory.adjust(value)
+                    elif field == 'wealth_change':
+                        customer.wealth = (customer.wealth or 0) + value
+                    elif field != 'discordIDstr':
+                        setattr(customer, field, value)
+            touched.append(customer)
+        self._record('upsert', customers=touched, items=[data['name'] for data in items], items_data=items, customers_data=customers)
+
+    def add_customer(self, customer: Customer):
+        if customer in self.customers:
+            return
+        self.customers.add(customer)
+        self._record('add_customer', customers=(customer,), data=customer.to_dict())
+
+    def remove_customer(self, customer: Customer):
+        self.customers.remove(customer)
+        self._record('remove_customer', customers=(customer,), customer=customer.discordIDstr)
+
+    def swap_tribe(self, customer: Customer, newTribe: str | None):
+        customer.tribe = newTribe
+        self._record('swap_tribe', customers=(customer,), customer=customer.discordIDstr, tribe=newTribe)
+
+    def clear_customers(self):
+        self.customers.clear()
+        self._record('clear_customers')
+
+    def move_money(self, customer: Customer, howMuch: int):
+        customer.wealth += howMuch
+        self._record('move_money', customers=(customer,), customer=customer.discordIDstr, amount=howMuch)
+
+    def move_money_tribe(self, tribe: str, howMuch: int):
+        members = self.customers.tribe(tribe)
+        for customer in members:
+            customer.wealth += howMuch
+        self._record('move_money_tribe', customers=members, tribe=tribe, amount=howMuch)
+
+    def grant_tribe(self, tribe: str, item: Item) -> list[Customer]:
+        # gives every member of the tribe their own copy of item, returns who got one
+        # raises ValueError, before changing anything, if item isn't at least one of something
         if item.quantity < 1:
-            self.inventory.remove(item)
+            raise ValueError(f"Can't hand out {item.quantity}x {item.name}, it has to be at least 1.")
+        members = self.customers.tribe(tribe)
+        for customer in members:
+            customer.add_item(item.copy())
+        self._record('grant_tribe', customers=members, tribe=tribe, item=item.to_dict())
+        return members
+
+    def rename_tribe(self, tribe: str, newTribe: str) -> list[Customer]:
+        # moves everyone in tribe over to newTribe, merging the two if newTribe already has members; returns who moved
+        members = self.customers.tribe(tribe)
+        for customer in members:
+            customer.tribe = newTribe
+        self._record('rename_tribe', customers=members, tribe=tribe, new_tribe=newTribe)
+        return members
+
+    def use(self, customer: Customer, item_name: str) -> str:
+        version = customer.version
+        result = customer.use(item_name)
+        if customer.version != version:
+            self._record('use', customers=(customer,), customer=customer.discordIDstr, item=item_name)
+        return result
+
+    def give(self, customer: Customer, item_name: str, recipient: Customer, quantity: int = 1) -> str:
+        version = customer.version
+        result = customer.give(item_name, recipient, quantity)
+        if customer.version != version:
+            self._record('give', customers=(customer, recipient), customer=customer.discordIDstr, item=item_name, recipient=recipient.discordIDstr, quantity=quantity)
+        return result
+
+    def add_customer_item(self, customer: Customer, item: Item):
+        record = item.to_dict() # taken now, the stack it merges into changes
+        customer.add_item(item)
+        self._record('add_customer_item', customers=(customer,), customer=customer.discordIDstr, item=record)
+
+    def remove_customer_item(self, customer: Customer, item_name: str):
+        customer.inventory.remove(item_name)
+        self._record('remove_customer_item', customers=(customer,), customer=customer.discordIDstr, item=item_name)
+
+    def remove_one_of(self, item: Item):
+        self.inventory.decrement(item.name)
     
     def remove_all_of(self, item: Item):
-        self.inventory.remove(item)
+        self.inventory.remove(item.name)
+        self._record('remove_item', items=(item.name,), item=item.name)
 
+    def change_quantity(self, item: Item, new_quantity: int):
+        self.inventory.set_quantity(item.name, new_quantity)
+        self._record('set_quantity', items=(item.name,), item=item.name, quantity=new_quantity)
+
+    def clear_inventory(self):
+        self.inventory.clear()
+        self._record('clear_inventory')
+
+    @metrics.timed('attemptBuy')
     def attemptBuy(self, customer_id, requestedItemName: str) -> str:
 
         # gets internal customer object from user asking to buy
@@ -165,71 +849,94 @@ class Shop:
         wealth = customer.wealth
         def canAfford(itemPrice, wealth): return wealth >= itemPrice
         
-        for item in self.inventory:
-            if item.name.lower() == requestedItemName.lower():
-                if canAfford(item.price, wealth):
-                    customer.buy(item.copy())
-                    self.remove_one_of(item)
-                    return "Thank you for your patronage! One quotebook entry coming up!\n" + f"*Your pockets are now heavy with items. You reach for your gold pouch eager to buy more, but feel nothing inside. **Your gold supply drops to 0g.***" if customer.wealth == 0 else f"*You feel your pockets get slightly heavier, and your gold supply drop to {customer.wealth}g*"
-                else:
-                    return f"It seems you're a bit too low on funds for that purchase by about {item.price - wealth}g... Perhaps another ware catches your eye? Maybe one a bit... cheaper?"
-        return f"Doesn't look like we sell anything by the name of {requestedItemName}, exactly... did you misspell it?"
+        item = self.inventory.get(requestedItemName)
+        if item is None:
+            return f"Doesn't look like we sell anything by the name of {requestedItemName}, exactly... {did_you_mean(self.inventory.suggest(requestedItemName))}"
+        if canAfford(item.price, wealth):
+            customer.buy(item.copy())
+            self.remove_one_of(item)
+            self._record('buy', customers=(customer,), items=(item.name,), customer=customer.discordIDstr, item=item.name)
+            return "Thank you for your patronage! One quotebook entry coming up!\n" + f"*Your pockets are now heavy with items. You reach for your gold pouch eager to buy more, but feel nothing inside. **Your gold supply drops to 0g.***" if customer.wealth == 0 else f"*You feel your pockets get slightly heavier, and your gold supply drop to {customer.wealth}g*"
+        else:
+            return f"It seems you're a bit too low on funds for that purchase by about {item.price - wealth}g... Perhaps another ware catches your eye? Maybe one a bit... cheaper?"
     
+    @property
+    def version(self) -> int:
+        # the catalog and registry never get swapped out, so the sum only ever goes up
+        return self.inventory.version + self.customers.version
+
+    @metrics.timed('print_customers')
     def print_customers(self, verbose = False, tribe = None):
-        output = "Customers:\n"
-        for customer in self.customers:
-            if tribe and customer.tribe != tribe:
-                continue
-            output += f"* {customer.realname} (\"{customer.servernickname}\")" 
+        return render_cache.get('customers', self, self.customers.version, (verbose, tribe), lambda: self._render_customers(verbose, tribe))
+
+    def customer_pages(self, verbose = False, tribe = None) -> Pages:
+        return render_cache.get('customer pages', self, self.customers.version, (verbose, tribe), lambda: Pages(self._customer_blocks(verbose, tribe)))
+
+    def _render_customers(self, verbose, tribe):
+        return "".join(self._customer_blocks(verbose, tribe))
+
+    def _customer_blocks(self, verbose, tribe):
+        yield "Customers:\n"
+        for customer in (self.customers.tribe(tribe) if tribe else self.customers):
+            line = f"* {customer.realname} (\"{customer.servernickname}\")"
             if verbose:
-                output += f" (strID: {customer.discordIDstr}, intID: {customer.discordIDint}, Wealth: {customer.wealth}g, Tribe: {customer.tribe})"
-            output += "\n"
-        return output
+                line += f" (strID: {customer.discordIDstr}, intID: {customer.discordIDint}, Wealth: {customer.wealth}g, Tribe: {customer.tribe})"
+            yield line + "\n"
     
+    @metrics.timed('display')
     def display(self):
-        output = f'~~' + " " * 10 + "~~\n"
+        return render_cache.get('display', self, self.inventory.version, (), self._render_display)
+
+    def display_pages(self, header: str = "") -> Pages:
+        return render_cache.get('display pages', self, self.inventory.version, (header,), lambda: Pages(self._display_blocks(), header=header))
+
+    def _render_display(self):
+        return "".join(self._display_blocks())
+
+    def _display_blocks(self):
+        yield f'~~' + " " * 10 + "~~\n"
         for item in self.inventory:
-             output += f"- {item.quantity}x {item.name} - {item.price}g \n{"\n".join([f"-# *{item}*" for item in item.description.split('\n')]) if item.description else ""}\n"
-        if self.inventory == []:
-            output += "[We're sold out!]\n"
-        output += f'~~' + " " * 10 + "~~\n"
-        if self.inventory != []:
-            output += f"*To buy an item, use the command {COMMAND_PREFIX}buy \"<item name>\".*"
-        return output
+            yield f"- {item.quantity}x {item.name} - {item.price}g \n{"\n".join([f"-# *{item}*" for item in item.description.split('\n')]) if item.description else ""}\n"
+        if not self.inventory:
+            yield "[We're sold out!]\n"
+        yield f'~~' + " " * 10 + "~~\n"
+        if self.inventory:
+            yield f"*To buy an item, use the command {self.prefix}buy \"<item name>\".*"
 
+    @metrics.timed('str_detailed_summary')
     def str_detailed_summary(self):
-        output = ""
-        output += f"> Timestamp: {discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n"
-        output += "**Shop Inventory:**"
+        return self._summary_timestamp() + render_cache.get('summary', self, self.version, (), self._render_summary)
+
+    def summary_pages(self) -> Pages:
+        return Pages(self._summary_blocks(), header=self._summary_timestamp())
+
+    def _summary_timestamp(self) -> str:
+        return f"> Timestamp: {discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n"
+
+    def _render_summary(self):
+        return "".join(self._summary_blocks())
+
+    def _summary_blocks(self):
+        yield "**Shop Inventory:**"
         if len(self.inventory) == 0:
-            output += "  - (Out of Stock)\n"
+            yield "  - (Out of Stock)\n"
         for item in self.inventory:
-            output += f"  - {item.quantity}x {item.name} ({item.price}g)\n"
-            if item.description:
-                output += f"    Description: {item.description}\n"
-        output += "Customers:"
+            yield f"  - {item.quantity}x {item.name} ({item.price}g)\n" + (f"    Description: {item.description}\n" if item.description else "")
+        yield "Customers:"
         if len(self.customers) == 0:
-            output += "  - (No Current Customers)\n"
+            yield "  - (No Current Customers)\n"
         for customer in self.customers:
-            output += f"  - {customer.realname} (id: {customer.discordIDstr}, wealth: {customer.wealth}g)\n"
+            block = [f"  - {customer.realname} (id: {customer.discordIDstr}, wealth: {customer.wealth}g)\n"]
             if customer.inventory:
-                output += "    Inventory:\n"
+                block.append("    Inventory:\n")
                 for item in customer.inventory:
-                    output += f"      - {item.quantity}x {item.name}\n"
+                    block.append(f"      - {item.quantity}x {item.name}\n")
                     if item.description:
-                        output += f"        Description: {item.description}\n"
-        output += "-" * 20
-        return output
+                        block.append(f"        Description: {item.description}\n")
+            yield "".join(block)
+        yield "-" * 20
 
+@metrics.timed('id_to_customer')
 def id_to_customer(shop: Shop, user_identifier: str) -> Customer:
-    for customer in shop.customers:
-        if customer.discordIDint == user_identifier:
-            return customer
-        elif customer.discordIDstr.lower() == user_identifier.lower():
-            return customer
-        elif customer.realname.lower() == user_identifier.lower():
-            return customer
-        elif customer.servernickname.lower() == user_identifier.lower():
-            return customer
-    # not in database :(
-    return None
\ No newline at end of file
+    # returns None if not in database :( and raises AmbiguousCustomerError if the identifier fits several customers
+    return shop.customers.find(user_identifier)
\ No newline at end of file
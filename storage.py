@@ -0,0 +1,248 @@
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+
+import backups
+from journal import Journal
+
+class Storage(ABC):
+    # where a Shop's state lives between restarts; the shop reports every change to it as it happens
+    def attach(self, shop):
+        # called once when the shop is created, before anything is loaded
+        pass
+
+    @abstractmethod
+    def load(self, shop):
+        # brings the shop back to its last saved state
+        ...
+
+    @abstractmethod
+    def record(self, shop, record: dict, customers = (), items = ()):
+        # called after every change, with the change itself plus the customers and shop item names it touched
+        ...
+
+    def backed_up(self, shop, seq: int):
+        # called once a backup file covering every change up to seq has been written
+        pass
+
+    @abstractmethod
+    def reset(self, shop):
+        # called after the shop was deliberately set to some other state (e.g. an older backup): save that state as-is
+        ...
+
+    def close(self):
+        pass
+
+    # questions about the whole shop; answered by walking memory here, backends with indexes can do better
+    def tribe_totals(self, shop) -> list[tuple[str | None, int, int]]:
+        return [(tribe, len(members), sum(customer.wealth or 0 for customer in members))
+                for tribe, members in ((tribe, shop.customers.tribe(tribe)) for tribe in shop.customers.tribes())]
+
+    def owners_of(self, shop, item_name: str) -> list[tuple[str, int]]:
+        return [(customer.realname, customer.inventory.get(item_name).quantity) for customer in shop.customers if item_name in customer.inventory]
+
+class JsonStorage(Storage):
+    # the newest backup file in a folder, plus a journal of every change made since it was written
+    def __init__(self, backup_folder: str, journal_path: str | None = None, fsync: bool = False):
+        self.backup_folder = backup_folder
+        self.journal = Journal(journal_path, fsync=fsync) if journal_path else None
+
+    def attach(self, shop):
+        if self.journal is not None:
+            shop.seq = self.journal.last_seq
+
+    def load(self, shop):
+        if os.path.exists(self.backup_folder):
+            manifest = backups.manifest_for(self.backup_folder)
+            for entry in manifest.recent(len(manifest)):
+                if manifest.verify(entry):
+                    shop.load_backup(os.path.join(self.backup_folder, entry['file']))
+                    print(f"Loaded backup from {entry['file']}")
+                    break
+                print(f"Skipped backup {entry['file']}, it's missing or doesn't match its checksum.")
+            else:
+                print("No backup files found. Starting with an empty shop.")
+                shop.inventory.clear()
+                shop.customers.clear()
+                shop.seq = 0
+        self.replay(shop)
+
+    def replay(self, shop):
+        if self.journal is None:
+            return
+        replayed = 0
+        shop._replaying = True
+        try:
+            for record in self.journal.records():
+                if record['seq'] > shop.seq:
+                    try:
+                        shop.apply(record)
+                        replayed += 1
+                    except Exception as e: # e.g. an older backup was loaded because the newest one was corrupted
+                        print(f"Couldn't replay journal entry {record}... {e}")
+                    shop.seq = record['seq']
+        finally:
+            shop._replaying = False
+        if replayed:
+            print(f"Replayed {replayed} journaled changes since the last backup.")
+
+    def record(self, shop, record: dict, customers = (), items = ()):
+        if self.journal is not None:
+            self.journal.append(record)
+
+    def backed_up(self, shop, seq: int):
+        if self.journal is not None:
+            self.journal.compact(seq)
+
+    def reset(self, shop):
+        # skip past everything journaled so far, none of it applies to the new state; the caller backs it up right after
+        if self.journal is not None:
+            shop.seq = self.journal.last_seq
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+class SqliteStorage(Storage):
+    # a local SQLite database (WAL mode) kept up to date one transaction per change, with indexes for whole-shop questions
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS items (
+            item_key TEXT PRIMARY KEY, -- lowercased name
+            quantity INTEGER,
+            price INTEGER,
+            data TEXT NOT NULL -- the item as it's written in backups
+        );
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_key TEXT PRIMARY KEY, -- lowercased discordIDstr
+            tribe TEXT,
+            wealth INTEGER,
+            data TEXT NOT NULL -- the customer as it's written in backups, minus their inventory
+        );
+        CREATE INDEX IF NOT EXISTS customers_by_tribe ON customers (tribe);
+        CREATE TABLE IF NOT EXISTS inventory (
+            customer_key TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            item_key TEXT NOT NULL,
+            quantity INTEGER,
+            data TEXT NOT NULL,
+            PRIMARY KEY (customer_key, position)
+        );
+        CREATE INDEX IF NOT EXISTS inventory_by_item ON inventory (item_key);
+    '''
+
+    def __init__(self, path: str, backup_folder: str | None = None, journal_path: str | None = None):
+        self.path = path
+        self.backup_folder = backup_folder # where to import from the first time, when switching over from JSON storage
+        self.journal_path = journal_path
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def _meta(self, key: str, default = None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key: str, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, json.dumps(value)))
+
+    def load(self, shop):
+        if not self._meta('initialized', False):
+            if self.backup_folder is not None:
+                print(f"Setting up {self.path} from the JSON backups in {self.backup_folder}...")
+                json_storage = JsonStorage(self.backup_folder, self.journal_path)
+                json_storage.attach(shop)
+                json_storage.load(shop)
+                json_storage.close()
+            self.reset(shop)
+            return
+        shop.load_records(self.iter_records())
+        print(f"Loaded shop from {self.path}")
+
+    def iter_records(self):
+        # the database's contents in the same shape backups.iter_backup gives
+        yield ('header', {'journal_seq': self._meta('seq', 0)})
+        for (data,) in self.conn.execute("SELECT data FROM items ORDER BY rowid"):
+            yield ('item', json.loads(data))
+        inventories = {}
+        for customer_key, data in self.conn.execute("SELECT customer_key, data FROM inventory ORDER BY customer_key, position"):
+            inventories.setdefault(customer_key, []).append(data)
+        for customer_key, data in self.conn.execute("SELECT customer_key, data FROM customers ORDER BY rowid"):
+            yield ('customer', json.loads(data), "[" + ",".join(inventories.get(customer_key, [])) + "]")
+
+    def record(self, shop, record: dict, customers = (), items = ()):
+        with self.conn: # everything one change touched is committed together, or not at all
+            if record['op'] == 'clear_inventory':
+                self.conn.execute("DELETE FROM items")
+            elif record['op'] == 'clear_customers':
+                self.conn.execute("DELETE FROM customers")
+                self.conn.execute("DELETE FROM inventory")
+            for customer in customers:
+                if customer in shop.customers:
+                    self._write_customer(customer)
+                else:
+                    self._delete_customer(customer.discordIDstr.lower())
+            for item_name in items:
+                item = shop.inventory.get(item_name)
+                if item is not None:
+                    self._write_item(item)
+                else:
+                    self.conn.execute("DELETE FROM items WHERE item_key = ?", (item_name.lower(),))
+            self._set_meta('seq', record['seq'])
+
+    def reset(self, shop):
+        with self.conn:
+            self.conn.execute("DELETE FROM items")
+            self.conn.execute("DELETE FROM customers")
+            self.conn.execute("DELETE FROM inventory")
+            for item in shop.inventory:
+                self._write_item(item)
+            for customer in shop.customers:
+                self._write_customer(customer)
+            self._set_meta('seq', shop.seq)
+            self._set_meta('initialized', True)
+
+    def _write_item(self, item):
+        self.conn.execute("INSERT INTO items (item_key, quantity, price, data) VALUES (?, ?, ?, ?) " \
+                          "ON CONFLICT (item_key) DO UPDATE SET quantity = excluded.quantity, price = excluded.price, data = excluded.data",
+                          (item.name.lower(), item.quantity, item.price, json.dumps(item.to_dict())))
+
+    def _write_customer(self, customer):
+        data = customer.to_dict()
+        inventory = data.pop('inventory')
+        key = customer.discordIDstr.lower()
+        self.conn.execute("INSERT INTO customers (customer_key, tribe, wealth, data) VALUES (?, ?, ?, ?) " \
+                          "ON CONFLICT (customer_key) DO UPDATE SET tribe = excluded.tribe, wealth = excluded.wealth, data = excluded.data",
+                          (key, customer.tribe, customer.wealth, json.dumps(data)))
+        self.conn.execute("DELETE FROM inventory WHERE customer_key = ?", (key,))
+        self.conn.executemany("INSERT INTO inventory (customer_key, position, item_key, quantity, data) VALUES (?, ?, ?, ?, ?)",
+                              [(key, position, item['name'].lower(), item['quantity'], json.dumps(item)) for position, item in enumerate(inventory)])
+
+    def _delete_customer(self, key: str):
+        self.conn.execute("DELETE FROM customers WHERE customer_key = ?", (key,))
+        self.conn.execute("DELETE FROM inventory WHERE customer_key = ?", (key,))
+
+    def tribe_totals(self, shop) -> list[tuple[str | None, int, int]]:
+        return self.conn.execute("SELECT tribe, COUNT(*), COALESCE(SUM(wealth), 0) FROM customers GROUP BY tribe ORDER BY MIN(rowid)").fetchall()
+
+    def owners_of(self, shop, item_name: str) -> list[tuple[str, int]]:
+        rows = self.conn.execute("SELECT customers.data, inventory.quantity FROM inventory JOIN customers USING (customer_key) " \
+                                 "WHERE inventory.item_key = ? ORDER BY customers.rowid", (item_name.lower(),))
+        return [(json.loads(data)['realname'], quantity) for data, quantity in rows]
+
+    def close(self):
+        self.conn.close()
+
+def open_storage(kind: str, backup_folder: str, journal_file_name: str, sqlite_file_name: str, fsync: bool = False) -> Storage:
+    # kind is STORAGE_BACKEND from the config
+    journal_path = os.path.join(backup_folder, journal_file_name)
+    if kind == "sqlite":
+        return SqliteStorage(os.path.join(backup_folder, sqlite_file_name), backup_folder=backup_folder, journal_path=journal_path)
+    if kind == "json":
+        return JsonStorage(backup_folder, journal_path, fsync=fsync)
+    raise ValueError(f"Unknown storage backend '{kind}', pick 'json' or 'sqlite'.")
@@ -0,0 +1,128 @@
+'''
+Fires thousands of interleaved buy/give/move_money/remove_customer commands at a throwaway shop, all going through
+transactions.transaction the way bot.py does, then checks no gold or stock appeared or vanished along the way.
+
+usage: python stress.py [operations] [customers] [items]
+'''
+
+import asyncio
+import importlib.util
+import random
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timezone
+
+if importlib.util.find_spec('config') is None: # no config.py outside a real deployment, the example one has everything the shop needs
+    import EXAMPLE_config
+    sys.modules['config'] = EXAMPLE_config
+
+# the shop only needs discord for the current time, so discord.py doesn't have to be installed (as in benchmarks.py)
+try:
+    import discord
+except ImportError:
+    discord = types.ModuleType('discord')
+    discord.utils = types.ModuleType('discord.utils')
+    discord.utils.utcnow = lambda: datetime.now(timezone.utc)
+    sys.modules['discord'] = discord
+    sys.modules['discord.utils'] = discord.utils
+
+import shop
+import transactions
+from storage import JsonStorage
+
+STARTING_WEALTH = 50
+STARTING_STOCK = 20
+
+def total_gold(stress_shop) -> int:
+    return sum(customer.wealth for customer in stress_shop.customers)
+
+def total_stock(stress_shop) -> int:
+    return sum(item.quantity for item in stress_shop.inventory) + \
+           sum(item.quantity for customer in stress_shop.customers for item in customer.inventory)
+
+async def run(operations: int = 5000, customer_count: int = 40, item_count: int = 10, seed: int = 0):
+    rng = random.Random(seed)
+    folder = tempfile.mkdtemp(prefix="shop_stress_")
+    stress_shop = shop.Shop(prefix="!", storage=JsonStorage(folder))
+    for i in range(item_count):
+        stress_shop.stock(shop.Item(name=f"item{i}", price=rng.randint(1, 15), description=None, description_on_use=None, quantity=STARTING_STOCK))
+    everyone = []
+    for i in range(customer_count):
+        customer = shop.Customer(realname=f"Customer {i}", discordIDstr=f"customer{i}", discordIDint=i, servernickname=None,
+                                 wealth=STARTING_WEALTH, tribe=f"tribe{i % 4}")
+        stress_shop.add_customer(customer)
+        everyone.append(customer)
+    item_names = [item.name for item in stress_shop.inventory]
+    start_gold, start_stock = total_gold(stress_shop), total_stock(stress_shop)
+    ledger = {'moved': 0, 'spent': 0, 'left_gold': 0, 'left_stock': 0, 'conflicts': 0, 'done': 0}
+
+    async def buy():
+        customer, item_name = rng.choice(everyone), rng.choice(item_names)
+        await asyncio.sleep(0)
+        async with transactions.transaction(stress_shop, customers=[customer], items=[item_name]):
+            item = stress_shop.inventory.get(item_name)
+            before = customer.wealth
+            await asyncio.sleep(0) # a command can be suspended while it holds the locks, nobody else may slip in here
+            stress_shop.attemptBuy(customer.discordIDstr, item_name)
+            if customer.wealth != before:
+                ledger['spent'] += item.price
+
+    async def give():
+        customer = rng.choice(everyone)
+        recipient = rng.choice([other for other in everyone if other.tribe == customer.tribe and other is not customer] or [customer])
+        await asyncio.sleep(0) # waiting on the recipient prompt
+        async with transactions.transaction(stress_shop, customers=[customer, recipient]):
+            owned = [item.name for item in customer.inventory]
+            if owned and recipient is not customer:
+                await asyncio.sleep(0)
+                stress_shop.give(customer, rng.choice(owned), recipient)
+
+    async def move_money():
+        # a transfer between two customers, done as two separate changes with a pause between them
+        payer, payee = rng.sample(everyone, 2)
+        amount = rng.randint(1, 10)
+        async with transactions.transaction(stress_shop, customers=[payer, payee]):
+            stress_shop.move_money(payer, -amount)
+            await asyncio.sleep(0)
+            stress_shop.move_money(payee, amount)
+        if rng.random() < 0.2: # and sometimes the hosts hand out gold
+            async with transactions.transaction(stress_shop, customers=[payee]):
+                stress_shop.move_money(payee, amount)
+                ledger['moved'] += amount
+
+    async def remove_customer():
+        customer = rng.choice(everyone)
+        await asyncio.sleep(0) # waiting on the "are you sure" prompt
+        async with transactions.transaction(stress_shop, customers=[customer]):
+            ledger['left_gold'] += customer.wealth
+            ledger['left_stock'] += sum(item.quantity for item in customer.inventory)
+            stress_shop.remove_customer(customer)
+
+    async def attempt(operation):
+        try:
+            await operation()
+            ledger['done'] += 1
+        except transactions.TransactionConflict:
+            ledger['conflicts'] += 1
+
+    kinds = [buy] * 200 + [give] * 100 + [move_money] * 99 + [remove_customer]
+    started = time.perf_counter()
+    await asyncio.gather(*(attempt(rng.choice(kinds)) for _ in range(operations)))
+    elapsed = time.perf_counter() - started
+
+    end_gold, end_stock = total_gold(stress_shop), total_stock(stress_shop)
+    expected_gold = start_gold + ledger['moved'] - ledger['spent'] - ledger['left_gold']
+    expected_stock = start_stock - ledger['left_stock']
+    print(f"{operations} operations in {elapsed:.2f}s ({ledger['done']} done, {ledger['conflicts']} stopped by a conflict), " \
+          f"{len(stress_shop.customers)}/{customer_count} customers left")
+    print(f"Gold: {end_gold} (expected {expected_gold}), stock: {end_stock} (expected {expected_stock})")
+    print(stress_shop.locks.stats())
+    assert end_gold == expected_gold, "gold was created or lost"
+    assert end_stock == expected_stock, "stock was created or lost"
+    assert len(stress_shop.locks) == 0, "locks were left behind"
+    print("Totals conserved.")
+
+if __name__ == "__main__":
+    asyncio.run(run(*(int(arg) for arg in sys.argv[1:4])))
@@ -0,0 +1,56 @@
+'''
+Regression checks for loading backups written by older versions of the shop. Runs offline, no bot needed.
+
+usage: python -m unittest test_backups
+'''
+
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from datetime import datetime, timezone
+
+if importlib.util.find_spec('config') is None: # no config.py outside a real deployment, the example one has everything the shop needs
+    import EXAMPLE_config
+    sys.modules['config'] = EXAMPLE_config
+
+# the shop only needs discord for the current time, so discord.py doesn't have to be installed (as in benchmarks.py)
+try:
+    import discord
+except ImportError:
+    discord = types.ModuleType('discord')
+    discord.utils = types.ModuleType('discord.utils')
+    discord.utils.utcnow = lambda: datetime.now(timezone.utc)
+    sys.modules['discord'] = discord
+    sys.modules['discord.utils'] = discord.utils
+
+import shop
+from storage import JsonStorage
+
+class LegacyBackupTest(unittest.TestCase):
+    def write_backup(self, backup_data: dict) -> str:
+        # a backup as the old bot left it: no manifest, no journal, just the file in the backup folder
+        folder = tempfile.mkdtemp(prefix="shop_legacy_")
+        with open(os.path.join(folder, "shop_backup_2025-02-01_12:00:00.json"), 'w') as file:
+            json.dump(backup_data, file)
+        return folder
+
+    def test_duplicate_stock_entries_are_merged(self):
+        # the old stock/add_folder_items didn't check for an item already being stocked, so one backup could list it twice
+        folder = self.write_backup({
+            'inventory': [{'name': "Rock", 'price': 2, 'quantity': 3, 'description': "A rock.", 'description_on_use': None},
+                          {'name': "Rope", 'price': 5, 'quantity': 1, 'description': None, 'description_on_use': None},
+                          {'name': "rock", 'price': 4, 'quantity': 2, 'description': None, 'description_on_use': None}],
+            'customers': [{'servernickname': "Sam", 'discordIDstr': "sam", 'realname': "Sam", 'discordIDint': 1, 'tribe': "red", 'wealth': 10,
+                           'inventory': [{'name': "Rock", 'quantity': 1, 'description': None, 'description_on_use': None},
+                                         {'name': "Rock", 'quantity': 1, 'description': None, 'description_on_use': None}]}],
+        })
+        legacy_shop = shop.Shop(prefix="!", storage=JsonStorage(folder), from_backup=True)
+        self.assertEqual([(item.name, item.price, item.quantity) for item in legacy_shop.inventory], [("Rock", 2, 5), ("Rope", 5, 1)])
+        self.assertEqual([(item.name, item.price, item.quantity) for item in legacy_shop.customers.get("sam").inventory], [("Rock", 0, 2)])
+
+if __name__ == "__main__":
+    unittest.main()
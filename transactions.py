@@ -0,0 +1,74 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+class TransactionConflict(Exception):
+    # the shop changed underneath a command (or stayed busy too long), so it was stopped before doing anything
+    pass
+
+class LockTable:
+    # asyncio locks per key (a customer or a shop item), made on demand and dropped once nobody holds or waits on them
+    def __init__(self):
+        self._locks = {} # key -> [lock, number of holders + waiters]
+        self.acquired = 0
+        self.waited = 0 # acquisitions that had to queue behind someone else
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, keys, timeout: float | None = None):
+        # keys are always taken in sorted order, so two transactions can't each hold what the other is waiting for
+        held = []
+        try:
+            for key in sorted(set(keys)):
+                entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                if entry[0].locked():
+                    self.waited += 1
+                try:
+                    await asyncio.wait_for(entry[0].acquire(), timeout)
+                except asyncio.TimeoutError:
+                    self._let_go(key)
+                    self.timeouts += 1
+                    raise TransactionConflict("Someone else is busy with that right now... try again in a moment.")
+                except BaseException:
+                    self._let_go(key)
+                    raise
+                held.append(key)
+                self.acquired += 1
+            yield
+        finally:
+            for key in reversed(held):
+                self._locks[key][0].release()
+                self._let_go(key)
+
+    def _let_go(self, key):
+        entry = self._locks[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+    def stats(self) -> str:
+        return f"Locks: {len(self)} in use, {self.acquired} taken, {self.waited} had to wait, {self.timeouts} timed out"
+
+def customer_key(customer) -> tuple:
+    return customer_id_key(customer.discordIDstr)
+
+def customer_id_key(discordIDstr: str) -> tuple:
+    # for customers that might not exist yet
+    return ('customer', discordIDstr.lower())
+
+def item_key(item_name: str) -> tuple:
+    return ('item', item_name.lower())
+
+@asynccontextmanager
+async def transaction(shop, customers = (), items = (), timeout: float | None = None):
+    # holds the customers' and items' locks for the body, after checking the customers weren't removed while the command
+    # was waiting (on a prompt, or on the locks themselves)
+    customers = [customer for customer in customers if customer is not None]
+    async with shop.locks.hold([customer_key(customer) for customer in customers] + [item_key(item_name) for item_name in items], timeout):
+        for customer in customers:
+            if customer not in shop.customers:
+                raise TransactionConflict(f"{customer.realname} isn't a customer anymore, so nothing was changed.")
+        yield